@@ -34,5 +34,32 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', '-created_at'], name='notification_user_read_idx'),
+            models.Index(fields=['user', '-id'], name='notification_user_recent_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored value, so a save can move the unread counter by the change (see accounts.signals)
+        instance._loaded_is_read = instance.is_read if 'is_read' in field_names else None
+        return instance
+
+    def __str__(self):
+        return f"Notification for {self.user.username}"
+
+
+class NotificationCounter(models.Model):
+    """
+    The user's number of unread notifications, kept up to date as
+    notifications are created, read and deleted (see accounts.unread).
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter'
+    )
+    unread = models.PositiveIntegerField(default=0)
+
     def __str__(self):
-        return f"Notification for {self.user.username}"
\ No newline at end of file
+        return f"{self.user.username}: {self.unread} unread"
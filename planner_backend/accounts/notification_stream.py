@@ -0,0 +1,166 @@
+"""
+Server-sent events channel for new notifications.
+
+An async view (see planner_app.async_views), served by the ASGI application
+(planner_backend.asgi, the asgi service of docker-compose.yml), so an open
+stream holds no worker thread. Each connection waits on the user's
+notifications version stamp, which every process bumps when it writes a
+notification, and when it changes sends the notifications created since the
+last one delivered ('notification' events, with the notification id as the
+event id) followed by the unread count if it changed ('unread_count'). The
+stamps of every user with an open stream are read by one VersionWatcher per
+worker, in a single query each NOTIFICATION_STREAM_POLL_INTERVAL, so open
+streams cost no queries while nothing changes. Between changes a comment
+keeps proxies from closing the connection. Streams end after
+NOTIFICATION_STREAM_MAX_DURATION seconds; EventSource reconnects by itself
+and resumes from the Last-Event-ID header.
+"""
+import asyncio
+import json
+import weakref
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from planner_app.async_views import AsyncAPIView
+from planner_app.models import DataVersion
+from planner_app.versions import NOTIFICATIONS
+from .models import Notification
+from .unread import get_unread_count
+
+NOTIFICATION_FIELDS = ['id', 'message', 'is_read', 'created_at']
+BATCH_SIZE = 100
+
+
+class VersionWatcher:
+    """
+    Polls the notifications version stamps of every user with an open stream
+    on one event loop, and wakes the streams of the users whose stamp moved.
+    The polling task runs only while some stream is subscribed.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)  # user_id: {asyncio.Event}
+        self.versions = {}
+        self.task = None
+
+    def subscribe(self, user_id):
+        event = asyncio.Event()
+        self.subscribers[user_id].add(event)
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return event
+
+    def unsubscribe(self, user_id, event):
+        self.subscribers[user_id].discard(event)
+        if not self.subscribers[user_id]:
+            del self.subscribers[user_id]
+            self.versions.pop(user_id, None)
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                await asyncio.sleep(settings.NOTIFICATION_STREAM_POLL_INTERVAL)
+                user_ids = list(self.subscribers)
+                versions = DataVersion.objects.filter(user_id__in=user_ids).values_list('user_id', NOTIFICATIONS)
+                current = {user_id: version async for user_id, version in versions}
+                for user_id in user_ids:
+                    version = current.get(user_id, 0)
+                    if user_id in self.subscribers and self.versions.get(user_id) != version:
+                        self.versions[user_id] = version
+                        for event in self.subscribers[user_id]:
+                            event.set()
+        finally:
+            self.task = None
+
+
+_watchers = weakref.WeakKeyDictionary()  # Event loop: VersionWatcher
+
+
+def get_watcher():
+    loop = asyncio.get_running_loop()
+    if loop not in _watchers:
+        _watchers[loop] = VersionWatcher()
+    return _watchers[loop]
+
+
+def format_event(event, data, event_id=None):
+    """
+    Format one server-sent event.
+    """
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def notification_events(user_id, last_id):
+    """
+    Yield the events of one stream, starting after notification last_id.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.NOTIFICATION_STREAM_MAX_DURATION
+    watcher = get_watcher()
+    changed = watcher.subscribe(user_id)  # Before the first read, so no change is missed
+    unread = None
+    try:
+        yield f"retry: {settings.NOTIFICATION_STREAM_RETRY_MS}\n\n"
+
+        while True:
+            while True:
+                batch = Notification.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')
+                notifications = [n async for n in batch.values(*NOTIFICATION_FIELDS)[:BATCH_SIZE]]
+                for notification in notifications:
+                    last_id = notification['id']
+                    yield format_event('notification', notification, event_id=last_id)
+                if len(notifications) < BATCH_SIZE:
+                    break
+            current_unread = await sync_to_async(get_unread_count)(user_id)
+            if current_unread != unread:
+                unread = current_unread
+                yield format_event('unread_count', {"unread_count": unread}, event_id=last_id)
+
+            # Wait for the next change, sending a heartbeat comment while there is none
+            while not changed.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(
+                        changed.wait(), timeout=min(settings.NOTIFICATION_STREAM_HEARTBEAT, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    if loop.time() < deadline:
+                        yield ": keep-alive\n\n"
+            changed.clear()
+    finally:
+        watcher.unsubscribe(user_id, changed)
+
+
+class NotificationStreamView(AsyncAPIView):
+    """
+    GET endpoint for the stream. Without a Last-Event-ID header (or
+    ?after=<notification id>) only notifications created after connecting
+    are sent.
+    """
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # A WSGI server would buffer the whole stream before sending anything
+            return JsonResponse(
+                {"error": "The notification stream is only served by the ASGI application."}, status=501
+            )
+
+        last_id = request.headers.get('Last-Event-ID') or request.GET.get('after')
+        if last_id is None or not last_id.isdigit():
+            latest = await Notification.objects.filter(user=request.user).order_by('-id').values_list(
+                'id', flat=True
+            ).afirst()
+            last_id = latest or 0
+
+        response = StreamingHttpResponse(
+            notification_events(request.user.id, int(last_id)), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+        return response
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from planner_app.profiling import ProfiledSerializerMixin
+from planner_app.sparse_fields import SparseFieldsetSerializerMixin
 from .models import Notification, UserProfile
 
 
@@ -34,14 +36,14 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 
 # User Profile Serializer
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
 
 
 # UserProfile Serializer
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
 
     class Meta:
@@ -51,12 +53,19 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 
 # Notification Serializer
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(ProfiledSerializerMixin, SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'user', 'message', 'is_read', 'created_at']
 
 
+class MarkReadSerializer(serializers.Serializer):
+    # Without ids every unread notification is marked
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=500
+    )
+
+
 # Account Registration Serializer
 class RegistrationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Notification
+from .unread import add_unread, recount_unread
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        if not instance.is_read:
+            add_unread(instance.user_id, 1)
+    elif update_fields is None or 'is_read' in update_fields:
+        was_read = getattr(instance, '_loaded_is_read', None)
+        if was_read is None:
+            recount_unread(instance.user_id)  # Not loaded from the database, so the change is unknown
+        elif was_read != instance.is_read:
+            add_unread(instance.user_id, -1 if instance.is_read else 1)
+    instance._loaded_is_read = instance.is_read
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        add_unread(instance.user_id, -1)
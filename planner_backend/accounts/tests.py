@@ -1,3 +1,114 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Notification, NotificationCounter
+from .notification_stream import get_watcher, notification_events
+from .unread import get_unread_count, mark_read
 
-# Create your tests here.
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.notifications = [Notification.objects.create(user=self.user, message=f"n{n}") for n in range(3)]
+        Notification.objects.create(user=self.other, message="other")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_counter_follows_writes(self):
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread, 3)
+        Notification.objects.create(user=self.user, message="read", is_read=True)
+        self.notifications[0].is_read = True
+        self.notifications[0].save()
+        self.notifications[1].delete()
+        self.assertEqual(get_unread_count(self.user.id), 1)
+
+    def test_read_transitions_move_the_counter_without_a_recount(self):
+        notification = Notification.objects.get(pk=self.notifications[0].pk)
+        notification.is_read = True
+        with CaptureQueriesContext(connection) as queries:
+            notification.save()
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        self.assertEqual(get_unread_count(self.user.id), 2)
+
+        notification.save()  # Unchanged
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        notification.is_read = False
+        notification.save()
+        self.assertEqual(get_unread_count(self.user.id), 3)
+
+    def test_missing_counter_is_rebuilt(self):
+        NotificationCounter.objects.all().delete()
+        self.assertEqual(get_unread_count(self.user.id), 3)
+
+    def test_unread_count_endpoint_reads_one_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/accounts/notifications/unread-count/')
+        self.assertEqual(response.json(), {"unread_count": 3})
+        self.assertEqual(len(queries), 2)  # Version stamp for the ETag, then the counter
+
+    def test_mark_read_is_one_update(self):
+        ids = [self.notifications[0].id, self.notifications[1].id]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/accounts/notifications/mark-read/', {"ids": ids}, format='json')
+        self.assertEqual(response.json(), {"marked": 2, "unread_count": 1})
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "accounts_notification"')]
+        self.assertEqual(len(updates), 1)
+
+        response = self.client.post('/accounts/notifications/mark-read/', {}, format='json')
+        self.assertEqual(response.json(), {"marked": 1, "unread_count": 0})
+        self.assertEqual(Notification.objects.filter(user=self.other, is_read=False).count(), 1)
+
+    def test_mark_read_rejects_empty_ids(self):
+        response = self.client.post('/accounts/notifications/mark-read/', {"ids": []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(NOTIFICATION_STREAM_POLL_INTERVAL=0.01, NOTIFICATION_STREAM_MAX_DURATION=5)
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', password='password')
+        self.notification = Notification.objects.create(user=self.user, message="Plan ready")
+        self.token = str(AccessToken.for_user(self.user))
+
+    async def test_stream_sends_new_notifications_and_count(self):
+        response = await self.async_client.get(
+            '/accounts/notifications/stream/', {'after': 0}, headers={"Authorization": f"Bearer {self.token}"}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = []
+        async for chunk in response.streaming_content:
+            frames.append(chunk.decode())
+            if len(frames) == 3:
+                break
+        self.assertTrue(frames[0].startswith('retry:'))
+        self.assertIn(f"id: {self.notification.id}\nevent: notification", frames[1])
+        self.assertIn('"message": "Plan ready"', frames[1])
+        self.assertIn('event: unread_count\ndata: {"unread_count": 1}', frames[2])
+
+    async def test_changes_are_pushed_through_the_shared_watcher(self):
+        streams = [notification_events(self.user.id, self.notification.id) for _ in range(2)]
+        for stream in streams:
+            for _ in range(2):  # retry, then the current unread count
+                await anext(stream)
+        self.assertEqual(len(get_watcher().subscribers[self.user.id]), 2)
+
+        new = await Notification.objects.acreate(user=self.user, message="Quote of the day")
+        for stream in streams:
+            self.assertIn(f"id: {new.id}\nevent: notification", await anext(stream))
+            self.assertIn('event: unread_count\ndata: {"unread_count": 2}', await anext(stream))
+
+        # Reading a notification only changes the count
+        await sync_to_async(mark_read)(self.user.id, [new.id])
+        self.assertIn('"unread_count": 1', await anext(streams[0]))
+        for stream in streams:
+            await stream.aclose()
+        self.assertNotIn(self.user.id, get_watcher().subscribers)
+
+    async def test_stream_requires_a_token(self):
+        response = await self.async_client.get('/accounts/notifications/stream/')
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,55 @@
+"""
+Unread notification counts.
+
+Each user's unread count is stored in a NotificationCounter row and moved
+with F() expressions as notifications are created, read and deleted, so the
+badge is a primary key lookup instead of a count over the notifications.
+A missing row (e.g. for users who had notifications before the counter
+existed) is filled in from the notifications on first use.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from planner_app.versions import NOTIFICATIONS, bump_version
+from .models import Notification, NotificationCounter
+
+
+def recount_unread(user_id):
+    """
+    Store and return the user's unread count computed from the notifications.
+    """
+    unread = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    NotificationCounter.objects.update_or_create(user_id=user_id, defaults={'unread': unread})
+    return unread
+
+
+def add_unread(user_id, count):
+    """
+    Move the user's unread count by count (negative when notifications are
+    read or deleted). A missing row is only created for new notifications,
+    so deleting a user's notifications along with the user leaves none behind.
+    """
+    counter = NotificationCounter.objects.filter(user_id=user_id)
+    if not counter.update(unread=Greatest(F('unread') + count, 0)) and count > 0:
+        recount_unread(user_id)  # Already includes the new notifications
+
+
+def get_unread_count(user_id):
+    unread = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    return recount_unread(user_id) if unread is None else unread
+
+
+def mark_read(user_id, ids=None):
+    """
+    Mark the user's unread notifications (or only those in ids) as read in
+    one UPDATE. Returns the number of notifications that were marked.
+    """
+    with transaction.atomic():
+        notifications = Notification.objects.filter(user_id=user_id, is_read=False)
+        if ids is not None:
+            notifications = notifications.filter(id__in=ids)
+        marked = notifications.update(is_read=True)  # Sends no signals, so follow up here
+        if marked:
+            add_unread(user_id, -marked)
+            bump_version(user_id, NOTIFICATIONS)
+    return marked
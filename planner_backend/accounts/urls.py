@@ -1,5 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
+from .notification_stream import NotificationStreamView
 from .views import NotificationViewSet, UserProfileView, RegisterViewSet
 
 router = DefaultRouter()
@@ -7,6 +8,8 @@ router.register('notifications', NotificationViewSet, basename='notification')
 router.register('register', RegisterViewSet, basename='register')
 
 urlpatterns = [
+    # Before the router, whose detail route would take 'stream' as a notification id
+    path('notifications/stream/', NotificationStreamView.as_view(), name='notification-stream'),
     path('', include(router.urls)),
     path('user-profile/', UserProfileView.as_view(), name='user-profile'),
 ]
@@ -5,6 +5,12 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.decorators import action
+from planner_app.conditional import ConditionalGetMixin
+from planner_app.pagination import OptionalCursorPagination
+from planner_app.sparse_fields import SparseFieldsetViewMixin
+from planner_app.versions import NOTIFICATIONS
+from .unread import get_unread_count, mark_read
 
 
 # Custom Token for JWT Authentication
@@ -41,16 +47,39 @@ class UserProfileView(APIView):
 
 # Notification Endpoints
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
+    etag_scope = NOTIFICATIONS
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
-    http_method_names = ['get']
+    pagination_class = OptionalCursorPagination
+    http_method_names = ['get', 'post']  # POST only for mark-read; notifications are not created here
 
     def get_queryset(self):
         # Filter goals for the logged-in user
         return Notification.objects.filter(user=self.request.user)
 
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Number of unread notifications, from the maintained counter"""
+        return Response({"unread_count": get_unread_count(request.user.id)}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='mark-read')
+    def mark_read(self, request):
+        """
+        Mark the notifications listed in ids, or all of them when ids is
+        left out, as read. Returns how many were marked and the new count.
+        """
+        serializer = MarkReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        marked = mark_read(request.user.id, serializer.validated_data.get('ids'))
+        return Response(
+            {"marked": marked, "unread_count": get_unread_count(request.user.id)},
+            status=status.HTTP_200_OK
+        )
+
 
 # Register Endpoints
 class RegisterViewSet(viewsets.ModelViewSet):
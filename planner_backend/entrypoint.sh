@@ -8,6 +8,15 @@ echo "Making and applying database migrations..."
 python manage.py makemigrations --noinput
 python manage.py migrate --noinput
 
+# Bring the denormalized progress counters in line with the activities
+# (rows created before the counters existed start at 0)
+echo "Rebuilding progress counters..."
+python manage.py rebuild_progress_counters
+
+# Rebuild the daily progress rollup behind the analytics endpoint from the same activities
+echo "Backfilling daily progress..."
+python manage.py backfill_daily_progress
+
 # Collect static files
 echo "Collecting static files..."
 python manage.py collectstatic --noinput --clear
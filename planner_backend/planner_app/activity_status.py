@@ -0,0 +1,72 @@
+"""
+Activity status updates.
+
+Statuses are applied in one UPDATE; the plans' and goals' progress counters
+and the plans' statuses follow in the same transaction (see planner_app.counters).
+"""
+from collections import Counter
+from django.db import transaction
+from django.db.models import BooleanField, Case, Value, When
+from .counters import apply_completed_deltas
+from .models import DailyPlan, DailyPlanActivity
+from .versions import GOALS, bump_version
+
+
+class ActivityNotFound(Exception):
+    pass
+
+
+def update_activity_statuses(user, updates):
+    """
+    Apply [{'id', 'status'}] to the user's activities in one UPDATE and roll
+    the change up to the owning plans and goals in the same transaction.
+    Raises ActivityNotFound, changing nothing, if any id is not one of the
+    user's activities. Returns the affected plans as [{'id', 'status'}].
+    """
+    new_statuses = {update['id']: update['status'] for update in updates}
+    with transaction.atomic():
+        # Lock the rows so the counter deltas match what the UPDATE changes
+        current = list(
+            DailyPlanActivity.objects.select_for_update(of=('self',))
+            .filter(id__in=new_statuses, plan__goal__user=user)
+            .values_list('id', 'plan_id', 'status')
+        )
+        if len(current) != len(new_statuses):
+            raise ActivityNotFound("One or more activities were not found or are not accessible.")
+
+        DailyPlanActivity.objects.filter(id__in=new_statuses).update(
+            status=Case(
+                *[When(id=activity_id, then=Value(status)) for activity_id, status in new_statuses.items()],
+                output_field=BooleanField(),
+            )
+        )
+
+        plan_deltas = Counter()
+        for activity_id, plan_id, old_status in current:
+            if new_statuses[activity_id] != old_status:
+                plan_deltas[plan_id] += 1 if new_statuses[activity_id] else -1
+        apply_completed_deltas({plan_id: delta for plan_id, delta in plan_deltas.items() if delta})
+
+        plan_ids = {plan_id for _, plan_id, _ in current}
+        plans = list(DailyPlan.objects.filter(pk__in=plan_ids).order_by('id').values('id', 'status'))
+        bump_version(user.id, GOALS)  # Queryset updates do not send model signals
+    return plans
+
+
+def mark_activities_completed(activity_ids):
+    """
+    Mark the activities completed whoever they belong to (e.g. from the
+    admin), with the same counter, rollup and version updates as
+    update_activity_statuses(). Returns the number of activities changed.
+    """
+    with transaction.atomic():
+        pending = list(
+            DailyPlanActivity.objects.select_for_update(of=('self',))
+            .filter(id__in=activity_ids, status=False)
+            .values_list('id', 'plan_id', 'plan__goal__user_id')
+        )
+        DailyPlanActivity.objects.filter(id__in=[activity_id for activity_id, _, _ in pending]).update(status=True)
+        apply_completed_deltas(dict(Counter(plan_id for _, plan_id, _ in pending)))
+        for user_id in {user_id for _, _, user_id in pending}:
+            bump_version(user_id, GOALS)
+    return len(pending)
@@ -2,6 +2,7 @@ from django.contrib import admin
 from .models import *
 from django.core.exceptions import ValidationError
 from django.contrib import messages
+from .activity_status import mark_activities_completed
 
 
 @admin.register(DailyRoutine)
@@ -68,10 +69,37 @@ class DailyPlanActivityAdmin(admin.ModelAdmin):
 
     def mark_completed(self, request, queryset):
         """
-        Custom action to mark selected activities as completed.
+        Custom action to mark selected activities as completed. Goes through
+        the same path as the API so the progress counters and caches follow.
         """
-        updated = queryset.update(status=True)
+        updated = mark_activities_completed(list(queryset.values_list('id', flat=True)))
         self.message_user(request, f"{updated} activities marked as completed.")
 
     mark_completed.short_description = "Mark selected activities as Completed"
 
+
+
+@admin.register(PlanGenerationJob)
+class PlanGenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('goal', 'plan_date', 'status', 'attempts', 'plan', 'updated_at')
+    list_filter = ('status', 'plan_date')
+    search_fields = ('goal__goal_name', 'goal__user__username')
+
+
+@admin.register(MotivationalQuote)
+class MotivationalQuoteAdmin(admin.ModelAdmin):
+    list_display = ('text', 'created_at')
+    search_fields = ('text',)
+
+
+@admin.register(DailyProgress)
+class DailyProgressAdmin(admin.ModelAdmin):
+    list_display = ('goal', 'user', 'date', 'planned_activities', 'completed_activities')
+    list_filter = ('date',)
+    search_fields = ('goal__goal_name', 'user__username')
+
+
+@admin.register(DataVersion)
+class DataVersionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'goals', 'routines', 'notifications')
+    search_fields = ('user__username',)
@@ -0,0 +1,130 @@
+"""
+Goal analytics from the DailyProgress rollup.
+
+Each (user, goal, date) row mirrors the counters of that day's plan. Rows are
+written as plans gain activities and activities change status (see
+planner_app.counters), and can be rebuilt in bulk with backfill_daily_progress.
+Analytics read a date range of rows with an index range scan instead of
+aggregating DailyPlanActivity.
+"""
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from .models import DailyPlan, DailyProgress, Goal
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def add_planned(user_id, goal_id, day, count):
+    """
+    Count newly created activities on the goal's day, creating the row if needed.
+    """
+    rows = DailyProgress.objects.filter(user_id=user_id, goal_id=goal_id, date=day)
+    if rows.update(planned_activities=F('planned_activities') + count):
+        return
+    try:
+        with transaction.atomic():
+            DailyProgress.objects.create(user_id=user_id, goal_id=goal_id, date=day, planned_activities=count)
+    except IntegrityError:
+        rows.update(planned_activities=F('planned_activities') + count)  # Created concurrently
+
+
+def remove_progress(goal_id, day):
+    """
+    Drop the goal's rollup row for a day whose plan was deleted.
+    """
+    DailyProgress.objects.filter(goal_id=goal_id, date=day).delete()
+
+
+def store_progress(rows):
+    """
+    Upsert [(user_id, goal_id, date, planned, completed)] rollup rows in one statement.
+    """
+    DailyProgress.objects.bulk_create(
+        [
+            DailyProgress(
+                user_id=user_id, goal_id=goal_id, date=day, planned_activities=planned, completed_activities=completed
+            )
+            for user_id, goal_id, day, planned, completed in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'goal', 'date'],
+        update_fields=['planned_activities', 'completed_activities'],
+    )
+
+
+def backfill_daily_progress(batch_size=500):
+    """
+    Rebuild every rollup row from the activities, a batch of goals at a time.
+    Returns the number of rows written.
+    """
+    written = 0
+    goal_ids = list(Goal.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(goal_ids), batch_size):
+        batch = goal_ids[start:start + batch_size]
+        plans = (
+            DailyPlan.objects.filter(goal_id__in=batch)
+            .values_list('goal__user_id', 'goal_id', 'plan_date')
+            .annotate(
+                planned=Count('activities'),
+                completed=Count('activities', filter=Q(activities__status=True)),
+            )
+        )
+        rows = list(plans)
+        with transaction.atomic():
+            DailyProgress.objects.filter(goal_id__in=batch).delete()  # Drops rows of deleted plans
+            store_progress(rows)
+        written += len(rows)
+    return written
+
+
+def progress_analytics(user_id, start, end, goal_id=None):
+    """
+    Daily completion, streaks and average completed activities per weekday
+    between start and end (inclusive), for one goal or all of the user's goals.
+    A day counts towards a streak when at least one activity was completed.
+    """
+    rows = DailyProgress.objects.filter(user_id=user_id, date__gte=start, date__lte=end)
+    if goal_id is not None:
+        rows = rows.filter(goal_id=goal_id)
+    daily = (
+        rows.values('date')
+        .annotate(planned=Sum('planned_activities'), completed=Sum('completed_activities'))
+        .order_by('date')
+    )
+
+    days = []
+    longest_streak = streak = 0
+    previous = None
+    weekday_totals = [[0, 0] for _ in WEEKDAY_NAMES]  # [completed, days]
+    for row in daily:
+        day, planned, completed = row['date'], row['planned'], row['completed']
+        days.append({
+            "date": day,
+            "planned": planned,
+            "completed": completed,
+            "completion_rate": round(completed / planned, 3) if planned else None,
+        })
+        weekday_totals[day.weekday()][0] += completed
+        weekday_totals[day.weekday()][1] += 1
+
+        if completed:
+            streak = streak + 1 if previous == day - timedelta(days=1) else 1
+            previous = day
+            longest_streak = max(longest_streak, streak)
+
+    # The current streak may still be extended today, so it also counts if it ended yesterday
+    current_streak = streak if previous is not None and previous >= end - timedelta(days=1) else 0
+
+    return {
+        "from": start,
+        "to": end,
+        "goal": goal_id,
+        "days": days,
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+        "weekday_averages": [
+            {"weekday": name, "average_completed": round(completed / count, 2) if count else None}
+            for name, (completed, count) in zip(WEEKDAY_NAMES, weekday_totals)
+        ],
+    }
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PlannerAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'planner_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .profiling import install
+        install()
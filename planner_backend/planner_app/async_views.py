@@ -0,0 +1,163 @@
+"""
+Native async variants of the Gemma-bound endpoints.
+
+DRF views are synchronous, so these are plain Django async views that
+authenticate with the same JWT bearer tokens. Under the ASGI application
+(planner_backend.asgi) a request waiting on Gemma holds no thread, so one
+worker can keep hundreds of generations in flight; ORM work still runs in
+a thread through sync_to_async or the async ORM methods. Under WSGI they
+work too, but without the gain.
+"""
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .jobs import PlanGenerationInProgress, agenerate_plan_once, enqueue_plan_generation
+from .models import DailyPlan, Goal
+from .plan_generation import PlanGenerationError
+from .plan_streaming import format_event, stream_plan_once
+from .serializers import GoalSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, safe=False)
+
+
+class AsyncAPIView(View):
+    """
+    Base for async API views: CSRF exempt like DRF views, and the request
+    user is taken from the JWT bearer token (401 without a valid one).
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return json_response({"detail": str(e.detail)}, status=401)
+        if authenticated is None:
+            return json_response({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user = authenticated[0]
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def check_plan_preconditions(goal, today):
+    """
+    Async counterpart of views.check_plan_preconditions: the response to send
+    instead of generating a plan for today, or None.
+    """
+    if await DailyPlan.objects.filter(goal=goal, plan_date=today).aexists():
+        return json_response({"message": "A daily plan for this goal already exists for today."}, status=200)
+    if not (goal.goal_start_date <= today <= goal.goal_end_date):
+        return json_response({"error": "Goal is not active on the current date."}, status=400)
+    return None
+
+
+class AsyncGenerateDailyPlanView(AsyncAPIView):
+    """
+    Async variant of GenerateDailyPlanAPIView, with the same modes and responses.
+    """
+
+    async def post(self, request, goal_id):
+        try:
+            goal = await Goal.objects.aget(id=goal_id, user=request.user)
+        except Goal.DoesNotExist:
+            return json_response({"error": "Goal not found or not accessible."}, status=404)
+
+        today = timezone.now().date()
+        precondition_response = await check_plan_preconditions(goal, today)
+        if precondition_response:
+            return precondition_response
+
+        mode = request.GET.get('mode')
+        if mode == 'async':
+            job = await sync_to_async(enqueue_plan_generation)(goal, today)
+            return json_response(
+                {"message": "Daily plan generation queued.", "job_id": job.id, "status": job.status}, status=202
+            )
+
+        try:
+            daily_plan = await agenerate_plan_once(goal, today, fast=mode == 'fast')
+        except PlanGenerationInProgress as e:
+            return json_response({"message": str(e), "job_id": e.job.id, "status": e.job.status}, status=202)
+        except PlanGenerationError as e:
+            return json_response({"error": str(e)}, status=500)
+        except Exception as e:
+            logger.error(f"Error generating daily plan: {e}")
+            return json_response({"error": "Failed to generate daily plan. Please try again later."}, status=500)
+
+        return json_response(
+            {"message": "Daily plan and activities created successfully.", "plan_id": daily_plan.id}, status=201
+        )
+
+
+async def stream_events(goal, plan_date):
+    """
+    Server-sent events of stream_plan_once() as an async iterator. The ASGI
+    handler buffers a sync iterator whole, so each event is pulled through
+    sync_to_async instead, in the request's thread like the rest of its ORM
+    work, and sent as soon as it is ready.
+    """
+    events = stream_plan_once(goal, plan_date)
+    next_event = sync_to_async(next)
+    try:
+        while (item := await next_event(events, None)) is not None:
+            yield format_event(*item)
+    finally:
+        await sync_to_async(events.close)()  # Finishes the generation job on disconnect too
+
+
+class AsyncGenerateDailyPlanStreamView(AsyncAPIView):
+    """
+    Async variant of GenerateDailyPlanStreamView, with the same events.
+    """
+
+    async def post(self, request, goal_id):
+        try:
+            goal = await Goal.objects.aget(id=goal_id, user=request.user)
+        except Goal.DoesNotExist:
+            return json_response({"error": "Goal not found or not accessible."}, status=404)
+
+        today = timezone.now().date()
+        precondition_response = await check_plan_preconditions(goal, today)
+        if precondition_response:
+            return precondition_response
+
+        response = StreamingHttpResponse(stream_events(goal, today), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+        return response
+
+
+class AsyncGoalCreateView(AsyncAPIView):
+    """
+    Async goal creation: validated and saved like POST /goals/, then the
+    feasibility score and notes calls run concurrently on the event loop.
+    """
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return json_response({"detail": "JSON parse error."}, status=400)
+
+        serializer = GoalSerializer(data=data, context={'request': request, 'enrich': False})
+        if not await sync_to_async(serializer.is_valid)():
+            return json_response(serializer.errors, status=400)
+
+        goal = await sync_to_async(serializer.save)()
+        goal.feasibility_score, goal.model_notes = await serializer.aenrich_goal(goal)
+        await goal.asave(update_fields=['feasibility_score', 'model_notes'])
+        return json_response(GoalSerializer(goal).data, status=201)
@@ -0,0 +1,115 @@
+"""
+Per-user, per-day busy-time index.
+
+A user's routines for one day of the week are turned once into sorted,
+merged busy intervals (in minutes of the day), so overlap checks and
+free-slot queries are a binary search instead of re-parsing every routine
+for every candidate activity. Indexes are cached and dropped whenever the
+user's routines change (see planner_app.signals); the TTL bounds staleness
+in other processes when the cache is not shared.
+"""
+from bisect import bisect_right
+from django.conf import settings
+from django.core.cache import cache
+from .models import DailyRoutine
+
+MINUTES_PER_DAY = 24 * 60
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+class BusyTimeIndex:
+    """
+    Sorted, non-overlapping busy intervals [start, end) in minutes of the day.
+    Routines that run past midnight (end before start) are split in two.
+    """
+
+    def __init__(self, routines):
+        self.routines = routines  # [{'activity_name', 'start_time', 'end_time'}] as HH:MM, for the prompt
+
+        intervals = []
+        for routine in routines:
+            start = int(routine['start_time'][:2]) * 60 + int(routine['start_time'][3:5])
+            end = int(routine['end_time'][:2]) * 60 + int(routine['end_time'][3:5])
+            if end > start:
+                intervals.append((start, end, routine['activity_name']))
+            elif end < start:
+                intervals.append((start, MINUTES_PER_DAY, routine['activity_name']))
+                intervals.append((0, end, routine['activity_name']))
+        intervals.sort()
+
+        self.starts, self.ends, self.names = [], [], []
+        for start, end, name in intervals:
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+                self.names[-1] = f"{self.names[-1]}, {name}"
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+                self.names.append(name)
+
+    def find_overlap(self, start_time, end_time):
+        """
+        Return (name, start, end) of the busy interval overlapping the given
+        time range, or None. O(log n).
+        """
+        start, end = to_minutes(start_time), to_minutes(end_time)
+        index = bisect_right(self.ends, start)  # First interval that ends after start
+        if index < len(self.starts) and self.starts[index] < end:
+            return self.names[index], self.starts[index], self.ends[index]
+        return None
+
+    def free_slots(self, after=0, min_length=1):
+        """
+        Return the free [start, end) ranges in minutes, from `after` to the
+        end of the day, that are at least min_length minutes long.
+        """
+        slots = []
+        cursor = after
+        for index in range(bisect_right(self.ends, after), len(self.starts)):
+            if self.starts[index] - cursor >= min_length:
+                slots.append((cursor, self.starts[index]))
+            cursor = max(cursor, self.ends[index])
+        if MINUTES_PER_DAY - cursor >= min_length:
+            slots.append((cursor, MINUTES_PER_DAY))
+        return slots
+
+
+def cache_key(user_id, weekday_name):
+    return f"busy-index:{user_id}:{weekday_name}"
+
+
+def get_busy_index(user_id, plan_date):
+    """
+    Return the busy-time index for the user's routines on the plan date.
+    """
+    weekday_name = WEEKDAY_NAMES[plan_date.weekday()]
+    key = cache_key(user_id, weekday_name)
+    index = cache.get(key)
+    if index is None:
+        day_type = 'Weekday' if plan_date.weekday() < 5 else 'Weekend'
+        daily_routines = DailyRoutine.objects.filter(
+            user_id=user_id,
+            days_of_week__in=[weekday_name, day_type]
+        ).only('activity_name', 'start_time', 'end_time')
+
+        index = BusyTimeIndex([
+            {
+                'activity_name': routine.activity_name,
+                'start_time': routine.start_time.strftime('%H:%M'),
+                'end_time': routine.end_time.strftime('%H:%M'),
+            }
+            for routine in daily_routines
+        ])
+        cache.set(key, index, settings.BUSY_INDEX_CACHE_TTL)
+    return index
+
+
+def invalidate_busy_index(user_id):
+    """
+    Drop the user's cached indexes for every day of the week.
+    """
+    cache.delete_many([cache_key(user_id, weekday_name) for weekday_name in WEEKDAY_NAMES])
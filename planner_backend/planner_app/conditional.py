@@ -0,0 +1,48 @@
+"""
+Conditional GET for read endpoints, from the per-user version stamps.
+
+The ETag combines the user's version of the view's data scope with the
+request path and query string (and today's date, which several payloads
+depend on). It is computed after authentication and before the handler, so a
+matching If-None-Match is answered with 304 without running queries on the
+main tables or serializers.
+"""
+import hashlib
+from django.utils import timezone
+from django.utils.cache import parse_etags, quote_etag
+from rest_framework.response import Response
+from .versions import get_version
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    etag_scope = None  # One of the planner_app.versions scopes
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        self.data_version = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        self.data_version = get_version(request.user.id, self.etag_scope)
+        variant = f"{request.get_full_path()}|{timezone.now().date().isoformat()}"
+        digest = hashlib.sha256(variant.encode('utf-8')).hexdigest()[:16]
+        self.etag = quote_etag(f"{self.etag_scope}-{request.user.id}-{self.data_version}-{digest}")
+        if self.etag in parse_etags(request.headers.get('If-None-Match', '')):
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=304)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            response['Cache-Control'] = 'private, no-cache'  # Always revalidate
+        return response
@@ -0,0 +1,168 @@
+"""
+Denormalized progress counters.
+
+DailyPlan and Goal store how many activities they have and how many are
+completed, and Goal how many of its days are completed (every activity of
+the plan done), so progress displays never aggregate over activities. The
+counters are moved with F() expressions in the same transaction as the change
+they follow, together with the DailyProgress rollup; rebuild_counters()
+recomputes them and reports any drift (e.g. after rows were deleted in the admin).
+Rows that predate the counters start at 0 until rebuild_progress_counters has
+run (the entrypoint runs it on every deploy); a status change on such a plan
+recounts it, and the counters never go below 0.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from .analytics import add_planned, remove_progress, store_progress
+from .models import DailyPlan, DailyPlanActivity, Goal
+from .versions import GOALS, bump_version
+
+
+def plan_status(total, completed, current_status):
+    """
+    A plan's status follows its activities: Completed when all are done,
+    In Progress when some are, otherwise Pending (or still Skipped).
+    """
+    if total and completed == total:
+        return 'Completed'
+    if completed:
+        return 'In Progress'
+    return 'Skipped' if current_status == 'Skipped' else 'Pending'
+
+
+def add_activities(daily_plan, count):
+    """
+    Count newly created (not yet completed) activities of a plan.
+    """
+    DailyPlan.objects.filter(pk=daily_plan.pk).update(total_activities=F('total_activities') + count)
+    Goal.objects.filter(pk=daily_plan.goal_id).update(total_activities=F('total_activities') + count)
+    add_planned(daily_plan.goal.user_id, daily_plan.goal_id, daily_plan.plan_date, count)
+
+
+def apply_completed_deltas(plan_deltas):
+    """
+    Move the completed counters by {plan_id: delta}, after the activities'
+    statuses were written, and update the plans' statuses. Must run inside a
+    transaction; the plan rows are locked so the completed-day transitions are
+    computed from current values. A plan whose counters the delta would take
+    out of range (created before they were maintained) is recounted from its
+    activities instead, and its goal moved by the difference. A change to a day
+    already folded into the goal's progress summary drops the summary, which
+    progress.close_days() then rebuilds.
+    """
+    plans = list(
+        DailyPlan.objects.select_for_update(of=('self',))
+        .filter(pk__in=plan_deltas)
+        .values_list(
+            'id', 'goal_id', 'goal__user_id', 'plan_date', 'total_activities', 'completed_activities', 'status',
+            'goal__progress_summary__closed_through',
+        )
+    )
+    stale = [plan[0] for plan in plans if not 0 <= plan[5] + plan_deltas[plan[0]] <= plan[4]]
+    # Goals whose rolling progress summary already folded in a changed day; rebuilt on next use
+    stale_summaries = {plan[1] for plan in plans if plan[7] and plan[3].isoformat() <= plan[7]}
+    recounted = {}
+    if stale:
+        counts = (
+            DailyPlanActivity.objects.filter(plan_id__in=stale)
+            .values('plan_id')
+            .annotate(total=Count('id'), completed=Count('id', filter=Q(status=True)))
+            .values_list('plan_id', 'total', 'completed')
+        )
+        recounted = {plan_id: (total, completed) for plan_id, total, completed in counts}
+
+    goal_deltas = defaultdict(lambda: [0, 0, 0])  # goal_id: [activities, completed activities, completed days]
+    progress = []
+    for plan_id, goal_id, user_id, plan_date, total, completed, current_status, _ in plans:
+        new_total, new_completed = recounted.get(plan_id, (total, completed + plan_deltas[plan_id]))
+        progress.append((user_id, goal_id, plan_date, new_total, new_completed))
+        new_status = plan_status(new_total, new_completed, current_status)
+        DailyPlan.objects.filter(pk=plan_id).update(
+            total_activities=new_total, completed_activities=new_completed, status=new_status
+        )
+        was_completed = plan_status(total, completed, current_status) == 'Completed'
+        goal_deltas[goal_id][0] += new_total - total
+        goal_deltas[goal_id][1] += new_completed - completed
+        goal_deltas[goal_id][2] += int(new_status == 'Completed') - int(was_completed)
+
+    for goal_id, (activities, completed_activities, days) in goal_deltas.items():
+        summary = {'progress_summary': {}} if goal_id in stale_summaries else {}
+        # The goal may count other plans that predate the counters too
+        Goal.objects.filter(pk=goal_id).update(
+            total_activities=Greatest(F('total_activities') + activities, 0),
+            completed_activities=Greatest(F('completed_activities') + completed_activities, 0),
+            completed_days=Greatest(F('completed_days') + days, 0),
+            **summary,
+        )
+    store_progress(progress)  # The plan rows are locked, so their counts are exact
+
+
+def discard_plan(daily_plan):
+    """
+    Delete a plan with its activities and take them back out of the goal's
+    counters and the rollup, e.g. a partially streamed plan being replaced.
+    """
+    with transaction.atomic():
+        total, completed, current_status = (
+            DailyPlan.objects.select_for_update(of=('self',))
+            .filter(pk=daily_plan.pk)
+            .values_list('total_activities', 'completed_activities', 'status')
+            .get()
+        )
+        Goal.objects.filter(pk=daily_plan.goal_id).update(
+            total_activities=Greatest(F('total_activities') - total, 0),
+            completed_activities=Greatest(F('completed_activities') - completed, 0),
+            completed_days=Greatest(F('completed_days') - int(current_status == 'Completed'), 0),
+        )
+        remove_progress(daily_plan.goal_id, daily_plan.plan_date)
+        daily_plan.delete()
+
+
+def rebuild_counters(fix=True, batch_size=500):
+    """
+    Recompute every plan's and goal's counters from the activities, a batch
+    of goals at a time. Returns (drifted plans, drifted goals); the stored
+    values are corrected unless fix is False.
+    """
+    drifted_plans = drifted_goals = 0
+    goal_ids = list(Goal.objects.order_by('id').values_list('id', flat=True))
+
+    for start in range(0, len(goal_ids), batch_size):
+        batch = goal_ids[start:start + batch_size]
+        plans = DailyPlan.objects.filter(goal_id__in=batch).annotate(
+            actual_total=Count('activities'),
+            actual_completed=Count('activities', filter=Q(activities__status=True)),
+        )
+
+        actual_goals = {goal_id: [0, 0, 0] for goal_id in batch}  # total, completed, completed days
+        plan_fixes = []
+        for plan in plans:
+            counts = actual_goals[plan.goal_id]
+            counts[0] += plan.actual_total
+            counts[1] += plan.actual_completed
+            counts[2] += int(bool(plan.actual_total) and plan.actual_completed == plan.actual_total)
+            if (plan.total_activities, plan.completed_activities) != (plan.actual_total, plan.actual_completed):
+                plan.total_activities = plan.actual_total
+                plan.completed_activities = plan.actual_completed
+                plan_fixes.append(plan)
+
+        goal_fixes = []
+        for goal in Goal.objects.filter(pk__in=batch).only(
+            'id', 'user_id', 'total_activities', 'completed_activities', 'completed_days'
+        ):
+            actual = actual_goals[goal.id]
+            if [goal.total_activities, goal.completed_activities, goal.completed_days] != actual:
+                goal.total_activities, goal.completed_activities, goal.completed_days = actual
+                goal_fixes.append(goal)
+
+        drifted_plans += len(plan_fixes)
+        drifted_goals += len(goal_fixes)
+        if fix:
+            DailyPlan.objects.bulk_update(plan_fixes, ['total_activities', 'completed_activities'])
+            Goal.objects.bulk_update(goal_fixes, ['total_activities', 'completed_activities', 'completed_days'])
+            for user_id in {goal.user_id for goal in goal_fixes}:
+                bump_version(user_id, GOALS)
+
+    return drifted_plans, drifted_goals
@@ -0,0 +1,348 @@
+"""
+Process-wide Gemma client.
+
+Every call to the Gemma model goes through one shared OpenAI client backed by
+a single pooled httpx connection pool, so keep-alive connections (and their
+TLS sessions) are reused across requests instead of being rebuilt per call.
+
+Async views use an AsyncOpenAI client instead, one per event loop (an async
+connection pool cannot be shared across loops), whose larger pool lets a
+single worker keep hundreds of calls in flight. Each one is closed on its own
+loop, by close_client() or when the loop shuts down.
+
+Prompts that depend only on their text (e.g. goal feasibility) can be served
+from the 'gemma' cache, keyed by the normalized prompt and model. Only
+responses the caller can parse are cached.
+
+Calls run under the process-wide resilience policy (planner_app.resilience):
+the timeout is the deadline of the whole call, retries, hedging and the
+circuit breaker are handled there, so the OpenAI clients' own retries are off.
+"""
+import asyncio
+import hashlib
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .resilience import RETRYABLE_ERRORS, CircuitBreaker, LatencyTracker, ResiliencePolicy, RetryBudget
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+_async_clients = weakref.WeakKeyDictionary()  # Event loop: (AsyncOpenAI client, its closer)
+_closing = set()  # Close tasks, referenced until done
+_policy = None
+_hedge_executor = None
+
+
+def build_http_client():
+    """
+    Build the pooled httpx client used underneath the OpenAI client.
+    """
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.GEMMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GEMMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GEMMA_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.GEMMA_TIMEOUT, connect=settings.GEMMA_CONNECT_TIMEOUT),
+    )
+
+
+def build_async_http_client():
+    """
+    Build the pooled httpx client used underneath the AsyncOpenAI client.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.GEMMA_ASYNC_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GEMMA_ASYNC_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GEMMA_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.GEMMA_TIMEOUT, connect=settings.GEMMA_CONNECT_TIMEOUT),
+    )
+
+
+def build_client(base_url=None, api_key=None):
+    """
+    Build a new OpenAI client on top of a pooled httpx client.
+    """
+    return openai.OpenAI(
+        base_url=base_url or settings.GEMMA_BASE_URL,
+        api_key=api_key or settings.GEMMA_API_KEY,
+        http_client=build_http_client(),
+        max_retries=0,
+    )
+
+
+def build_async_client(base_url=None, api_key=None):
+    """
+    Build a new AsyncOpenAI client on top of a pooled httpx client.
+    """
+    return openai.AsyncOpenAI(
+        base_url=base_url or settings.GEMMA_BASE_URL,
+        api_key=api_key or settings.GEMMA_API_KEY,
+        http_client=build_async_http_client(),
+        max_retries=0,
+    )
+
+
+def get_client():
+    """
+    Return the shared Gemma client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_client()
+    return _client
+
+
+def close_client():
+    """
+    Close the shared client and the async clients with their connection pools
+    (e.g. after a fork or in tests). Async clients are closed on their own
+    event loops; see aclose_client() to wait for the running loop's.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        async_clients = list(_async_clients.items())
+        _async_clients.clear()
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    for loop, (_, closer) in async_clients:
+        if loop.is_closed():
+            continue  # Its shutdown already closed the client
+        if loop is running:
+            task = loop.create_task(closer.aclose())
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(closer.aclose(), loop).result()
+        else:
+            loop.run_until_complete(closer.aclose())
+
+
+async def aclose_client():
+    """
+    Close the running event loop's async client, if it has one, and wait for it.
+    """
+    _, closer = _async_clients.pop(asyncio.get_running_loop(), (None, None))
+    if closer is not None:
+        await closer.aclose()
+
+
+async def close_at_shutdown(client):
+    """
+    Parked on the client's event loop until closed: either by close_client()
+    or by the loop's shutdown_asyncgens(), which asyncio.run(), asgiref and
+    uvicorn run before closing the loop, so the pool closes on its own loop.
+    """
+    try:
+        yield
+    finally:
+        await client.close()
+
+
+def get_async_client():
+    """
+    Return the async Gemma client of the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = build_async_client()
+        closer = close_at_shutdown(client)
+        asyncio.ensure_future(anext(closer))  # Starting it registers it with the loop's shutdown
+        entry = _async_clients[loop] = (client, closer)
+    return entry[0]
+
+
+def get_executor():
+    """
+    Return the shared thread pool used to run independent Gemma calls concurrently.
+    """
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.GEMMA_EXECUTOR_WORKERS, thread_name_prefix='gemma'
+                )
+    return _executor
+
+
+def get_policy():
+    """
+    Return the process-wide resilience policy, creating it on first use.
+    """
+    global _policy, _hedge_executor
+    if _policy is None:
+        with _client_lock:
+            if _policy is None:
+                _hedge_executor = ThreadPoolExecutor(
+                    max_workers=settings.GEMMA_EXECUTOR_WORKERS, thread_name_prefix='gemma-hedge'
+                )
+                _policy = ResiliencePolicy(
+                    breaker=CircuitBreaker(
+                        settings.GEMMA_BREAKER_FAILURE_THRESHOLD, settings.GEMMA_BREAKER_RESET_TIMEOUT
+                    ),
+                    budget=RetryBudget(settings.GEMMA_RETRY_BUDGET_RATIO, settings.GEMMA_RETRY_BUDGET_MAX_TOKENS),
+                    latencies=LatencyTracker(settings.GEMMA_LATENCY_WINDOW),
+                    max_retries=settings.GEMMA_MAX_RETRIES,
+                    backoff_base=settings.GEMMA_RETRY_BACKOFF_BASE,
+                    backoff_cap=settings.GEMMA_RETRY_BACKOFF_CAP,
+                    hedge_percentile=settings.GEMMA_HEDGE_PERCENTILE,
+                    hedge_min_samples=settings.GEMMA_HEDGE_MIN_SAMPLES,
+                    executor=_hedge_executor,
+                )
+    return _policy
+
+
+def reset_policy():
+    """
+    Drop the resilience state (breaker, budget, latencies), e.g. in tests.
+    """
+    global _policy
+    with _client_lock:
+        _policy = None
+
+
+def cache_key(prompt, model):
+    """
+    Cache key for a prompt: whitespace and case are normalized so trivially
+    different copies of the same goal share one entry.
+    """
+    normalized = " ".join(prompt.split()).casefold()
+    digest = hashlib.sha256(f"{model}\n{normalized}".encode()).hexdigest()
+    return f"gemma:{digest}"
+
+
+def cacheable(response_text, validate):
+    """
+    Whether a response may be cached: validate raises ValueError for answers
+    the caller cannot parse, which must not be served again for the cache TTL.
+    """
+    if validate is None:
+        return True
+    try:
+        validate(response_text)
+    except ValueError:
+        return False
+    return True
+
+
+def complete(prompt, timeout=None, client=None, cache=False, operation='default', validate=None):
+    """
+    Send a single user prompt to Gemma and return the stripped response text.
+    With cache=True, identical (normalized) prompts are answered from the cache;
+    validate(response_text), if given, must not raise ValueError for the
+    response to be cached.
+    timeout is the deadline for the whole call, retries included; operation
+    names the kind of prompt, whose recent latencies decide when to hedge.
+    """
+    if cache:
+        key = cache_key(prompt, settings.GEMMA_MODEL)
+        cached = caches['gemma'].get(key)
+        if cached is not None:
+            metrics.GEMMA_CACHE_HITS.labels(operation).inc()
+            return cached
+        metrics.GEMMA_CACHE_MISSES.labels(operation).inc()
+
+    client = client or get_client()
+
+    def attempt(attempt_timeout):
+        completion = client.chat.completions.create(
+            model=settings.GEMMA_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=attempt_timeout,
+        )
+        metrics.record_usage(operation, completion.usage)
+        return completion.choices[0].message.content.strip()
+
+    deadline = timeout if timeout is not None else settings.GEMMA_TIMEOUT
+    with metrics.observe_call(operation):
+        response_text = get_policy().call(attempt, deadline, operation)
+
+    if cache and cacheable(response_text, validate):
+        caches['gemma'].set(key, response_text)
+    return response_text
+
+
+async def acomplete(prompt, timeout=None, client=None, cache=False, operation='default', validate=None):
+    """
+    Async variant of complete(), for async views.
+    """
+    if cache:
+        key = cache_key(prompt, settings.GEMMA_MODEL)
+        cached = await caches['gemma'].aget(key)
+        if cached is not None:
+            metrics.GEMMA_CACHE_HITS.labels(operation).inc()
+            return cached
+        metrics.GEMMA_CACHE_MISSES.labels(operation).inc()
+
+    client = client or get_async_client()
+
+    async def attempt(attempt_timeout):
+        completion = await client.chat.completions.create(
+            model=settings.GEMMA_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=attempt_timeout,
+        )
+        metrics.record_usage(operation, completion.usage)
+        return completion.choices[0].message.content.strip()
+
+    deadline = timeout if timeout is not None else settings.GEMMA_TIMEOUT
+    with metrics.observe_call(operation):
+        response_text = await get_policy().acall(attempt, deadline, operation)
+
+    if cache and cacheable(response_text, validate):
+        await caches['gemma'].aset(key, response_text)
+    return response_text
+
+
+def stream(prompt, timeout=None, client=None, operation='default'):
+    """
+    Send a single user prompt to Gemma in stream mode and yield the response
+    text as it arrives. Opening the stream is retried like complete(); a
+    stream is never hedged, and fails without retry once it has started.
+    """
+    client = client or get_client()
+    policy = get_policy()
+
+    def attempt(attempt_timeout):
+        return client.chat.completions.create(
+            model=settings.GEMMA_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=attempt_timeout,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+    with metrics.observe_call(operation):
+        deadline = timeout if timeout is not None else settings.GEMMA_TIMEOUT
+        chunks = policy.call(attempt, deadline, operation, hedge=False)
+        try:
+            for chunk in chunks:
+                if chunk.usage is not None:
+                    metrics.record_usage(operation, chunk.usage)  # Sent with the last chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except RETRYABLE_ERRORS:
+            policy.breaker.record_failure()
+            raise
+        finally:
+            chunks.close()
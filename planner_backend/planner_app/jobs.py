@@ -0,0 +1,290 @@
+"""
+DB-backed queue for background daily plan generation.
+
+Jobs are rows in PlanGenerationJob, one per (goal, plan_date). Workers claim
+queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker
+threads or processes can drain the queue without an external broker.
+
+The same row is the in-flight lease for synchronous generation: the request
+that claims it calls Gemma, concurrent requests for the same goal and day wait
+for it to finish and share its plan instead of paying for the call again.
+"""
+import asyncio
+import logging
+import time
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import DailyPlan, Goal, PlanGenerationJob
+from .plan_generation import PlanGenerationError, agenerate_daily_plan, generate_daily_plan
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_GOAL_STATUSES = ['Pending', 'In Progress']
+GENERATION_ERROR_MESSAGE = "Failed to generate daily plan. Please try again later."
+
+
+class PlanGenerationInProgress(Exception):
+    """
+    Another request is still generating the plan and did not finish in time.
+    """
+
+    def __init__(self, job):
+        super().__init__("Daily plan generation is already in progress.")
+        self.job = job
+
+
+def enqueue_plan_generation(goal, plan_date, run_after=None):
+    """
+    Queue plan generation for a goal and day, optionally not before run_after.
+    A duplicate submission attaches to the existing job; a failed job is re-queued.
+    """
+    run_after = run_after or timezone.now()
+    job, created = PlanGenerationJob.objects.get_or_create(
+        goal=goal, plan_date=plan_date, defaults={'run_after': run_after}
+    )
+    if not created and job.status == 'Failed':
+        PlanGenerationJob.objects.filter(pk=job.pk, status='Failed').update(
+            status='Queued', error=None, attempts=0, run_after=run_after, updated_at=timezone.now()
+        )
+        job.refresh_from_db()
+    return job
+
+
+def claim_next_job():
+    """
+    Atomically claim the next due queued job (or a job whose worker died) and
+    mark it as running. Returns None when there is nothing to do right now.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.PLAN_JOB_STALE_AFTER)
+    with transaction.atomic():
+        job = (
+            PlanGenerationJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='Queued', run_after__lte=now) | Q(status='Running', updated_at__lt=stale_before))
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'Running'
+        job.attempts += 1
+        job.save(update_fields=['status', 'attempts', 'updated_at'])
+    return job
+
+
+def finish_job(job, status, plan=None, error=None):
+    job.status = status
+    job.plan = plan
+    job.error = error
+    job.save(update_fields=['status', 'plan', 'error', 'updated_at'])
+
+
+def generate_for_job(job, fast=False):
+    """
+    Generate the plan for a job whose lease the caller holds and record the
+    outcome on the job row. Errors are recorded and re-raised.
+    """
+    existing_plan = DailyPlan.objects.filter(goal=job.goal, plan_date=job.plan_date).first()
+    if existing_plan:
+        finish_job(job, 'Succeeded', plan=existing_plan)
+        return existing_plan
+
+    try:
+        daily_plan = generate_daily_plan(job.goal, job.plan_date, fast=fast)
+    except IntegrityError:
+        # Another path (e.g. the streaming endpoint) saved the plan in the meantime
+        daily_plan = DailyPlan.objects.get(goal=job.goal, plan_date=job.plan_date)
+    except PlanGenerationError as e:
+        finish_job(job, 'Failed', error=str(e))
+        raise
+    except Exception:
+        finish_job(job, 'Failed', error=GENERATION_ERROR_MESSAGE)
+        raise
+    finish_job(job, 'Succeeded', plan=daily_plan)
+    return daily_plan
+
+
+def run_job(job):
+    """
+    Generate the plan for a claimed job and record the outcome on the job row.
+    """
+    goal = job.goal
+
+    if goal.status not in ACTIVE_GOAL_STATUSES or not (goal.goal_start_date <= job.plan_date <= goal.goal_end_date):
+        finish_job(job, 'Failed', error="Goal is not active on the plan date.")
+        return job
+
+    if job.attempts > settings.PLAN_JOB_MAX_ATTEMPTS:
+        finish_job(job, 'Failed', error="Daily plan generation was interrupted too many times.")
+        return job
+
+    try:
+        generate_for_job(job)
+    except PlanGenerationError:
+        pass
+    except Exception as e:
+        logger.error(f"Error generating daily plan for job {job.id}: {e}")
+    return job
+
+
+def claim_generation(goal, plan_date):
+    """
+    Take the in-flight lease for generating the goal's plan on plan_date.
+    Returns (job, True) when the caller must generate the plan, or
+    (job, False) when another request or worker is running it or already has.
+    Queued, failed and stale jobs are taken over.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.PLAN_JOB_STALE_AFTER)
+    with transaction.atomic():
+        job, created = PlanGenerationJob.objects.select_for_update().get_or_create(
+            goal=goal, plan_date=plan_date, defaults={'status': 'Running', 'attempts': 1}
+        )
+        if created:
+            return job, True
+        if job.status == 'Succeeded' and job.plan_id is not None:
+            return job, False
+        if job.status == 'Running' and job.updated_at >= stale_before:
+            return job, False
+        job.status = 'Running'
+        job.attempts += 1
+        job.error = None
+        job.save(update_fields=['status', 'attempts', 'error', 'updated_at'])
+    return job, True
+
+
+def wait_for_generation(job, timeout=None):
+    """
+    Wait for the holder of the job's lease to finish and return its plan.
+    Raises PlanGenerationError if it failed and PlanGenerationInProgress if
+    it is still running after timeout seconds.
+    """
+    deadline = time.monotonic() + (timeout or settings.PLAN_SINGLE_FLIGHT_WAIT)
+    while True:
+        job.refresh_from_db(fields=['status', 'plan', 'error', 'updated_at'])
+        if job.status == 'Succeeded' and job.plan_id is not None:
+            return DailyPlan.objects.get(pk=job.plan_id)
+        if job.status == 'Failed':
+            raise PlanGenerationError(job.error or GENERATION_ERROR_MESSAGE)
+        if time.monotonic() >= deadline:
+            raise PlanGenerationInProgress(job)
+        time.sleep(settings.PLAN_SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+def generate_plan_once(goal, plan_date, fast=False):
+    """
+    Generate the goal's plan for plan_date at most once across concurrent
+    requests and workers: the first caller generates it, the others wait for
+    its result.
+    """
+    job, leader = claim_generation(goal, plan_date)
+    if not leader:
+        return wait_for_generation(job)
+    return generate_for_job(job, fast=fast)
+
+
+async def agenerate_for_job(job, goal, fast=False):
+    """
+    Async variant of generate_for_job() for the goal the job belongs to.
+    """
+    existing_plan = await DailyPlan.objects.filter(goal=goal, plan_date=job.plan_date).afirst()
+    if existing_plan:
+        await sync_to_async(finish_job)(job, 'Succeeded', plan=existing_plan)
+        return existing_plan
+
+    try:
+        daily_plan = await agenerate_daily_plan(goal, job.plan_date, fast=fast)
+    except IntegrityError:
+        daily_plan = await DailyPlan.objects.aget(goal=goal, plan_date=job.plan_date)
+    except PlanGenerationError as e:
+        await sync_to_async(finish_job)(job, 'Failed', error=str(e))
+        raise
+    except Exception:
+        await sync_to_async(finish_job)(job, 'Failed', error=GENERATION_ERROR_MESSAGE)
+        raise
+    await sync_to_async(finish_job)(job, 'Succeeded', plan=daily_plan)
+    return daily_plan
+
+
+async def await_generation(job, timeout=None):
+    """
+    Async variant of wait_for_generation(): polls without holding a thread.
+    """
+    deadline = time.monotonic() + (timeout or settings.PLAN_SINGLE_FLIGHT_WAIT)
+    while True:
+        await job.arefresh_from_db(fields=['status', 'plan', 'error', 'updated_at'])
+        if job.status == 'Succeeded' and job.plan_id is not None:
+            return await DailyPlan.objects.aget(pk=job.plan_id)
+        if job.status == 'Failed':
+            raise PlanGenerationError(job.error or GENERATION_ERROR_MESSAGE)
+        if time.monotonic() >= deadline:
+            raise PlanGenerationInProgress(job)
+        await asyncio.sleep(settings.PLAN_SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+async def agenerate_plan_once(goal, plan_date, fast=False):
+    """
+    Async variant of generate_plan_once(), sharing the same lease.
+    """
+    job, leader = await sync_to_async(claim_generation)(goal, plan_date)
+    if not leader:
+        return await await_generation(job)
+    return await agenerate_for_job(job, goal, fast=fast)
+
+
+def work(stop_when_idle=False, poll_interval=None):
+    """
+    Claim and run jobs until no queued jobs are left (stop_when_idle) or forever.
+    Jobs scheduled for later are waited for, not skipped.
+    """
+    poll_interval = poll_interval or settings.PLAN_JOB_POLL_INTERVAL
+    try:
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if stop_when_idle and not PlanGenerationJob.objects.filter(status='Queued').exists():
+                    return
+                time.sleep(poll_interval)
+                continue
+            run_job(job)
+    finally:
+        connection.close()
+
+
+def process_jobs(workers=None, stop_when_idle=False, poll_interval=None):
+    """
+    Run a pool of worker threads over the job queue.
+    """
+    workers = workers or settings.PLAN_JOB_WORKERS
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plan-job') as executor:
+        futures = [executor.submit(work, stop_when_idle, poll_interval) for _ in range(workers)]
+        for future in futures:
+            future.result()
+
+
+def enqueue_pregeneration(plan_date, window_start, window_seconds):
+    """
+    Queue plan generation for every active goal that covers plan_date and has
+    no plan yet, spreading the jobs evenly over the window. Goals that already
+    have a job keep it, so re-running after a crash only fills the gaps.
+    """
+    goals = list(
+        Goal.objects.filter(
+            status__in=ACTIVE_GOAL_STATUSES,
+            goal_start_date__lte=plan_date,
+            goal_end_date__gte=plan_date,
+        )
+        .exclude(daily_plans__plan_date=plan_date)
+        .order_by('id')
+    )
+    spacing = window_seconds / len(goals) if goals else 0
+    jobs = []
+    for index, goal in enumerate(goals):
+        run_after = window_start + timedelta(seconds=index * spacing)
+        jobs.append(enqueue_plan_generation(goal, plan_date, run_after=run_after))
+    return jobs
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from planner_app.analytics import backfill_daily_progress
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily progress rollup used by the analytics endpoint from the plans' activities."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Goals per batch.")
+
+    def handle(self, *args, **options):
+        written = backfill_daily_progress(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily progress rows."))
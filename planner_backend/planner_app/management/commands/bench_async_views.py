@@ -0,0 +1,141 @@
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from planner_app import gemma_client
+from planner_app.management.stub_llm import StubLLMServer
+from planner_app.models import Goal
+
+# Late in the day so the activities are still ahead when the benchmark runs
+PLAN_REPLY = json.dumps({
+    "activities": [
+        {"activity_name": "Review notes", "start_time": "22:00", "end_time": "22:30", "notes": "Benchmark."},
+        {"activity_name": "Plan tomorrow", "start_time": "23:00", "end_time": "23:20", "notes": "Benchmark."},
+    ],
+    "notes": "Benchmark plan.",
+})
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the goal creation and daily plan generation endpoints against a local stub LLM: "
+        "the DRF views through Django's WSGI handler on a fixed number of request threads, as under "
+        "the gunicorn WSGI workers, versus the async views through the ASGI handler on a single event "
+        "loop, as in one uvicorn worker. Creates throwaway users, deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Concurrent requests per scenario.")
+        parser.add_argument('--latency', type=float, default=1.0, help="Simulated LLM latency in seconds.")
+        parser.add_argument(
+            '--threads', type=int, default=6, help="Request threads of the sync scenarios (3 workers x 2 threads)."
+        )
+
+    def handle(self, *args, **options):
+        requests, latency, threads = options['requests'], options['latency'], options['threads']
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        sync_users = self.create_users(f"{prefix}-sync", requests)
+        async_users = self.create_users(f"{prefix}-async", requests)
+        settings_overrides = {
+            'GEMMA_API_KEY': 'stub',
+            'GEMMA_GOAL_ENRICHMENT_DEADLINE': latency * requests + 30,
+            'GEMMA_PLAN_TIMEOUT': latency * requests + 30,
+            'QUOTE_POOL_BACKGROUND_REFILL': False,
+        }
+        try:
+            with StubLLMServer(reply="7", latency=latency) as stub, \
+                    override_settings(GEMMA_BASE_URL=stub.base_url, **settings_overrides):
+                self.report("goals, sync", stub, lambda: self.run_sync(
+                    [('/planner/goals/', self.goal_payload(user), token) for user, token in sync_users], threads
+                ))
+                self.report("goals, async", stub, lambda: asyncio.run(self.run_async(
+                    [('/planner/async/goals/', self.goal_payload(user), token) for user, token in async_users]
+                )))
+
+            with StubLLMServer(reply=PLAN_REPLY, latency=latency) as stub, \
+                    override_settings(GEMMA_BASE_URL=stub.base_url, **settings_overrides):
+                self.report("plans, sync", stub, lambda: self.run_sync(
+                    [(f'/planner/generate-daily-plan/{goal_id}/', None, token)
+                     for goal_id, token in self.goals(sync_users)], threads
+                ))
+                self.report("plans, async", stub, lambda: asyncio.run(self.run_async(
+                    [(f'/planner/async/generate-daily-plan/{goal_id}/', None, token)
+                     for goal_id, token in self.goals(async_users)]
+                )))
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def create_users(self, prefix, count):
+        User.objects.bulk_create([User(username=f"{prefix}-{n}") for n in range(count)])
+        users = User.objects.filter(username__startswith=f"{prefix}-").order_by('id')
+        return [(user, f"Bearer {AccessToken.for_user(user)}") for user in users]
+
+    def goal_payload(self, user):
+        # Distinct goals, so no prompt is answered from the response cache
+        start = timezone.now().date()
+        return {
+            "goal_name": f"Goal of {user.username}", "goal_description": "Benchmark goal.",
+            "goal_start_date": str(start), "goal_end_date": str(start + timedelta(days=14)),
+        }
+
+    def goals(self, users):
+        tokens = {user.id: token for user, token in users}
+        goals = Goal.objects.filter(user_id__in=tokens).values_list('id', 'user_id')
+        return [(goal_id, tokens[user_id]) for goal_id, user_id in goals]
+
+    def run_sync(self, calls, threads):
+        def send(call):
+            path, payload, token = call
+            started = time.perf_counter()
+            response = Client().post(
+                path, payload or {}, content_type='application/json', headers={"Authorization": token}
+            )
+            return time.perf_counter() - started, response.status_code
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(send, calls))
+
+    async def run_async(self, calls):
+        client = AsyncClient()
+
+        async def send(call):
+            path, payload, token = call
+            started = time.perf_counter()
+            response = await client.post(
+                path, payload or {}, content_type='application/json', headers={"Authorization": token}
+            )
+            return time.perf_counter() - started, response.status_code
+
+        try:
+            return await asyncio.gather(*(send(call) for call in calls))
+        finally:
+            await gemma_client.aclose_client()  # The async client belongs to this event loop
+
+    def report(self, label, stub, run):
+        caches['gemma'].clear()
+        gemma_client.close_client()
+        stub.reset_peak()
+        started = time.perf_counter()
+        # Per-request time excludes the wait for a free request thread in the sync scenarios
+        results = run()
+        wall = time.perf_counter() - started
+        timings = sorted(elapsed for elapsed, _ in results)
+        failed = sum(1 for _, status in results if status >= 300)
+        self.stdout.write(
+            f"{label:<14} requests={len(results)} wall={wall:.2f}s "
+            f"throughput={len(results) / wall:.1f}/s "
+            f"p50={statistics.median(timings) * 1000:.0f}ms "
+            f"peak_in_flight={stub.peak_in_flight} failed={failed}"
+        )
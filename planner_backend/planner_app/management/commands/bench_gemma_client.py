@@ -0,0 +1,57 @@
+import statistics
+import time
+
+import openai
+from django.core.management.base import BaseCommand
+
+from planner_app import gemma_client
+from planner_app.management.stub_llm import StubLLMServer
+
+
+class Command(BaseCommand):
+    help = "Benchmark per-call Gemma latency with and without connection reuse against a local stub server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help="Number of calls per scenario.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Simulated server latency in seconds.")
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+
+        with StubLLMServer(latency=options['latency']) as stub:
+            # Old behaviour: a brand-new client (and connection pool) per call
+            def fresh_client_call():
+                client = openai.OpenAI(base_url=stub.base_url, api_key='stub')
+                try:
+                    return gemma_client.complete("ping", client=client)
+                finally:
+                    client.close()
+
+            self.run_scenario("new client per call", fresh_client_call, calls, stub)
+
+            # New behaviour: one pooled client shared by every call
+            shared = gemma_client.build_client(base_url=stub.base_url, api_key='stub')
+            try:
+                self.run_scenario(
+                    "shared pooled client", lambda: gemma_client.complete("ping", client=shared), calls, stub
+                )
+            finally:
+                shared.close()
+
+    def run_scenario(self, label, call, calls, stub):
+        call()  # Warm up imports and the first connection
+        connections_before = stub.connections
+        timings = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        timings.sort()
+        self.stdout.write(
+            f"{label:<22} calls={calls} "
+            f"mean={statistics.mean(timings):.2f}ms "
+            f"p50={timings[len(timings) // 2]:.2f}ms "
+            f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+            f"connections={stub.connections - connections_before}"
+        )
@@ -0,0 +1,162 @@
+import random
+import statistics
+import time
+from datetime import date, time as dt_time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Notification
+from planner_app.models import DailyPlan, DailyPlanActivity, DailyRoutine, Goal, PlanGenerationJob
+
+BENCH_USER_PREFIX = 'bench_user_'
+ACTIVE_GOAL_STATUSES = ['Pending', 'In Progress']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday', 'Weekday', 'Weekend']
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN and time the planner's hot queries with and without their indexes. "
+        "Use a scratch database: --seed-users inserts a large synthetic dataset, and the "
+        "indexes are dropped inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-users', type=int, default=0, help="Seed this many synthetic users first.")
+        parser.add_argument('--goals-per-user', type=int, default=4)
+        parser.add_argument('--days-per-goal', type=int, default=30)
+        parser.add_argument('--random-seed', type=int, default=42)
+        parser.add_argument('--repeat', type=int, default=50, help="Runs per query for the timing.")
+        parser.add_argument('--analyze', action='store_true', help="Use EXPLAIN ANALYZE (PostgreSQL only).")
+
+    def handle(self, *args, **options):
+        if options['seed_users']:
+            self.seed(options['seed_users'], options['goals_per_user'], options['days_per_goal'], options['random_seed'])
+
+        user = User.objects.filter(username__startswith=BENCH_USER_PREFIX).order_by('-id').first()
+        if user is None:
+            raise CommandError("No benchmark users found. Run with --seed-users first.")
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')  # Fresh planner statistics
+
+        queries = self.queries(user)
+        with_indexes = self.measure(queries, options['repeat'], options['analyze'])
+
+        connection.disable_constraint_checking()  # SQLite can only alter tables with FK checks off
+        try:
+            with transaction.atomic():
+                self.drop_indexes()
+                without_indexes = self.measure(queries, options['repeat'], options['analyze'])
+                transaction.set_rollback(True)
+        finally:
+            connection.enable_constraint_checking()
+
+        for label in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label}"))
+            for heading, results in (("without indexes", without_indexes), ("with indexes", with_indexes)):
+                plan, median = results[label]
+                self.stdout.write(f"-- {heading}: median {median:.3f}ms")
+                self.stdout.write(plan)
+
+        self.stdout.write("\nSummary (median ms, without -> with indexes):")
+        for label in queries:
+            before, after = without_indexes[label][1], with_indexes[label][1]
+            self.stdout.write(f"  {label:<36} {before:>9.3f} -> {after:>9.3f}")
+
+    def queries(self, user):
+        """
+        The query shapes behind each endpoint, for the given user.
+        """
+        goal = Goal.objects.filter(user=user).order_by('-id').first()
+        plan = DailyPlan.objects.filter(goal=goal).order_by('-plan_date').first()
+        return {
+            "RecentGoalView": Goal.objects.filter(user=user, status__in=ACTIVE_GOAL_STATUSES).order_by('-id')[:1],
+            "GoalSerializer.validate": Goal.objects.filter(user=user, status__in=ACTIVE_GOAL_STATUSES).values('id')[:1],
+            "Plan exists for goal and day": DailyPlan.objects.filter(goal=goal, plan_date=plan.plan_date).values('id')[:1],
+            "Busy-time index routines": DailyRoutine.objects.filter(user=user, days_of_week__in=['Monday', 'Weekday']),
+            "Completed activities of a plan": DailyPlanActivity.objects.filter(plan=plan, status=True),
+            "Unread notifications": Notification.objects.filter(user=user, is_read=False).order_by('-created_at'),
+            "Plan job claim": PlanGenerationJob.objects.filter(
+                status='Queued', run_after__lte=timezone.now()
+            ).order_by('run_after', 'id')[:1],
+        }
+
+    def measure(self, queries, repeat, analyze):
+        results = {}
+        for label, queryset in queries.items():
+            if analyze and connection.vendor == 'postgresql':
+                plan = queryset.explain(analyze=True)
+            else:
+                plan = queryset.explain()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())  # .all() clones, so every run hits the database
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = (plan, statistics.median(timings))
+        return results
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model in (Goal, DailyPlan, DailyRoutine, DailyPlanActivity, Notification, PlanGenerationJob):
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+            for constraint in DailyPlan._meta.constraints:
+                editor.remove_constraint(DailyPlan, constraint)
+
+    def seed(self, users, goals_per_user, days_per_goal, random_seed):
+        """
+        Insert a reproducible synthetic dataset: per user, routines,
+        notifications and goals (the newest one active) with a plan and six
+        activities for every day.
+        """
+        rng = random.Random(random_seed)
+        password = make_password('password')
+        first = User.objects.filter(username__startswith=BENCH_USER_PREFIX).count()
+        start_date = date(2024, 1, 1)
+
+        for number in range(first, first + users):
+            with transaction.atomic():
+                user = User.objects.create(username=f"{BENCH_USER_PREFIX}{number}", password=password)
+                DailyRoutine.objects.bulk_create([
+                    DailyRoutine(
+                        user=user, activity_name=f"Routine {n}", start_time=dt_time(hour, 0),
+                        end_time=dt_time(hour + 1, 0), days_of_week=rng.choice(DAYS),
+                    )
+                    for n, hour in enumerate(rng.sample(range(6, 22), 8))
+                ])
+                Notification.objects.bulk_create([
+                    Notification(user=user, message=f"Notification {n}", is_read=rng.random() < 0.8)
+                    for n in range(40)
+                ])
+
+                for goal_number in range(goals_per_user):
+                    goal_start = start_date + timedelta(days=goal_number * days_per_goal)
+                    active = goal_number == goals_per_user - 1
+                    goal = Goal.objects.create(
+                        user=user, goal_name=f"Goal {goal_number}", goal_description="Benchmark goal.",
+                        goal_start_date=goal_start, goal_end_date=goal_start + timedelta(days=days_per_goal - 1),
+                        status='In Progress' if active else rng.choice(['Completed', 'Expired', 'Cancelled']),
+                    )
+                    plans = DailyPlan.objects.bulk_create([
+                        DailyPlan(goal=goal, plan_date=goal_start + timedelta(days=day), notes="Keep going.")
+                        for day in range(days_per_goal)
+                    ])
+                    if not plans[0].pk:
+                        plans = list(DailyPlan.objects.filter(goal=goal).order_by('plan_date'))
+                    DailyPlanActivity.objects.bulk_create([
+                        DailyPlanActivity(
+                            plan=plan, activity_name=f"Activity {n}", start_time=dt_time(7 + n * 2, 0),
+                            end_time=dt_time(7 + n * 2, 45), status=rng.random() < 0.6,
+                        )
+                        for plan in plans
+                        for n in range(6)
+                    ])
+
+            if (number - first + 1) % 100 == 0:
+                self.stdout.write(f"Seeded {number - first + 1}/{users} users.")
+        self.stdout.write(self.style.SUCCESS(f"Seeded {users} users."))
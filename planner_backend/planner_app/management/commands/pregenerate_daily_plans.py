@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from planner_app.jobs import enqueue_pregeneration, process_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue next-day daily plan generation for every active goal, spread over a time window. "
+        "Safe to re-run: goals that already have a plan or a job are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Plan date (YYYY-MM-DD). Defaults to tomorrow.")
+        parser.add_argument(
+            '--window-hours', type=float, default=settings.PLAN_PREGENERATION_WINDOW_HOURS,
+            help="Hours over which the jobs are spread, starting now."
+        )
+        parser.add_argument('--run', action='store_true', help="Also process the jobs in this process.")
+        parser.add_argument('--workers', type=int, default=None, help="Worker threads when using --run.")
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                plan_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("--date must be in YYYY-MM-DD format.")
+        else:
+            plan_date = timezone.now().date() + timedelta(days=1)
+
+        jobs = enqueue_pregeneration(plan_date, timezone.now(), options['window_hours'] * 3600)
+        pending = sum(1 for job in jobs if job.status in ('Queued', 'Running'))
+        self.stdout.write(f"{len(jobs)} goals need a plan for {plan_date}, {pending} jobs pending.")
+
+        if options['run']:
+            process_jobs(workers=options['workers'], stop_when_idle=True)
+            self.stdout.write(self.style.SUCCESS(f"Finished pre-generating plans for {plan_date}."))
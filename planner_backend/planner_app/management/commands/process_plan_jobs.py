@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from planner_app.jobs import process_jobs
+
+
+class Command(BaseCommand):
+    help = "Run background workers that generate queued daily plans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Number of worker threads.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Seconds to wait when idle.")
+
+    def handle(self, *args, **options):
+        process_jobs(
+            workers=options['workers'],
+            stop_when_idle=options['once'],
+            poll_interval=options['poll_interval'],
+        )
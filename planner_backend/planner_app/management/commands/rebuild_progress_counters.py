@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from planner_app.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized activity and day counters on plans and goals, reporting any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report drift, without fixing it. Exits with an error if any counter is off."
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help="Goals per batch.")
+
+    def handle(self, *args, **options):
+        drifted_plans, drifted_goals = rebuild_counters(fix=not options['check'], batch_size=options['batch_size'])
+
+        if options['check']:
+            if drifted_plans or drifted_goals:
+                raise CommandError(f"Counter drift: {drifted_plans} plans and {drifted_goals} goals are off.")
+            self.stdout.write(self.style.SUCCESS("All progress counters are correct."))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt progress counters: fixed {drifted_plans} plans and {drifted_goals} goals."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from planner_app.quotes import refill_pool
+
+
+class Command(BaseCommand):
+    help = "Top up the pre-generated motivational quote pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=None, help="Target pool size.")
+
+    def handle(self, *args, **options):
+        added = refill_pool(options['size'])
+        self.stdout.write(self.style.SUCCESS(f"Added {added} quotes to the pool."))
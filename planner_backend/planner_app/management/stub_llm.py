@@ -0,0 +1,139 @@
+"""
+Local OpenAI-compatible stub server used by the benchmark commands.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 1024  # Load tests open hundreds of connections at once
+
+
+class StubLLMServer:
+    """
+    Minimal /chat/completions server that answers every request with a fixed
+    reply after an optional delay, and counts the requests and TCP connections
+    it accepts and the most requests it had in flight at once.
+    Streaming requests get the reply as server-sent event chunks of
+    chunk_size characters, chunk_delay seconds apart.
+    """
+
+    def __init__(self, reply="7", latency=0.0, host='127.0.0.1', port=0, chunk_size=8, chunk_delay=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = StubHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Allow keep-alive
+            disable_nagle_algorithm = True
+            wbufsize = -1  # Send headers and body in one write
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                try:
+                    self.answer()
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def answer(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if request.get('stream'):
+                    self.send_stream()
+                    return
+                body = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": stub.reply},
+                    }],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for start in range(0, len(stub.reply), stub.chunk_size):
+                    chunk = {
+                        "id": "stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": "stub",
+                        "choices": [{
+                            "index": 0,
+                            "finish_reason": None,
+                            "delta": {"content": stub.reply[start:start + stub.chunk_size]},
+                        }],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    if stub.chunk_delay:
+                        time.sleep(stub.chunk_delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output clean
+
+        return Handler
+
+    def reset_peak(self):
+        with self._lock:
+            self.peak_in_flight = self.in_flight
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
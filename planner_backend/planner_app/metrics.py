@@ -0,0 +1,106 @@
+"""
+Prometheus metrics for the Gemma calls and what becomes of their answers.
+
+The metrics are prometheus_client counters and histograms, updated in memory
+on the request path. GET /metrics renders them in the Prometheus text format.
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers; each process then writes its values to
+memory-mapped files there, and /metrics aggregates them.
+
+Operations are the call sites: plan, feasibility, notes and quotes.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import openai
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from .profiling import record_llm_time
+from .resilience import CircuitOpen
+
+GEMMA_CALL_DURATION = Histogram(
+    'gemma_call_duration_seconds', "Duration of Gemma calls, retries and hedges included.",
+    ['operation', 'outcome'], buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+GEMMA_TOKENS = Counter('gemma_tokens', "Tokens reported in completion.usage.", ['operation', 'kind'])
+GEMMA_CALL_ERRORS = Counter('gemma_call_errors', "Failed Gemma calls by error type.", ['operation', 'error'])
+GEMMA_CACHE_HITS = Counter('gemma_cache_hits', "Gemma calls answered from the response cache.", ['operation'])
+GEMMA_CACHE_MISSES = Counter('gemma_cache_misses', "Cacheable Gemma calls not found in the cache.", ['operation'])
+GEMMA_FALLBACKS = Counter('gemma_fallbacks', "Results served by a local fallback instead of Gemma.", ['operation'])
+GEMMA_PARSE_FAILURES = Counter('gemma_parse_failures', "Gemma responses that could not be parsed.", ['operation'])
+PLAN_ACTIVITIES_REJECTED = Counter(
+    'plan_activities_rejected', "Generated activities rejected by validation.", ['reason']
+)
+
+
+def error_type(error):
+    """
+    Short label for a failed call's exception.
+    """
+    if isinstance(error, CircuitOpen):
+        return 'circuit_open'
+    if isinstance(error, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(error, openai.APIConnectionError):
+        return 'connection'
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, openai.APIStatusError):
+        return 'status'
+    return 'other'
+
+
+@contextmanager
+def observe_call(operation):
+    """
+    Time the Gemma call in the block and count it by outcome; the time also
+    goes to the request's profile when it is sampled.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        elapsed = time.perf_counter() - started
+        GEMMA_CALL_DURATION.labels(operation, 'error').observe(elapsed)
+        GEMMA_CALL_ERRORS.labels(operation, error_type(e)).inc()
+        record_llm_time(elapsed)
+        raise
+    elapsed = time.perf_counter() - started
+    GEMMA_CALL_DURATION.labels(operation, 'ok').observe(elapsed)
+    record_llm_time(elapsed)
+
+
+def record_usage(operation, usage):
+    if usage is not None:
+        GEMMA_TOKENS.labels(operation, 'prompt').inc(usage.prompt_tokens or 0)
+        GEMMA_TOKENS.labels(operation, 'completion').inc(usage.completion_tokens or 0)
+
+
+def get_registry():
+    """
+    The registry to read: every worker's values in multiprocess mode, else this process's.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. The scraper must send METRICS_TOKEN as a
+    bearer token; without a token configured only staff users logged in to
+    the admin can read it.
+    """
+    token = settings.METRICS_TOKEN
+    scraper = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}")
+    if not scraper and not request.user.is_staff:
+        return HttpResponse(status=401 if token else 403)
+
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 # Daily Routine
@@ -21,6 +22,14 @@ class DailyRoutine(models.Model):
     )
     days_of_week = models.CharField(max_length=20, choices=DAYS_OF_WEEK_CHOICES, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Busy-time index: a user's routines for one weekday and its day type
+            models.Index(fields=['user', 'days_of_week'], name='routine_user_days_idx'),
+            # Cursor pagination of a user's routines
+            models.Index(fields=['user', '-id'], name='routine_user_recent_idx'),
+        ]
+
     def __str__(self):
         return f"{self.activity_name} ({self.start_time} - {self.end_time})"
 
@@ -45,6 +54,23 @@ class Goal(models.Model):
     model_notes = models.TextField(null=True, blank=True)
     feasibility_score = models.IntegerField(default=0)
     status = models.CharField(max_length=100, choices=STATUS_CHOICES, default='Pending')
+    progress_summary = models.JSONField(default=dict, blank=True)  # Rolled up by planner_app.progress
+    # Denormalized counters, kept up to date by planner_app.counters
+    total_activities = models.PositiveIntegerField(default=0)
+    completed_activities = models.PositiveIntegerField(default=0)
+    completed_days = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Active goals only: RecentGoalView and the one-active-goal check in GoalSerializer
+            models.Index(
+                fields=['user', '-id'],
+                name='goal_active_user_recent_idx',
+                condition=models.Q(status__in=['Pending', 'In Progress']),
+            ),
+            # Cursor pagination of all of a user's goals
+            models.Index(fields=['user', '-id'], name='goal_user_recent_idx'),
+        ]
 
     def __str__(self):
         return self.goal_name
@@ -64,6 +90,14 @@ class DailyPlan(models.Model):
     plan_date = models.DateField()
     notes = models.TextField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    # Denormalized counters, kept up to date by planner_app.counters
+    total_activities = models.PositiveIntegerField(default=0)
+    completed_activities = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['goal', 'plan_date'], name='unique_daily_plan_per_goal_day'),
+        ]
 
     @property
     def day_number(self):
@@ -86,6 +120,92 @@ class DailyPlanActivity(models.Model):
     status = models.BooleanField(default=False)
     notes = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['plan', 'status'], name='activity_plan_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.activity_name} ({self.status})"
 
+
+
+# Daily progress rollup per (user, goal, date), for the analytics endpoint
+
+class DailyProgress(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_progress')
+    goal = models.ForeignKey(Goal, on_delete=models.CASCADE, related_name='daily_progress')
+    date = models.DateField()
+    planned_activities = models.PositiveIntegerField(default=0)
+    completed_activities = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also the index for per-goal date ranges
+            models.UniqueConstraint(fields=['user', 'goal', 'date'], name='unique_daily_progress'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'], name='daily_progress_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.goal} on {self.date}: {self.completed_activities}/{self.planned_activities}"
+
+
+# Per-user data version stamps, for cache keys and ETags (see planner_app.versions)
+
+class DataVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='data_version')
+    goals = models.PositiveBigIntegerField(default=0)  # Goals, plans and activities
+    routines = models.PositiveBigIntegerField(default=0)
+    notifications = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Data versions for {self.user}"
+
+
+# Background plan generation job (DB-backed queue)
+
+class PlanGenerationJob(models.Model):
+    STATUS_CHOICES = (
+        ('Queued', 'Queued'),
+        ('Running', 'Running'),
+        ('Succeeded', 'Succeeded'),
+        ('Failed', 'Failed'),
+    )
+
+    goal = models.ForeignKey(Goal, on_delete=models.CASCADE, related_name='generation_jobs')
+    plan_date = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Queued')
+    plan = models.ForeignKey(DailyPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # Not claimed before this time
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['goal', 'plan_date'], name='unique_generation_job_per_goal_day'),
+        ]
+        indexes = [
+            # Workers only ever look for queued or running jobs, in run_after order
+            models.Index(
+                fields=['run_after', 'id'],
+                name='plan_job_pending_idx',
+                condition=models.Q(status__in=['Queued', 'Running']),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Plan job for {self.goal} on {self.plan_date} ({self.status})"
+
+
+# Pre-generated motivational quotes, taken by new daily plans
+
+class MotivationalQuote(models.Model):
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.text[:50]
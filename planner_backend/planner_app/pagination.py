@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, newest first: each page is an index
+    range scan however many rows the user has. Opt-in, so existing clients
+    that expect a plain list keep getting one: pass ?page_size= (max 100) or
+    follow a ?cursor= from a previous page to get a paginated response.
+    """
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,42 @@
+"""
+Calendar payload: every plan of a user's goals in a date range, with its
+activities, in exactly two queries (plans, then activities, both filtered by
+user and date range rather than by a list of plan ids). Rows are read with
+values() and the payload leaves out notes to keep a month of plans small.
+"""
+from .models import DailyPlan, DailyPlanActivity
+
+
+def plan_calendar(user_id, start, end, goal_id=None):
+    plans = DailyPlan.objects.filter(goal__user_id=user_id, plan_date__range=(start, end))
+    activities = DailyPlanActivity.objects.filter(plan__goal__user_id=user_id, plan__plan_date__range=(start, end))
+    if goal_id is not None:
+        plans = plans.filter(goal_id=goal_id)
+        activities = activities.filter(plan__goal_id=goal_id)
+
+    activities_by_plan = {}
+    for activity_id, plan_id, name, start_time, end_time, done in activities.order_by(
+        'plan_id', 'start_time', 'id'
+    ).values_list('id', 'plan_id', 'activity_name', 'start_time', 'end_time', 'status'):
+        activities_by_plan.setdefault(plan_id, []).append({
+            "id": activity_id,
+            "activity_name": name,
+            "start_time": start_time.strftime('%H:%M'),
+            "end_time": end_time.strftime('%H:%M'),
+            "status": done,
+        })
+
+    return [
+        {
+            "id": plan['id'],
+            "goal": plan['goal_id'],
+            "plan_date": plan['plan_date'],
+            "status": plan['status'],
+            "total_activities": plan['total_activities'],
+            "completed_activities": plan['completed_activities'],
+            "activities": activities_by_plan.get(plan['id'], []),
+        }
+        for plan in plans.order_by('plan_date', 'goal_id').values(
+            'id', 'goal_id', 'plan_date', 'status', 'total_activities', 'completed_activities'
+        )
+    ]
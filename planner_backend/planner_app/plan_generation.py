@@ -0,0 +1,223 @@
+import re
+import json
+import logging
+from datetime import datetime
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import DailyPlan, DailyPlanActivity
+from .counters import add_activities
+from .prompt_context import build_plan_context
+from .scheduler import build_local_plan
+from . import gemma_client, metrics
+
+logger = logging.getLogger(__name__)
+
+PARSE_ERROR_MESSAGE = "Failed to parse AI response. Please try again later."
+NO_ACTIVITIES_ERROR_MESSAGE = "No valid activities were generated. Please try again later."
+
+
+class PlanGenerationError(Exception):
+    """
+    Raised when Gemma does not return a usable daily plan.
+    """
+
+
+def build_plan_prompt(goal, plan_date, context):
+    """
+    Build the Gemma prompt for a goal's daily plan on the given date.
+    """
+    today = timezone.now().date()
+    day_label = "today" if plan_date == today else str(plan_date)
+    busy_label = "Today" if plan_date == today else f"On {plan_date}"
+
+    return (
+        f"Based on the following goal, progress, and user's busy times, generate a daily plan for {day_label} with at least 5 activities, "
+        f"scheduled outside of the user's busy times. "
+        f"Goal Name: '{goal.goal_name}'. "
+        f"Goal Description: '{goal.goal_description}'. "
+        f"Goal Start Date: {goal.goal_start_date}. "
+        f"Goal End Date: {goal.goal_end_date}. "
+        f"Completed Activities So Far: {context['completed_activities_count']}. "
+        f"User's Busy Times {busy_label}: {json.dumps(context['busy_times'])}. "
+        f"Progress So Far: {context['progress_summary']} "
+        f"Your response must be valid JSON only, with the following structure:\n"
+        f"{{\n"
+        f"  \"notes\": \"string\",\n"
+        f"  \"activities\": [\n"
+        f"    {{\n"
+        f"      \"activity_name\": \"string\",\n"
+        f"      \"start_time\": \"HH:MM\" (24-hour format),\n"
+        f"      \"end_time\": \"HH:MM\" (24-hour format),\n"
+        f"      \"notes\": \"string\"\n"
+        f"    }},\n"
+        f"    ...\n"
+        f"  ]\n"
+        f"}}\n"
+        f"Ensure that 'start_time' and 'end_time' are valid times in 24-hour format (HH:MM). "
+        f"Ensure that none of the activities overlap with the user's busy times. "
+        f"If generating a plan for today, ensure that 'start_time' is greater than the current time ({timezone.now().strftime('%H:%M')}). "
+        f"Do not include any explanation or additional text. Only output the JSON data."
+    )
+
+
+def parse_plan_response(response_text):
+    """
+    Extract the JSON plan object from the raw Gemma response.
+    """
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if not json_match:
+        logger.error("No JSON content found in AI response.")
+        metrics.GEMMA_PARSE_FAILURES.labels('plan').inc()
+        raise PlanGenerationError(PARSE_ERROR_MESSAGE)
+    try:
+        return json.loads(json_match.group(0))
+    except json.JSONDecodeError as e:
+        metrics.GEMMA_PARSE_FAILURES.labels('plan').inc()
+        logger.error(f"Invalid JSON response from AI: {e}")
+        logger.error(f"AI response was: {response_text}")
+        raise PlanGenerationError(PARSE_ERROR_MESSAGE)
+
+
+def build_activity(daily_plan, activity, busy_index):
+    """
+    Validate one AI-generated activity and return an unsaved DailyPlanActivity,
+    or None if it must be skipped.
+    """
+    time_format = "%H:%M"
+    try:
+        # Parse and validate start_time and end_time
+        start_time_obj = datetime.strptime(activity["start_time"], time_format).time()
+        end_time_obj = datetime.strptime(activity["end_time"], time_format).time()
+
+        # Ensure start_time is before end_time
+        if start_time_obj >= end_time_obj:
+            logger.error(
+                f"Start time {start_time_obj} is not before end time {end_time_obj} in activity '{activity['activity_name']}'")
+            metrics.PLAN_ACTIVITIES_REJECTED.labels('end_before_start').inc()
+            return None  # Skip invalid activity
+
+        # If plan date is today, ensure start_time is after current time
+        current_time = timezone.now().time()
+        if daily_plan.plan_date == timezone.now().date() and start_time_obj <= current_time:
+            logger.error(
+                f"Start time {start_time_obj} is not after current time {current_time} in activity '{activity['activity_name']}'")
+            metrics.PLAN_ACTIVITIES_REJECTED.labels('in_the_past').inc()
+            return None  # Skip activity that has already passed
+
+        # Check for overlaps with user's busy times
+        overlap = busy_index.find_overlap(start_time_obj, end_time_obj)
+        if overlap:
+            busy_name, busy_start, busy_end = overlap
+            logger.error(
+                f"Activity '{activity['activity_name']}' overlaps with busy time '{busy_name}' "
+                f"from {busy_start // 60:02d}:{busy_start % 60:02d} to {busy_end // 60:02d}:{busy_end % 60:02d}")
+            metrics.PLAN_ACTIVITIES_REJECTED.labels('busy_overlap').inc()
+            return None  # Skip activities that overlap with busy times
+
+        return DailyPlanActivity(
+            plan=daily_plan,
+            activity_name=activity["activity_name"],
+            start_time=start_time_obj,
+            end_time=end_time_obj,
+            notes=activity.get("notes", ""),
+            status=False
+        )
+    except (KeyError, ValueError, TypeError) as e:
+        logger.error(f"Error parsing activity data: {e}")
+        metrics.PLAN_ACTIVITIES_REJECTED.labels('malformed').inc()
+        return None  # Skip invalid activity
+
+
+def save_plan(goal, plan_date, daily_plan_data, busy_index):
+    """
+    Validate the plan's activities and store the plan with them in one
+    transaction. Raises PlanGenerationError if no activity is valid.
+    """
+    with transaction.atomic():
+        daily_plan = DailyPlan.objects.create(
+            goal=goal,
+            plan_date=plan_date,
+            status='Pending',
+            notes=daily_plan_data.get("notes", "")
+        )
+
+        # Prepare activity instances for bulk creation
+        activity_instances = []
+        for activity in daily_plan_data.get("activities", []):
+            instance = build_activity(daily_plan, activity, busy_index)
+            if instance is not None:
+                activity_instances.append(instance)
+
+        if not activity_instances:
+            logger.error("No valid activities to create.")
+            raise PlanGenerationError(NO_ACTIVITIES_ERROR_MESSAGE)
+
+        # Bulk create activities
+        DailyPlanActivity.objects.bulk_create(activity_instances)
+        add_activities(daily_plan, len(activity_instances))
+
+    return daily_plan
+
+
+def generate_daily_plan(goal, plan_date, fast=False):
+    """
+    Ask Gemma for the goal's plan on plan_date, validate the activities and
+    store the plan with its activities. When Gemma fails or none of its
+    activities are valid, or when fast is set, the plan is built by the local
+    scheduler instead. Raises PlanGenerationError when no usable plan comes back.
+    """
+    context = build_plan_context(goal, plan_date)
+
+    if not fast:
+        try:
+            prompt = build_plan_prompt(goal, plan_date, context)
+
+            # Call the AI model through the shared client, with a timeout to prevent long waits
+            response_text = gemma_client.complete(prompt, timeout=settings.GEMMA_PLAN_TIMEOUT, operation='plan')
+            logger.info(f"Gemma AI response: {response_text}")
+
+            return save_plan(goal, plan_date, parse_plan_response(response_text), context['busy_index'])
+        except (PlanGenerationError, openai.OpenAIError) as e:
+            if not settings.PLAN_LOCAL_FALLBACK:
+                raise
+            logger.error(f"Gemma plan generation failed, using the local scheduler: {e}")
+            metrics.GEMMA_FALLBACKS.labels('plan').inc()
+
+    return save_local_plan(goal, plan_date, context['busy_index'])
+
+
+def save_local_plan(goal, plan_date, busy_index):
+    """
+    Build the plan with the local scheduler and store it.
+    """
+    return save_plan(goal, plan_date, build_local_plan(goal, plan_date, busy_index), busy_index)
+
+
+async def agenerate_daily_plan(goal, plan_date, fast=False):
+    """
+    Async variant of generate_daily_plan() for async views. The Gemma call
+    holds no thread while it waits; the context and the writes still run
+    through the sync ORM in a thread.
+    """
+    context = await sync_to_async(build_plan_context)(goal, plan_date)
+
+    if not fast:
+        try:
+            prompt = build_plan_prompt(goal, plan_date, context)
+            response_text = await gemma_client.acomplete(
+                prompt, timeout=settings.GEMMA_PLAN_TIMEOUT, operation='plan'
+            )
+            logger.info(f"Gemma AI response: {response_text}")
+
+            plan_data = parse_plan_response(response_text)
+            return await sync_to_async(save_plan)(goal, plan_date, plan_data, context['busy_index'])
+        except (PlanGenerationError, openai.OpenAIError) as e:
+            if not settings.PLAN_LOCAL_FALLBACK:
+                raise
+            logger.error(f"Gemma plan generation failed, using the local scheduler: {e}")
+            metrics.GEMMA_FALLBACKS.labels('plan').inc()
+
+    return await sync_to_async(save_local_plan)(goal, plan_date, context['busy_index'])
@@ -0,0 +1,256 @@
+"""
+Streaming daily plan generation.
+
+Gemma's completion is read in stream mode and the "activities" array is parsed
+incrementally: as soon as one activity object is complete it is validated,
+saved and handed to the caller, instead of waiting for the whole response.
+"""
+import json
+import logging
+import openai
+from django.conf import settings
+from .models import DailyPlan
+from .plan_generation import (
+    NO_ACTIVITIES_ERROR_MESSAGE, PlanGenerationError, build_activity, build_plan_prompt, parse_plan_response,
+    save_plan,
+)
+from .counters import add_activities, discard_plan
+from .jobs import (
+    GENERATION_ERROR_MESSAGE, PlanGenerationInProgress, claim_generation, finish_job, wait_for_generation,
+)
+from .prompt_context import build_plan_context
+from .versions import GOALS, bump_version
+from .scheduler import build_local_plan
+from . import gemma_client, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityStreamParser:
+    """
+    Incremental parser for the "activities" array of a streamed plan response.
+    feed() takes the next piece of text and returns the activity objects that
+    were completed by it.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = 0  # Next character to scan
+        self.in_array = False
+        self.depth = 0  # Brace depth inside the activities array
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        if not self.in_array and not self._find_array_start():
+            return []
+
+        completed = []
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0 and self.object_start is not None:
+                    completed.append(self._decode(self.text[self.object_start:self.position + 1]))
+                    self.object_start = None
+            elif char == ']' and self.depth == 0:
+                self.in_array = False
+                self.position += 1
+                break
+            self.position += 1
+        return [activity for activity in completed if activity is not None]
+
+    def _find_array_start(self):
+        key_index = self.text.find('"activities"', self.position)
+        if key_index == -1:
+            return False
+        bracket_index = self.text.find('[', key_index)
+        if bracket_index == -1:
+            return False
+        self.position = bracket_index + 1
+        self.in_array = True
+        return True
+
+    def _decode(self, raw):
+        try:
+            activity = json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid activity JSON in streamed response: {e}")
+            return None
+        return activity if isinstance(activity, dict) else None
+
+
+def stream_daily_plan(goal, plan_date):
+    """
+    Generate the goal's plan for plan_date from a streamed completion.
+    Yields (event, data) pairs: 'plan' when the plan row is created, one
+    'activity' per saved activity, then 'done' or 'error'. When the stream
+    fails or breaks off inside the activities array after activities were
+    sent, the partial plan is deleted, 'reset' tells the client to drop it,
+    and the local scheduler's plan follows (or 'error' without the fallback).
+    """
+    daily_plan = DailyPlan(goal=goal, plan_date=plan_date, status='Pending', notes="")
+    try:
+        context = build_plan_context(goal, plan_date)
+        prompt = build_plan_prompt(goal, plan_date, context)
+
+        parser = ActivityStreamParser()
+        response_text = ""
+
+        for chunk in gemma_client.stream(prompt, timeout=settings.GEMMA_PLAN_TIMEOUT, operation='plan'):
+            response_text += chunk
+            for activity in parser.feed(chunk):
+                instance = build_activity(daily_plan, activity, context['busy_index'])
+                if instance is None:
+                    continue
+                if daily_plan.pk is None:
+                    # Only persist the plan once it has at least one valid activity
+                    daily_plan.save()
+                    yield 'plan', {"plan_id": daily_plan.id}
+                instance.save()
+                add_activities(daily_plan, 1)
+                yield 'activity', activity_event_data(instance)
+
+        logger.info(f"Gemma AI response: {response_text}")
+
+        if daily_plan.pk is None:
+            logger.error("No valid activities to create.")
+            yield from stream_local_plan(goal, plan_date, context)
+            return
+        if parser.in_array:
+            # Cut off mid-array: the activities that did arrive are not the whole plan
+            logger.error("Streamed plan response ended inside the activities array.")
+            yield from discard_partial_plan(daily_plan)
+            yield from stream_local_plan(goal, plan_date, context)
+            return
+
+        # The plan notes are only known once the whole response has arrived
+        try:
+            notes = parse_plan_response(response_text).get("notes", "")
+        except PlanGenerationError:
+            notes = ""
+        if notes:
+            DailyPlan.objects.filter(pk=daily_plan.pk).update(notes=notes)
+            bump_version(goal.user_id, GOALS)
+
+        yield 'done', {"message": "Daily plan and activities created successfully.", "plan_id": daily_plan.id}
+
+    except openai.OpenAIError as e:
+        # Gemma failed: replace whatever was streamed with the local scheduler's plan
+        yield from discard_partial_plan(daily_plan)
+        if not settings.PLAN_LOCAL_FALLBACK:
+            logger.error(f"Error streaming daily plan: {e}")
+            yield 'error', {"error": GENERATION_ERROR_MESSAGE}
+            return
+        logger.error(f"Gemma plan streaming failed, using the local scheduler: {e}")
+        yield from stream_local_plan(goal, plan_date, context)
+
+    except Exception as e:
+        logger.error(f"Error streaming daily plan: {e}")
+        yield from discard_partial_plan(daily_plan)
+        yield 'error', {"error": GENERATION_ERROR_MESSAGE}
+
+
+def discard_partial_plan(daily_plan):
+    """
+    Delete a partially streamed plan, if one was saved, and yield the 'reset'
+    event telling the client to drop the activities it received.
+    """
+    if daily_plan.pk is None:
+        return
+    plan_id = daily_plan.id
+    discard_plan(daily_plan)
+    yield 'reset', {"plan_id": plan_id}
+
+
+def stream_local_plan(goal, plan_date, context):
+    """
+    Build the plan with the local scheduler and yield it as stream events.
+    """
+    if not settings.PLAN_LOCAL_FALLBACK:
+        yield 'error', {"error": NO_ACTIVITIES_ERROR_MESSAGE}
+        return
+    metrics.GEMMA_FALLBACKS.labels('plan').inc()
+    try:
+        daily_plan = save_plan(
+            goal, plan_date, build_local_plan(goal, plan_date, context['busy_index']), context['busy_index']
+        )
+    except PlanGenerationError as e:
+        yield 'error', {"error": str(e)}
+        return
+
+    yield from saved_plan_events(daily_plan)
+
+
+def saved_plan_events(daily_plan):
+    """
+    Yield the events for a plan that is already saved.
+    """
+    yield 'plan', {"plan_id": daily_plan.id}
+    for instance in daily_plan.activities.order_by('start_time'):
+        yield 'activity', activity_event_data(instance)
+    yield 'done', {"message": "Daily plan and activities created successfully.", "plan_id": daily_plan.id}
+
+
+def stream_plan_once(goal, plan_date):
+    """
+    Single-flight wrapper around stream_daily_plan: only the request holding
+    the generation lease streams from Gemma, concurrent requests wait for it
+    and replay the saved plan.
+    """
+    job, leader = claim_generation(goal, plan_date)
+    if not leader:
+        try:
+            daily_plan = wait_for_generation(job)
+        except (PlanGenerationError, PlanGenerationInProgress) as e:
+            yield 'error', {"error": str(e)}
+            return
+        yield from saved_plan_events(daily_plan)
+        return
+
+    error = None
+    try:
+        for event, data in stream_daily_plan(goal, plan_date):
+            if event == 'error':
+                error = data['error']
+            yield event, data
+    finally:
+        # Also runs when the client disconnects mid-stream; keep what was saved
+        daily_plan = DailyPlan.objects.filter(goal=goal, plan_date=plan_date).first()
+        if daily_plan:
+            finish_job(job, 'Succeeded', plan=daily_plan)
+        else:
+            finish_job(job, 'Failed', error=error or GENERATION_ERROR_MESSAGE)
+
+
+def activity_event_data(instance):
+    return {
+        "id": instance.id,
+        "activity_name": instance.activity_name,
+        "start_time": instance.start_time.strftime("%H:%M"),
+        "end_time": instance.end_time.strftime("%H:%M"),
+        "status": instance.status,
+        "notes": instance.notes,
+    }
+
+
+def format_event(event, data):
+    """
+    Format one server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
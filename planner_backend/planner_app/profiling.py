@@ -0,0 +1,237 @@
+"""
+Sampled per-request profiling.
+
+RequestProfilingMiddleware profiles a random PROFILING_SAMPLE_RATE fraction
+of requests. For each sampled request it measures:
+- the SQL query count and total database time, through an execute wrapper
+  installed on every database connection;
+- the time spent in the serializers' to_representation(), for serializers
+  that use ProfiledSerializerMixin;
+- the time spent waiting on Gemma calls (planner_app.metrics.observe_call);
+- the wall time.
+
+The wall time stops once the view has returned, so for streamed responses
+it does not include the stream.
+
+The current profile is held in a context variable, so it follows the request
+into sync_to_async threads. Unsampled requests pay one random() call, plus a
+context variable lookup per query and per serialized object.
+
+The measurements go into Prometheus histograms labelled by view (and so are
+aggregated across workers like the other metrics); ProfilingAggregatesView
+summarizes them for admins. Sampled requests slower than
+PROFILING_SLOW_REQUEST_MS are logged with their slowest queries.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+COMPONENTS = ['wall', 'sql', 'serializer', 'llm']
+
+REQUEST_PROFILE_SECONDS = Histogram(
+    'request_profile_seconds', "Time per sampled request, by view and component (wall, sql, serializer, llm).",
+    ['view', 'component'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_PROFILE_QUERIES = Counter('request_profile_sql_queries', "SQL queries of sampled requests.", ['view'])
+
+_current = contextvars.ContextVar('request_profile', default=None)
+_serializing = contextvars.ContextVar('profiled_serializing', default=False)
+
+
+class RequestProfile:
+    """
+    Measurements of one sampled request. Gemma calls of a request may run in
+    parallel threads, hence the lock.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # (seconds, sql)
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.llm_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, sql, seconds):
+        with self._lock:
+            self.queries.append((seconds, sql))
+            self.sql_time += seconds
+
+    def add_serializer_time(self, seconds):
+        with self._lock:
+            self.serializer_time += seconds
+
+    def add_llm_time(self, seconds):
+        with self._lock:
+            self.llm_time += seconds
+
+
+def record_llm_time(seconds):
+    profile = _current.get()
+    if profile is not None:
+        profile.add_llm_time(seconds)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        # First, so a temporary connection.execute_wrapper() pushed later pops its own wrapper
+        connection.execute_wrappers.insert(0, sql_wrapper)
+
+
+def install():
+    """
+    Hook the query timing in; called once from the app config.
+    """
+    connection_created.connect(install_sql_wrapper, dispatch_uid='planner_app.profiling')
+    for connection in connections.all(initialized_only=True):
+        install_sql_wrapper(None, connection)
+
+
+class ProfiledSerializerMixin:
+    """
+    Counts the serializer's to_representation() time towards the sampled
+    request's profile. Only the outermost call is timed, so serializers
+    nested as fields or called from a SerializerMethodField are not counted
+    twice; with many=True every item is timed on its own.
+    """
+
+    def to_representation(self, instance):
+        profile = _current.get()
+        if profile is None or _serializing.get():
+            return super().to_representation(instance)
+        token = _serializing.set(True)
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.add_serializer_time(time.perf_counter() - started)
+            _serializing.reset(token)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def finish_profile(profile, request, response):
+    wall = time.perf_counter() - profile.started
+    view = view_label(request)
+    for component, seconds in zip(COMPONENTS, (wall, profile.sql_time, profile.serializer_time, profile.llm_time)):
+        REQUEST_PROFILE_SECONDS.labels(view, component).observe(seconds)
+    REQUEST_PROFILE_QUERIES.labels(view).inc(len(profile.queries))
+
+    if wall * 1000 >= settings.PROFILING_SLOW_REQUEST_MS:
+        slowest = sorted(profile.queries, key=lambda query: query[0], reverse=True)
+        slowest = slowest[:settings.PROFILING_SLOW_QUERIES_LOGGED]
+        logger.warning(
+            "Slow request %s %s (%s) %s: %.0fms wall, %d queries in %.0fms, serializers %.0fms, LLM %.0fms%s",
+            request.method, request.path, view, getattr(response, 'status_code', '-'), wall * 1000,
+            len(profile.queries), profile.sql_time * 1000, profile.serializer_time * 1000, profile.llm_time * 1000,
+            "".join(f"\n  {seconds * 1000:.1f}ms {sql}" for seconds, sql in slowest),
+        )
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles a sample of requests; works under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            finish_profile(profile, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        response = None
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+            finish_profile(profile, request, response)
+        return response
+
+
+def profiling_aggregates(registry):
+    """
+    Per-view totals and averages of the sampled requests recorded in registry,
+    slowest total wall time first.
+    """
+    views = {}
+    for metric in registry.collect():
+        if metric.name == 'request_profile_seconds':
+            for sample in metric.samples:
+                view, component = sample.labels['view'], sample.labels['component']
+                totals = views.setdefault(view, {'requests': 0, 'queries': 0})
+                if sample.name.endswith('_sum'):
+                    totals[component] = sample.value
+                elif sample.name.endswith('_count') and component == 'wall':
+                    totals['requests'] = int(sample.value)
+        elif metric.name == 'request_profile_sql_queries':
+            for sample in metric.samples:
+                if sample.name.endswith('_total'):
+                    views.setdefault(sample.labels['view'], {'requests': 0, 'queries': 0})['queries'] = sample.value
+
+    rows = []
+    for view, totals in views.items():
+        requests = totals['requests']
+        if not requests:
+            continue
+        row = {
+            "view": view,
+            "requests": requests,
+            "total_wall_ms": round(totals.get('wall', 0) * 1000, 1),
+            "avg_sql_queries": round(totals['queries'] / requests, 1),
+        }
+        for component in COMPONENTS:
+            row[f"avg_{component}_ms"] = round(totals.get(component, 0) * 1000 / requests, 1)
+        rows.append(row)
+    return sorted(rows, key=lambda row: row['total_wall_ms'], reverse=True)
@@ -0,0 +1,116 @@
+"""
+Rolling progress summary per goal.
+
+Instead of sending every previous plan and activity to Gemma, each goal keeps
+a compact summary in Goal.progress_summary. A day is folded into the summary
+once it is closed (i.e. before a later day's plan is generated), so each
+update only reads the days closed since the last one and the prompt stays
+about the same size from day 1 to day 30.
+
+Summary layout:
+    closed_through        last plan date folded into the summary
+    days                  number of closed days
+    total_activities      activities planned on closed days
+    completed_activities  activities completed on closed days
+    missed_days           closed days with no completed activity
+    activities            {activity_name: [planned, completed]}
+    recent_days           [[plan_date, planned, completed], ...] for the last N days
+"""
+from datetime import date
+from django.conf import settings
+from django.db.models import Prefetch
+from .models import Goal, DailyPlan, DailyPlanActivity
+
+
+def empty_summary():
+    return {
+        'closed_through': None,
+        'days': 0,
+        'total_activities': 0,
+        'completed_activities': 0,
+        'missed_days': 0,
+        'activities': {},
+        'recent_days': [],
+    }
+
+
+def close_days(goal, before_date):
+    """
+    Fold the goal's plans dated before before_date that are not yet in the
+    summary into Goal.progress_summary. Returns the up-to-date summary.
+    """
+    summary = {**empty_summary(), **(goal.progress_summary or {})}
+
+    plans = DailyPlan.objects.filter(goal=goal, plan_date__lt=before_date)
+    if summary['closed_through']:
+        plans = plans.filter(plan_date__gt=date.fromisoformat(summary['closed_through']))
+    plans = (
+        plans.only('goal_id', 'plan_date')
+        .order_by('plan_date')
+        .prefetch_related(Prefetch(
+            'activities', queryset=DailyPlanActivity.objects.only('plan_id', 'activity_name', 'status')
+        ))
+    )
+
+    closed_any = False
+    for plan in plans:
+        closed_any = True
+        activities = plan.activities.all()
+        completed = sum(1 for activity in activities if activity.status)
+
+        summary['days'] += 1
+        summary['total_activities'] += len(activities)
+        summary['completed_activities'] += completed
+        if not completed:
+            summary['missed_days'] += 1
+        for activity in activities:
+            counts = summary['activities'].setdefault(activity.activity_name, [0, 0])
+            counts[0] += 1
+            counts[1] += int(activity.status)
+        summary['recent_days'].append([plan.plan_date.isoformat(), len(activities), completed])
+        summary['closed_through'] = plan.plan_date.isoformat()
+
+    if not closed_any:
+        return summary
+
+    # Keep the stored summary bounded
+    summary['recent_days'] = summary['recent_days'][-settings.PROGRESS_SUMMARY_RECENT_DAYS:]
+    if len(summary['activities']) > settings.PROGRESS_SUMMARY_MAX_ACTIVITIES:
+        most_planned = sorted(summary['activities'].items(), key=lambda item: item[1][0], reverse=True)
+        summary['activities'] = dict(most_planned[:settings.PROGRESS_SUMMARY_MAX_ACTIVITIES])
+
+    Goal.objects.filter(pk=goal.pk).update(progress_summary=summary)
+    goal.progress_summary = summary
+    return summary
+
+
+def format_summary(summary, skipped_limit=5):
+    """
+    Render the summary as a short, fixed-size text block for the prompt.
+    """
+    if not summary['days']:
+        return "No previous days yet."
+
+    total = summary['total_activities']
+    completed = summary['completed_activities']
+    rate = round(100 * completed / total) if total else 0
+    lines = [
+        f"Days so far: {summary['days']}, days with nothing completed: {summary['missed_days']}. "
+        f"Completion rate: {rate}% ({completed}/{total} activities)."
+    ]
+
+    skipped = [
+        (name, planned - done, planned)
+        for name, (planned, done) in summary['activities'].items()
+        if planned - done > 0
+    ]
+    skipped.sort(key=lambda item: item[1], reverse=True)
+    if skipped:
+        lines.append("Most skipped activities: " + "; ".join(
+            f"{name} (skipped {missed} of {planned})" for name, missed, planned in skipped[:skipped_limit]
+        ) + ".")
+
+    lines.append("Recent days (date: completed/planned): " + ", ".join(
+        f"{plan_date}: {done}/{planned}" for plan_date, planned, done in summary['recent_days']
+    ) + ".")
+    return " ".join(lines)
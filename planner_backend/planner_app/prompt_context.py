@@ -0,0 +1,51 @@
+"""
+Prompt context for daily plan generation.
+
+Everything the plan prompt needs (busy times and progress so far) is loaded
+here in a fixed number of queries, no matter how many days of the goal have
+already passed. History comes from the goal's rolling progress summary, the
+completed count from the goal's maintained counter, and when planning ahead
+today's progress so far from today's plan counters.
+"""
+from django.utils import timezone
+from .busy_times import get_busy_index
+from .models import DailyPlan
+from .progress import close_days, format_summary
+
+
+def build_plan_context(goal, plan_date):
+    """
+    Assemble the prompt context for the goal's plan on plan_date: one query for
+    routines (unless their busy-time index is cached), plus up to three to
+    fold newly closed days into the summary, and one for today's plan when
+    planning a later day.
+    """
+    today = timezone.now().date()
+    # Only days that are over can be closed, even when planning ahead
+    summary = close_days(goal, min(plan_date, today))
+    progress = format_summary(summary)
+    if plan_date > today:
+        progress = f"{progress} {format_today(goal, today)}"
+
+    busy_index = get_busy_index(goal.user_id, plan_date)
+    return {
+        'busy_index': busy_index,
+        'busy_times': busy_index.routines,
+        'completed_activities_count': goal.completed_activities,
+        'progress_summary': progress,
+    }
+
+
+def format_today(goal, today):
+    """
+    Today's progress, for a plan generated ahead of time while today is still open.
+    """
+    counts = (
+        DailyPlan.objects.filter(goal=goal, plan_date=today)
+        .values_list('total_activities', 'completed_activities')
+        .first()
+    )
+    if counts is None:
+        return f"Today ({today}): no plan."
+    planned, completed = counts
+    return f"Today so far ({today}): {completed}/{planned} activities completed."
@@ -0,0 +1,115 @@
+"""
+Pool of pre-generated motivational quotes.
+
+Quotes are generated in bulk by Gemma (one call per batch) and stored in the
+MotivationalQuote table. Creating a daily plan only pops the oldest quote
+from the pool; when the pool runs low it is refilled in the background
+(unless QUOTE_POOL_BACKGROUND_REFILL is off, then only by refill_quote_pool).
+"""
+import re
+import json
+import logging
+import threading
+from django.conf import settings
+from django.db import connection
+from .models import MotivationalQuote
+from . import gemma_client, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MOTIVATIONAL_QUOTE = "Keep pushing forward—you're closer to success than you think!"
+
+_refill_lock = threading.Lock()
+
+
+def take_quote():
+    """
+    Pop a quote from the pool without calling Gemma. Falls back to the default
+    quote when the pool is empty, and schedules a refill when it runs low.
+    """
+    quote = None
+    for _ in range(3):  # Another request may take the same quote first
+        candidate = MotivationalQuote.objects.order_by('id').values_list('id', 'text').first()
+        if candidate is None:
+            break
+        deleted, _ = MotivationalQuote.objects.filter(id=candidate[0]).delete()
+        if deleted:
+            quote = candidate[1]
+            break
+
+    # Bounded check: is there at least a low-water mark's worth of quotes left?
+    low_water = settings.QUOTE_POOL_LOW_WATER
+    if not MotivationalQuote.objects.order_by('id')[low_water:low_water + 1].exists():
+        schedule_refill()
+
+    if quote is None:
+        metrics.GEMMA_FALLBACKS.labels('quotes').inc()
+        return DEFAULT_MOTIVATIONAL_QUOTE
+    return quote
+
+
+def schedule_refill():
+    """
+    Refill the pool on the shared Gemma executor, unless a refill is already
+    running or QUOTE_POOL_BACKGROUND_REFILL is off.
+    """
+    if not settings.QUOTE_POOL_BACKGROUND_REFILL or not _refill_lock.acquire(blocking=False):
+        return
+    try:
+        gemma_client.get_executor().submit(_refill_in_background)
+    except Exception:
+        _refill_lock.release()
+        raise
+
+
+def _refill_in_background():
+    try:
+        refill_pool()
+    except Exception as e:
+        logger.error(f"Error refilling motivational quote pool: {e}")
+    finally:
+        connection.close()
+        _refill_lock.release()
+
+
+def generate_quotes(count):
+    """
+    Ask Gemma for a batch of motivational quotes in a single call.
+    """
+    prompt = (
+        f"Generate {count} different motivational quotes that are playful, encouraging, "
+        f"and less than 50 words each. Each should inspire someone to achieve their daily plan. "
+        f"Respond with only a JSON array of strings."
+    )
+    response_text = gemma_client.complete(prompt, operation='quotes')
+
+    json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+    if not json_match:
+        logger.error("No JSON array found in quote response.")
+        metrics.GEMMA_PARSE_FAILURES.labels('quotes').inc()
+        return []
+    try:
+        quotes = json.loads(json_match.group(0))
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON in quote response: {e}")
+        metrics.GEMMA_PARSE_FAILURES.labels('quotes').inc()
+        return []
+    return [quote.strip() for quote in quotes if isinstance(quote, str) and quote.strip()]
+
+
+def refill_pool(target_size=None):
+    """
+    Top the pool up to target_size quotes. Returns the number of quotes added.
+    """
+    target_size = target_size or settings.QUOTE_POOL_SIZE
+    added = 0
+    for _ in range(settings.QUOTE_POOL_MAX_BATCHES):
+        missing = target_size - MotivationalQuote.objects.count()
+        if missing <= 0:
+            break
+        quotes = generate_quotes(min(missing, settings.QUOTE_POOL_BATCH_SIZE))
+        if not quotes:
+            break
+        MotivationalQuote.objects.bulk_create([MotivationalQuote(text=quote) for quote in quotes])
+        added += len(quotes)
+    return added
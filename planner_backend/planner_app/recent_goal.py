@@ -0,0 +1,56 @@
+"""
+Home screen payload: the user's most recent active goal with today's plan.
+
+The serialized payload is cached per user and day under the user's goals
+version stamp, which every change to the goal, its plans or their activities
+bumps (see planner_app.versions), so a change makes every process miss. A
+cache miss costs a fixed number of queries: the goal, today's plan and its
+activities, with no per-object lazy loads.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.utils import timezone
+from .models import DailyPlan, DailyPlanActivity, Goal
+from .serializers import RecentGoalSerializer
+from .versions import GOALS, get_version
+
+ACTIVE_GOAL_STATUSES = ['Pending', 'In Progress']
+
+
+def cache_key(user_id, day, version):
+    return f"recent-goal:{user_id}:{day.isoformat()}:{version}"
+
+
+def load_recent_goal(user_id, today):
+    """
+    Fetch the most recent active goal with today's plan and its activities prefetched.
+    """
+    todays_plans = DailyPlan.objects.filter(plan_date=today).prefetch_related(
+        Prefetch('activities', queryset=DailyPlanActivity.objects.order_by('start_time', 'id'))
+    )
+    return (
+        Goal.objects.filter(user_id=user_id, status__in=ACTIVE_GOAL_STATUSES)
+        .prefetch_related(Prefetch('daily_plans', queryset=todays_plans, to_attr='todays_plans'))
+        .order_by('-id')
+        .first()
+    )
+
+
+def get_recent_goal_payload(user_id, version=None):
+    """
+    Return the serialized recent goal for the user, or None if there is none.
+    Pass the user's goals version if it was already read for this request.
+    """
+    if version is None:
+        version = get_version(user_id, GOALS)
+    today = timezone.now().date()
+    key = cache_key(user_id, today, version)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached['data']
+
+    goal = load_recent_goal(user_id, today)
+    data = RecentGoalSerializer(goal).data if goal else None
+    cache.set(key, {'data': data}, settings.RECENT_GOAL_CACHE_TTL)
+    return data
@@ -0,0 +1,289 @@
+"""
+Resilience policy for Gemma calls.
+
+Every call gets one deadline covering all of its attempts. Transient
+failures (connection errors, timeouts, 429 and 5xx responses) are retried
+with jittered exponential backoff while the deadline allows, and only while
+the process-wide retry budget has tokens: each call earns a fraction of a
+retry, so during an outage retries add at most that fraction of extra load
+instead of multiplying it. Optionally a second, hedged request is sent when
+the first has not answered by a latency percentile of recent calls of the
+same operation, and whichever answers first wins.
+
+A circuit breaker counts consecutive failures. Once it opens, calls fail
+immediately with CircuitOpen (an OpenAIError, so the callers' existing
+fallbacks apply) until the reset timeout has passed and a trial call succeeds.
+
+State is per process, like the client itself.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import openai
+
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class CircuitOpen(openai.OpenAIError):
+    """
+    Gemma is failing; the call was not attempted.
+    """
+
+    def __init__(self):
+        super().__init__("Gemma is unavailable (circuit open).")
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may go ahead. After the reset timeout one trial call
+        is let through; the others keep failing fast until it succeeds.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # A trial that never reported back (e.g. cancelled) is replaced after the timeout too
+            if self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = self.clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all calls: every call deposits ratio tokens, every
+    retry or hedge withdraws one.
+    """
+
+    def __init__(self, ratio, max_tokens):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful attempts, per operation.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self.samples.setdefault(operation, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, operation, percentile, min_samples):
+        """
+        The latency below which percentile % of the operation's recent
+        attempts finished, or None with fewer than min_samples samples.
+        """
+        with self._lock:
+            samples = sorted(self.samples.get(operation, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+
+def backoff_delay(retry, base, cap):
+    """
+    Full-jitter exponential backoff before the given retry (1 for the first).
+    """
+    return random.uniform(0, min(cap, base * 2 ** (retry - 1)))
+
+
+class ResiliencePolicy:
+    """
+    Runs attempt(timeout) under the deadline, retry, hedging and breaker
+    rules above. attempt is one request with the given timeout in seconds.
+    """
+
+    def __init__(self, breaker, budget, latencies, max_retries, backoff_base, backoff_cap,
+                 hedge_percentile=0, hedge_min_samples=50, executor=None):
+        self.breaker = breaker
+        self.budget = budget
+        self.latencies = latencies
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.executor = executor  # Runs sync hedged attempts
+
+    def hedge_delay(self, operation, remaining):
+        """
+        Seconds after which to send a hedged request, or None not to hedge.
+        """
+        if not self.hedge_percentile:
+            return None
+        delay = self.latencies.percentile(operation, self.hedge_percentile, self.hedge_min_samples)
+        if delay is None or delay >= remaining:
+            return None
+        return delay
+
+    def next_retry_delay(self, retries, deadline):
+        """
+        The backoff before another retry, or None if no retry is allowed.
+        """
+        if retries > self.max_retries:
+            return None
+        delay = backoff_delay(retries, self.backoff_base, self.backoff_cap)
+        if time.monotonic() + delay >= deadline or not self.breaker.allow() or not self.budget.withdraw():
+            return None
+        return delay
+
+    def timed(self, attempt, timeout, operation):
+        started = time.monotonic()
+        result = attempt(timeout)
+        self.latencies.record(operation, time.monotonic() - started)
+        return result
+
+    def call(self, attempt, timeout, operation='default', hedge=True):
+        if not self.breaker.allow():
+            raise CircuitOpen()
+        self.budget.deposit()
+        deadline = time.monotonic() + timeout
+        retries = 0
+        while True:
+            try:
+                remaining = deadline - time.monotonic()
+                if hedge:
+                    result = self.hedged(attempt, remaining, operation)
+                else:
+                    result = self.timed(attempt, remaining, operation)
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                retries += 1
+                delay = self.next_retry_delay(retries, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except openai.APIStatusError:
+                self.breaker.record_success()  # Gemma answered, only not with a usable response
+                raise
+            self.breaker.record_success()
+            return result
+
+    def hedged(self, attempt, remaining, operation):
+        delay = self.hedge_delay(operation, remaining)
+        if delay is None or self.executor is None:
+            return self.timed(attempt, remaining, operation)
+
+        primary = self.executor.submit(self.timed, attempt, remaining, operation)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            return primary.result()
+
+        hedge = self.executor.submit(self.timed, attempt, remaining - delay, operation)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()  # The other one finishes in the background
+                error = error or future.exception()
+        raise error
+
+    async def acall(self, attempt, timeout, operation='default'):
+        """
+        Async variant of call(); attempt(timeout) returns an awaitable.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen()
+        self.budget.deposit()
+        deadline = time.monotonic() + timeout
+        retries = 0
+        while True:
+            try:
+                result = await self.ahedged(attempt, deadline - time.monotonic(), operation)
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure()
+                retries += 1
+                delay = self.next_retry_delay(retries, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except openai.APIStatusError:
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def atimed(self, attempt, timeout, operation):
+        started = time.monotonic()
+        result = await attempt(timeout)
+        self.latencies.record(operation, time.monotonic() - started)
+        return result
+
+    async def ahedged(self, attempt, remaining, operation):
+        delay = self.hedge_delay(operation, remaining)
+        if delay is None:
+            return await self.atimed(attempt, remaining, operation)
+
+        primary = asyncio.ensure_future(self.atimed(attempt, remaining, operation))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            return await primary
+
+        hedge = asyncio.ensure_future(self.atimed(attempt, remaining - delay, operation))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()  # The slower request is abandoned
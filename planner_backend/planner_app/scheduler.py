@@ -0,0 +1,94 @@
+"""
+Deterministic local scheduler.
+
+Builds a daily plan without Gemma by placing activity templates, taken from
+the goal's recent history (or generic ones for a new goal), into the user's
+free slots. It respects busy routines, the current time and start < end, and
+runs in milliseconds, so it serves both as the fallback when Gemma fails and
+as the explicit "fast plan" mode.
+"""
+from django.conf import settings
+from django.utils import timezone
+from .busy_times import to_minutes
+from .models import DailyPlanActivity
+from .quotes import take_quote
+
+GENERIC_TEMPLATES = [
+    ("Focused work on {goal}", 45, "Make concrete progress towards your goal."),
+    ("Learn something new for {goal}", 30, "Read, watch or research one thing that helps."),
+    ("Practice session for {goal}", 30, "Repeat what you learned so it sticks."),
+    ("Review today's progress", 15, "Note what went well and what to improve."),
+    ("Plan tomorrow's steps", 15, "Write down the first thing you will do tomorrow."),
+]
+
+
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def activity_templates(goal):
+    """
+    Return (activity_name, duration_minutes, notes) templates, best first:
+    recent activities of the goal ranked by how often they were completed,
+    topped up with generic templates.
+    """
+    recent = (
+        DailyPlanActivity.objects.filter(plan__goal=goal)
+        .order_by('-plan__plan_date', 'start_time')
+        .values_list('activity_name', 'start_time', 'end_time', 'status', 'notes')
+        [:settings.LOCAL_SCHEDULER_HISTORY]
+    )
+
+    stats = {}
+    for name, start_time, end_time, completed, notes in recent:
+        if name not in stats:
+            duration = to_minutes(end_time) - to_minutes(start_time)
+            stats[name] = {'duration': duration, 'notes': notes or "", 'planned': 0, 'completed': 0}
+        stats[name]['planned'] += 1
+        stats[name]['completed'] += int(completed)
+
+    ranked = sorted(stats.items(), key=lambda item: (item[1]['completed'], item[1]['planned']), reverse=True)
+    templates = [(name, data['duration'], data['notes']) for name, data in ranked if data['duration'] > 0]
+
+    for name, duration, notes in GENERIC_TEMPLATES:
+        if len(templates) >= settings.LOCAL_SCHEDULER_MIN_ACTIVITIES:
+            break
+        templates.append((name.format(goal=goal.goal_name)[:100], duration, notes))
+    return templates
+
+
+def build_local_plan(goal, plan_date, busy_index):
+    """
+    Place the goal's activity templates into the free slots of plan_date.
+    Returns plan data in the same shape as a parsed Gemma response.
+    """
+    day_start = settings.LOCAL_SCHEDULER_DAY_START * 60
+    day_end = settings.LOCAL_SCHEDULER_DAY_END * 60
+    gap = settings.LOCAL_SCHEDULER_GAP_MINUTES
+
+    cursor = day_start
+    now = timezone.now()
+    if plan_date == now.date():
+        # Start after the current time, rounded up to the next 5 minutes
+        current = now.hour * 60 + now.minute + 1
+        cursor = max(cursor, current + (-current % 5))
+
+    activities = []
+    for name, duration, notes in activity_templates(goal):
+        if len(activities) >= settings.LOCAL_SCHEDULER_MAX_ACTIVITIES:
+            break
+        for slot_start, slot_end in busy_index.free_slots(after=cursor, min_length=duration):
+            start = max(slot_start, cursor)
+            end = start + duration
+            if end > min(slot_end, day_end):
+                continue
+            activities.append({
+                "activity_name": name,
+                "start_time": format_minutes(start),
+                "end_time": format_minutes(end),
+                "notes": notes,
+            })
+            cursor = end + gap
+            break
+
+    return {"notes": take_quote(), "activities": activities}
@@ -1,13 +1,36 @@
+import asyncio
+import logging
 from rest_framework import serializers
 from datetime import date
-from .models import DailyRoutine, Goal, DailyPlan, DailyPlanActivity
+from .models import DailyRoutine, Goal, DailyPlan, DailyPlanActivity, PlanGenerationJob
 from django.utils.timezone import now
 from django.conf import settings
-import openai
+from concurrent.futures import wait
+from contextvars import copy_context
+from . import gemma_client, metrics
+from .profiling import ProfiledSerializerMixin
+from .quotes import take_quote
+from .sparse_fields import SparseFieldsetSerializerMixin
+
+logger = logging.getLogger(__name__)
+
+# Fallbacks used when Gemma fails or does not answer in time
+DEFAULT_FEASIBILITY_SCORE = 5
+DEFAULT_MODEL_NOTES = (
+    "Keep going! Your goal is a beautiful journey of growth and discovery. "
+    "Every small step forward is a victory worth celebrating."
+)
+
+
+def parse_feasibility_score(response):
+    """
+    The 1-10 score in a feasibility answer; raises ValueError if there is none.
+    """
+    return max(1, min(int(response), 10))  # Clamp score between 1 and 10
 
 
 # DailyRoutine Serializer
-class DailyRoutineSerializer(serializers.ModelSerializer):
+class DailyRoutineSerializer(ProfiledSerializerMixin, SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DailyRoutine
         fields = ['id', 'user', 'activity_name', 'start_time', 'end_time', 'days_of_week']
@@ -23,11 +46,14 @@ class DailyRoutineSerializer(serializers.ModelSerializer):
 
 # Goal Serializer
 
-class GoalSerializer(serializers.ModelSerializer):
+class GoalSerializer(ProfiledSerializerMixin, SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Goal
-        read_only_fields = ['user', 'status', 'feasibility_score', 'model_notes']
-        fields = '__all__'
+        read_only_fields = [
+            'user', 'status', 'feasibility_score', 'model_notes',
+            'total_activities', 'completed_activities', 'completed_days',
+        ]
+        exclude = ['progress_summary']
 
     def validate(self, data):
         """
@@ -68,103 +94,197 @@ class GoalSerializer(serializers.ModelSerializer):
 
         # Call Gemma AI to calculate feasibility score and generate notes
         goal = super().create(validated_data)
-        goal.feasibility_score = self.calculate_feasibility_score(goal)
-        goal.model_notes = self.generate_model_notes(goal)
-        goal.save()
+        if self.context.get('enrich', True):  # Async views enrich with aenrich_goal instead
+            goal.feasibility_score, goal.model_notes = self.enrich_goal(goal)
+            goal.save()
         return goal
 
-    def calculate_feasibility_score(self, goal):
+    def enrich_goal(self, goal):
+        """
+        Run the feasibility and notes calls concurrently under one overall deadline.
+        Each call that fails or misses the deadline falls back on its own.
+        """
+        deadline = settings.GEMMA_GOAL_ENRICHMENT_DEADLINE
+        executor = gemma_client.get_executor()
+        # Each call runs in a copy of this context, so it counts towards the request's profile
+        score_future = executor.submit(
+            copy_context().run, self.calculate_feasibility_score, goal, deadline, fallback=False
+        )
+        notes_future = executor.submit(copy_context().run, self.generate_model_notes, goal, deadline, fallback=False)
+
+        done, pending = wait([score_future, notes_future], timeout=deadline)
+        for future in pending:
+            future.cancel()  # Calls still queued behind a busy executor never run
+        return self.with_fallbacks(
+            score_future.result() if score_future in done else None,
+            notes_future.result() if notes_future in done else None,
+        )
+
+    async def aenrich_goal(self, goal):
+        """
+        Async variant of enrich_goal(): both calls run on the event loop
+        under the same deadline, with the same fallbacks.
+        """
+        deadline = settings.GEMMA_GOAL_ENRICHMENT_DEADLINE
+        score_task = asyncio.ensure_future(self.acalculate_feasibility_score(goal, deadline, fallback=False))
+        notes_task = asyncio.ensure_future(self.agenerate_model_notes(goal, deadline, fallback=False))
+
+        done, pending = await asyncio.wait([score_task, notes_task], timeout=deadline)
+        for task in pending:
+            task.cancel()
+        return self.with_fallbacks(
+            score_task.result() if score_task in done else None,
+            notes_task.result() if notes_task in done else None,
+        )
+
+    def with_fallbacks(self, feasibility_score, model_notes):
+        """
+        Replace the results of failed or late enrichment calls (None) with the
+        fallbacks, counting each fallback once.
         """
-        Calls Gemma AI to analyze goal feasibility.
+        if feasibility_score is None:
+            logger.warning("Feasibility score failed or timed out, using fallback.")
+            metrics.GEMMA_FALLBACKS.labels('feasibility').inc()
+            feasibility_score = DEFAULT_FEASIBILITY_SCORE
+        if model_notes is None:
+            logger.warning("Motivational notes failed or timed out, using fallback.")
+            metrics.GEMMA_FALLBACKS.labels('notes').inc()
+            model_notes = DEFAULT_MODEL_NOTES
+        return feasibility_score, model_notes
+
+    def feasibility_prompt(self, goal):
+        return (
+            f"Please analyze the following goal for feasibility:\n"
+            f"Goal Name: {goal.goal_name}\n"
+            f"Goal Description: {goal.goal_description}\n"
+            f"Timeframe: {(goal.goal_end_date - goal.goal_start_date).days} days\n"
+            f"On a scale of 1 to 10 (1 being least feasible, 10 being most feasible), rate its feasibility.\n"
+            f"Respond with only a single number between 1 and 10."
+        )
+
+    def model_notes_prompt(self, goal):
+        return (
+            f"Please write a motivational paragraph to encourage someone working towards the following goal:\n"
+            f"Goal Name: {goal.goal_name}\n"
+            f"Goal Description: {goal.goal_description}"
+        )
+
+    def calculate_feasibility_score(self, goal, timeout=None, fallback=True):
         """
+        Calls Gemma AI to analyze goal feasibility. With fallback=False a
+        failed call returns None instead of the default score.
+        """
+        response = None
         try:
-            client = openai.OpenAI(
-                base_url=settings.GEMMA_BASE_URL,
-                api_key=settings.GEMMA_API_KEY
+            response = gemma_client.complete(
+                self.feasibility_prompt(goal), timeout=timeout, cache=True, operation='feasibility',
+                validate=parse_feasibility_score,
             )
-
-            input_data = {
-                "role": "user",
-                "content": (
-                    f"Please analyze the following goal for feasibility:\n"
-                    f"Goal Name: {goal.goal_name}\n"
-                    f"Goal Description: {goal.goal_description}\n"
-                    f"Timeframe: {(goal.goal_end_date - goal.goal_start_date).days} days\n"
-                    f"On a scale of 1 to 10 (1 being least feasible, 10 being most feasible), rate its feasibility.\n"
-                    f"Respond with only a single number between 1 and 10."
-                )
-            }
-
-            completion = client.chat.completions.create(
-                model="google/gemma-2-27b-it",
-                messages=[input_data]
+            return parse_feasibility_score(response)
+        except ValueError:
+            logger.warning(f"Unexpected feasibility score from Gemma AI: {response!r}")
+            metrics.GEMMA_PARSE_FAILURES.labels('feasibility').inc()
+        except Exception as e:
+            logger.error(f"Error calling Gemma AI: {e}")
+        if not fallback:
+            return None
+        metrics.GEMMA_FALLBACKS.labels('feasibility').inc()
+        return DEFAULT_FEASIBILITY_SCORE
+
+    async def acalculate_feasibility_score(self, goal, timeout=None, fallback=True):
+        response = None
+        try:
+            response = await gemma_client.acomplete(
+                self.feasibility_prompt(goal), timeout=timeout, cache=True, operation='feasibility',
+                validate=parse_feasibility_score,
             )
-
-            response = completion.choices[0].message.content.strip()
-            score = int(response)
-            return max(1, min(score, 10))  # Clamp score between 1 and 10
+            return parse_feasibility_score(response)
+        except ValueError:
+            logger.warning(f"Unexpected feasibility score from Gemma AI: {response!r}")
+            metrics.GEMMA_PARSE_FAILURES.labels('feasibility').inc()
         except Exception as e:
-            print(f"Error calling Gemma AI: {e}")
-            return 5  # Default fallback score
+            logger.error(f"Error calling Gemma AI: {e}")
+        if not fallback:
+            return None
+        metrics.GEMMA_FALLBACKS.labels('feasibility').inc()
+        return DEFAULT_FEASIBILITY_SCORE
 
-    def generate_model_notes(self, goal):
+    def generate_model_notes(self, goal, timeout=None, fallback=True):
         """
-        Generate motivational notes for the goal.
+        Generate motivational notes for the goal. With fallback=False a
+        failed call returns None instead of the default notes.
         """
         try:
-            client = openai.OpenAI(
-                base_url=settings.GEMMA_BASE_URL,
-                api_key=settings.GEMMA_API_KEY
+            response = gemma_client.complete(
+                self.model_notes_prompt(goal), timeout=timeout, cache=True, operation='notes'
             )
-
-            input_data = {
-                "role": "user",
-                "content": (
-                    f"Please write a motivational paragraph to encourage someone working towards the following goal:\n"
-                    f"Goal Name: {goal.goal_name}\n"
-                    f"Goal Description: {goal.goal_description}"
-                )
-            }
-
-            completion = client.chat.completions.create(
-                model="google/gemma-2-27b-it",
-                messages=[input_data]
-            )
-
-            response = completion.choices[0].message.content.strip()
             return response[:100]  # Ensure the text is within 100 words
         except Exception as e:
-            print(f"Error generating motivational notes: {e}")
-            return (
-                "Keep going! Your goal is a beautiful journey of growth and discovery. "
-                "Every small step forward is a victory worth celebrating."
+            logger.error(f"Error generating motivational notes: {e}")
+        if not fallback:
+            return None
+        metrics.GEMMA_FALLBACKS.labels('notes').inc()
+        return DEFAULT_MODEL_NOTES
+
+    async def agenerate_model_notes(self, goal, timeout=None, fallback=True):
+        try:
+            response = await gemma_client.acomplete(
+                self.model_notes_prompt(goal), timeout=timeout, cache=True, operation='notes'
             )
+            return response[:100]
+        except Exception as e:
+            logger.error(f"Error generating motivational notes: {e}")
+        if not fallback:
+            return None
+        metrics.GEMMA_FALLBACKS.labels('notes').inc()
+        return DEFAULT_MODEL_NOTES
 
 
-class DailyPlanActivityStatusSerializer(serializers.ModelSerializer):
+class DailyPlanActivityStatusSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DailyPlanActivity
         fields = ['id', 'status']
 
 
-class DailyPlanActivitySerializer(serializers.ModelSerializer):
+# Bulk activity status update
+class ActivityStatusListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        ids = [item['id'] for item in attrs]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each activity may only appear once.")
+        return attrs
+
+
+class ActivityStatusUpdateSerializer(ProfiledSerializerMixin, serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.BooleanField()
+
+    class Meta:
+        list_serializer_class = ActivityStatusListSerializer
+
+
+class DailyPlanActivitySerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DailyPlanActivity
         fields = ['id', 'plan', 'activity_name', 'start_time', 'end_time', 'status', 'notes', ]
 
 
-class DailyPlanActivitySerializer(serializers.ModelSerializer):
+class DailyPlanActivitySerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DailyPlanActivity
         fields = ['id', 'activity_name', 'start_time', 'end_time', 'status', 'notes']
 
 
-class DailyPlanSerializer(serializers.ModelSerializer):
+class DailyPlanSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     activities = DailyPlanActivitySerializer(many=True, read_only=True)
 
     class Meta:
         model = DailyPlan
-        fields = ['id', 'goal', 'plan_date', 'notes', 'status', 'day_number', 'activities']
+        fields = [
+            'id', 'goal', 'plan_date', 'notes', 'status', 'day_number',
+            'total_activities', 'completed_activities', 'activities',
+        ]
+        read_only_fields = ['total_activities', 'completed_activities']
 
     def validate(self, data):
         """
@@ -211,55 +331,39 @@ class DailyPlanSerializer(serializers.ModelSerializer):
 
     def generate_motivational_quote(self):
         """
-        Generate a motivational quote using the Gemma AI model.
+        Take a motivational quote from the pre-generated pool (no Gemma call).
         """
-        try:
-
-            # Initialize OpenAI API client
-            client = openai.OpenAI(
-                base_url=settings.GEMMA_BASE_URL,
-                api_key=settings.GEMMA_API_KEY
-            )
-
-            # Prepare the input for the AI model
-            input_data = {
-                "role": "user",
-                "content": (
-                    "Generate a motivational quote that is playful, encouraging, "
-                    "and less than 50 words. It should inspire someone to achieve their daily plan."
-                )
-            }
-
-            # Call the Gemma AI model
-            completion = client.chat.completions.create(
-                model="google/gemma-2-27b-it",
-                messages=[input_data]
-            )
-
-            # Parse and return the response
-            quote = completion.choices[0].message.content.strip()
-            return quote
-
-        except Exception as e:
-            # Handle errors and provide a fallback quote
-            print(f"Error generating motivational quote: {e}")
-            return "Keep pushing forward—you're closer to success than you think!"
+        return take_quote()
 
 
 # Recent Goal Serializer
-class RecentGoalSerializer(serializers.ModelSerializer):
+class RecentGoalSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     daily_plans = serializers.SerializerMethodField()
 
     class Meta:
         model = Goal
-        fields = '__all__'
+        exclude = ['progress_summary']
 
     def get_daily_plans(self, obj):
         """
         Return only the daily plan for the current day.
         """
-        today = now().date()
-        daily_plan = obj.daily_plans.filter(plan_date=today).first()  # Fetch today's daily plan if it exists
+        if hasattr(obj, 'todays_plans'):
+            # Prefetched by planner_app.recent_goal, with the activities
+            daily_plan = obj.todays_plans[0] if obj.todays_plans else None
+        else:
+            today = now().date()
+            daily_plan = obj.daily_plans.filter(plan_date=today).first()  # Fetch today's daily plan if it exists
         if daily_plan:
             return DailyPlanSerializer(daily_plan).data
         return None
+
+
+# Plan Generation Job Serializer
+class PlanGenerationJobSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    plan_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = PlanGenerationJob
+        fields = ['job_id', 'goal', 'plan_date', 'status', 'plan_id', 'error', 'created_at', 'updated_at']
@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from accounts.models import Notification
+from .models import DailyPlan, DailyPlanActivity, DailyRoutine, Goal
+from .busy_times import invalidate_busy_index
+from .versions import GOALS, NOTIFICATIONS, ROUTINES, bump_version
+
+
+def deleted_with_user(origin):
+    """
+    Whether a post_delete comes from deleting the user: the user's version
+    row goes away in the same cascade, and bumping it would recreate it.
+    """
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, User)
+
+
+@receiver([post_save, post_delete], sender=DailyRoutine)
+def routine_changed(sender, instance, **kwargs):
+    """
+    Routines feed the busy-time index, so drop the user's cached indexes.
+    """
+    invalidate_busy_index(instance.user_id)
+    if not deleted_with_user(kwargs.get('origin')):
+        bump_version(instance.user_id, ROUTINES)
+
+
+@receiver([post_save, post_delete], sender=Goal)
+def goal_changed(sender, instance, **kwargs):
+    if not deleted_with_user(kwargs.get('origin')):
+        bump_version(instance.user_id, GOALS)
+
+
+@receiver([post_save, post_delete], sender=DailyPlan)
+def plan_changed(sender, instance, **kwargs):
+    if deleted_with_user(kwargs.get('origin')):
+        return
+    try:
+        bump_version(instance.goal.user_id, GOALS)
+    except ObjectDoesNotExist:
+        pass  # Removed together with its goal, which bumps on its own
+
+
+@receiver([post_save, post_delete], sender=DailyPlanActivity)
+def activity_changed(sender, instance, **kwargs):
+    """
+    Activities are bulk-created with their plan, whose own signal covers them;
+    this catches individual saves such as streamed activities.
+    """
+    if deleted_with_user(kwargs.get('origin')):
+        return
+    try:
+        bump_version(instance.plan.goal.user_id, GOALS)
+    except ObjectDoesNotExist:
+        pass
+
+
+@receiver([post_save, post_delete], sender=Notification)
+def notification_changed(sender, instance, **kwargs):
+    if not deleted_with_user(kwargs.get('origin')):
+        bump_version(instance.user_id, NOTIFICATIONS)
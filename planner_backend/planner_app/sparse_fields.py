@@ -0,0 +1,47 @@
+"""
+Sparse fieldsets: ?fields=id,goal_name limits a GET response to the listed
+fields. The serializer mixin drops the other fields from the output, and the
+view mixin only loads the requested columns, so long text such as
+goal_description is neither read nor sent. Unknown names are ignored, and
+a list without any known name returns every field.
+"""
+
+FIELDS_QUERY_PARAM = 'fields'
+
+
+def requested_fields(request):
+    """
+    Return the set of field names requested with ?fields=, or None.
+    """
+    if request is None or request.method != 'GET':
+        return None
+    value = request.query_params.get(FIELDS_QUERY_PARAM)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetSerializerMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = requested_fields(self.context.get('request'))
+        if names and names & set(self.fields):
+            for field_name in set(self.fields) - names:
+                self.fields.pop(field_name)
+
+
+class SparseFieldsetViewMixin:
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        names = requested_fields(self.request)
+        if not names:
+            return queryset
+        # Only defer loading when every requested field is a plain column
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        serializer_fields = set(self.get_serializer_class()().fields)
+        columns = names & serializer_fields
+        if columns and columns <= concrete:
+            queryset = queryset.only('id', *columns)
+        return queryset
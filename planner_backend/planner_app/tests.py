@@ -1,3 +1,1398 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import sync_to_async
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+import httpx
+import openai
+from prometheus_client import REGISTRY
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .analytics import backfill_daily_progress
+from .busy_times import BusyTimeIndex, get_busy_index
+from .counters import add_activities, rebuild_counters
+from .jobs import (
+    PlanGenerationInProgress, claim_generation, claim_next_job, enqueue_plan_generation, enqueue_pregeneration,
+    generate_plan_once, run_job, wait_for_generation,
+)
+from accounts.models import Notification
+from .models import (
+    DailyRoutine, DataVersion, Goal, DailyPlan, DailyPlanActivity, DailyProgress, MotivationalQuote,
+    PlanGenerationJob,
+)
+from .plan_generation import build_activity, generate_daily_plan
+from .serializers import DEFAULT_FEASIBILITY_SCORE, DEFAULT_MODEL_NOTES, GoalSerializer, RecentGoalSerializer
+from .profiling import RequestProfile, _current, record_llm_time
+from .plan_streaming import ActivityStreamParser, stream_plan_once
+from .prompt_context import build_plan_context
+from . import quotes
+from .recent_goal import get_recent_goal_payload, load_recent_goal
+from .resilience import CircuitBreaker, CircuitOpen, LatencyTracker, ResiliencePolicy, RetryBudget
+from .scheduler import build_local_plan
+from . import gemma_client
+from .management.stub_llm import StubLLMServer
 
-# Create your tests here.
+
+class PlanContextTests(TestCase):
+    """
+    The prompt context must load in a constant number of queries and stay
+    about the same size, however many days of the goal have already passed.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='planner', password='password')
+        self.start = date(2024, 1, 1)
+        self.goal = Goal.objects.create(
+            user=self.user,
+            goal_name='Run a 5k',
+            goal_description='Build up to running 5k without stopping.',
+            goal_start_date=self.start,
+            goal_end_date=self.start + timedelta(days=30),
+        )
+        DailyRoutine.objects.create(
+            user=self.user, activity_name='Work', start_time=time(9), end_time=time(17), days_of_week='Weekday'
+        )
+
+    def add_days(self, days):
+        for day in range(days):
+            plan = DailyPlan.objects.create(goal=self.goal, plan_date=self.start + timedelta(days=day))
+            DailyPlanActivity.objects.bulk_create([
+                DailyPlanActivity(
+                    plan=plan, activity_name=f'Activity {n}', start_time=time(18 + n), end_time=time(18 + n, 30),
+                    status=n % 2 == 0,
+                )
+                for n in range(3)
+            ])
+        rebuild_counters()  # The activities were created without the counters
+        self.goal.refresh_from_db()
+
+    def test_query_count_is_constant(self):
+        for days in (1, 29):
+            DailyPlan.objects.filter(goal=self.goal).delete()
+            self.goal.progress_summary = {}
+            self.add_days(days)
+            plan_date = self.start + timedelta(days=days)
+            cache.clear()
+            # Routines, newly closed plans, their activities, summary update
+            with self.assertNumQueries(4):
+                context = build_plan_context(self.goal, plan_date)
+            self.assertEqual(context['completed_activities_count'], days * 2)
+            # Routines are cached and there is nothing new to close the second time round
+            with self.assertNumQueries(1):
+                build_plan_context(self.goal, plan_date)
+
+    def test_summary_is_incremental_and_bounded(self):
+        self.add_days(29)
+        build_plan_context(self.goal, self.start + timedelta(days=10))
+        self.goal.refresh_from_db()
+        self.assertEqual(self.goal.progress_summary['days'], 10)
+
+        build_plan_context(self.goal, self.start + timedelta(days=29))
+        self.goal.refresh_from_db()
+        summary = self.goal.progress_summary
+        self.assertEqual(summary['days'], 29)
+        self.assertEqual(summary['total_activities'], 87)
+        self.assertEqual(summary['activities']['Activity 1'], [29, 0])
+        self.assertEqual(len(summary['recent_days']), 7)
+
+    def test_status_change_on_a_closed_day_reaches_the_prompt(self):
+        self.add_days(3)
+        build_plan_context(self.goal, self.start + timedelta(days=3))
+        activity = DailyPlanActivity.objects.get(plan__plan_date=self.start, activity_name='Activity 1')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(
+            '/planner/daily-plan-activities-update/bulk/', [{'id': activity.id, 'status': True}], format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.goal.refresh_from_db()
+        context = build_plan_context(self.goal, self.start + timedelta(days=3))
+        self.assertEqual(context['completed_activities_count'], 7)
+        self.assertEqual(self.goal.progress_summary['completed_activities'], 7)
+        self.assertIn("2024-01-01: 3/3", context['progress_summary'])
+
+    def test_planning_ahead_includes_today_so_far(self):
+        self.add_days(2)  # Jan 1 and Jan 2
+        now = timezone.make_aware(datetime(2024, 1, 2, 20))
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            context = build_plan_context(self.goal, date(2024, 1, 3))
+        self.assertIn("Days so far: 1,", context['progress_summary'])
+        self.assertIn("Today so far (2024-01-02): 2/3 activities completed.", context['progress_summary'])
+
+    def test_busy_times_match_day_type(self):
+        self.add_days(1)
+        weekday_context = build_plan_context(self.goal, date(2024, 1, 2))  # Tuesday
+        weekend_context = build_plan_context(self.goal, date(2024, 1, 6))  # Saturday
+        self.assertEqual(weekday_context['busy_times'][0]['start_time'], '09:00')
+        self.assertEqual(weekend_context['busy_times'], [])
+
+
+class BusyTimeIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def index(self, *ranges):
+        return BusyTimeIndex([
+            {'activity_name': f'Routine {n}', 'start_time': start, 'end_time': end}
+            for n, (start, end) in enumerate(ranges)
+        ])
+
+    def test_overlapping_routines_are_merged(self):
+        index = self.index(('09:00', '12:00'), ('11:00', '13:00'), ('18:00', '19:00'))
+        self.assertEqual(list(zip(index.starts, index.ends)), [(540, 780), (1080, 1140)])
+
+    def test_find_overlap(self):
+        index = self.index(('09:00', '12:00'), ('18:00', '19:00'))
+        self.assertIsNone(index.find_overlap(time(12), time(18)))
+        self.assertIsNone(index.find_overlap(time(8), time(9)))
+        self.assertEqual(index.find_overlap(time(11, 30), time(12, 30))[0], 'Routine 0')
+        self.assertEqual(index.find_overlap(time(17), time(20))[0], 'Routine 1')
+
+    def test_overnight_routine(self):
+        index = self.index(('22:00', '06:00'))
+        self.assertIsNotNone(index.find_overlap(time(5), time(7)))
+        self.assertIsNotNone(index.find_overlap(time(22, 30), time(23)))
+        self.assertIsNone(index.find_overlap(time(7), time(21)))
+
+    def test_free_slots(self):
+        index = self.index(('09:00', '12:00'), ('18:00', '19:00'))
+        self.assertEqual(index.free_slots(after=600, min_length=30), [(720, 1080), (1140, 1440)])
+
+    def test_index_is_invalidated_when_routines_change(self):
+        user = User.objects.create_user(username='busy', password='password')
+        monday = date(2024, 1, 1)
+        self.assertEqual(get_busy_index(user.id, monday).starts, [])
+        DailyRoutine.objects.create(
+            user=user, activity_name='Gym', start_time=time(7), end_time=time(8), days_of_week='Monday'
+        )
+        self.assertEqual(get_busy_index(user.id, monday).starts, [420])
+
+
+class LocalSchedulerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='scheduler', password='password')
+        self.goal = Goal.objects.create(
+            user=self.user,
+            goal_name='Learn Spanish',
+            goal_description='Hold a basic conversation in Spanish.',
+            goal_start_date=date(2024, 1, 1),
+            goal_end_date=date(2024, 2, 1),
+        )
+
+    def test_plan_avoids_busy_times(self):
+        index = BusyTimeIndex([
+            {'activity_name': 'Work', 'start_time': '07:30', 'end_time': '17:00'},
+        ])
+        plan = build_local_plan(self.goal, date(2024, 1, 2), index)
+        self.assertGreaterEqual(len(plan['activities']), 5)
+        previous_end = time(0)
+        for activity in plan['activities']:
+            start = time.fromisoformat(activity['start_time'])
+            end = time.fromisoformat(activity['end_time'])
+            self.assertLess(start, end)
+            self.assertGreaterEqual(start, previous_end)
+            self.assertIsNone(index.find_overlap(start, end))
+            previous_end = end
+
+    def test_history_is_preferred(self):
+        plan = DailyPlan.objects.create(goal=self.goal, plan_date=date(2024, 1, 1))
+        DailyPlanActivity.objects.create(
+            plan=plan, activity_name='Duolingo lesson', start_time=time(19), end_time=time(19, 20), status=True
+        )
+        result = build_local_plan(self.goal, date(2024, 1, 2), BusyTimeIndex([]))
+        first = result['activities'][0]
+        self.assertEqual(first['activity_name'], 'Duolingo lesson')
+        self.assertEqual((first['start_time'], first['end_time']), ('07:00', '07:20'))
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='single', password='password')
+        self.goal = Goal.objects.create(
+            user=self.user,
+            goal_name='Write a novel',
+            goal_description='Finish the first draft.',
+            goal_start_date=date(2024, 1, 1),
+            goal_end_date=date(2024, 2, 1),
+        )
+        self.plan_date = date(2024, 1, 2)
+
+    def test_one_plan_per_goal_and_day(self):
+        DailyPlan.objects.create(goal=self.goal, plan_date=self.plan_date)
+        with self.assertRaises(IntegrityError):
+            DailyPlan.objects.create(goal=self.goal, plan_date=self.plan_date)
+
+    def test_concurrent_request_waits_for_the_first(self):
+        job, leader = claim_generation(self.goal, self.plan_date)
+        self.assertTrue(leader)
+        same_job, leader = claim_generation(self.goal, self.plan_date)
+        self.assertEqual(same_job.pk, job.pk)
+        self.assertFalse(leader)
+        with self.assertRaises(PlanGenerationInProgress):
+            wait_for_generation(same_job, timeout=0.01)
+
+    def test_generated_plan_is_shared(self):
+        first = generate_plan_once(self.goal, self.plan_date, fast=True)
+        second = generate_plan_once(self.goal, self.plan_date, fast=True)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(DailyPlan.objects.filter(goal=self.goal).count(), 1)
+        self.assertEqual(PlanGenerationJob.objects.get(goal=self.goal).status, 'Succeeded')
+
+    def test_failed_generation_can_be_retried(self):
+        job, _ = claim_generation(self.goal, self.plan_date)
+        PlanGenerationJob.objects.filter(pk=job.pk).update(status='Failed', error='Gemma is down')
+        _, leader = claim_generation(self.goal, self.plan_date)
+        self.assertTrue(leader)
+
+
+class RecentGoalTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='home', password='password')
+        today = timezone.now().date()
+        self.goal = Goal.objects.create(
+            user=self.user,
+            goal_name='Get fit',
+            goal_description='Exercise every day.',
+            goal_start_date=today - timedelta(days=3),
+            goal_end_date=today + timedelta(days=10),
+        )
+        self.plan = DailyPlan.objects.create(goal=self.goal, plan_date=today)
+        self.activities = DailyPlanActivity.objects.bulk_create([
+            DailyPlanActivity(plan=self.plan, activity_name=f'Activity {n}', start_time=time(8 + n), end_time=time(9 + n))
+            for n in range(5)
+        ])
+        cache.clear()
+
+    def test_payload_is_loaded_in_constant_queries_and_cached(self):
+        # Version stamp, goal, today's plan, its activities
+        with self.assertNumQueries(4):
+            payload = get_recent_goal_payload(self.user.id)
+        self.assertEqual(payload['daily_plans']['day_number'], 4)
+        self.assertEqual(len(payload['daily_plans']['activities']), 5)
+        with self.assertNumQueries(1):
+            get_recent_goal_payload(self.user.id)
+
+    def test_activity_patch_invalidates_payload(self):
+        self.assertFalse(get_recent_goal_payload(self.user.id)['daily_plans']['activities'][0]['status'])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(
+            f'/planner/daily-plan-activities-update/{self.activities[0].id}/', {'status': True}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_recent_goal_payload(self.user.id)['daily_plans']['activities'][0]['status'])
+
+
+class ListEndpointTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lister', password='password')
+        Goal.objects.bulk_create([
+            Goal(
+                user=self.user, goal_name=f'Goal {n}', goal_description='A long description. ' * 50,
+                goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20), status='Completed',
+            )
+            for n in range(25)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get('/planner/goals/')
+        self.assertEqual(len(response.json()), 25)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/planner/goals/?page_size=10')
+        page = response.json()
+        self.assertEqual([goal['goal_name'] for goal in page['results']][:2], ['Goal 24', 'Goal 23'])
+        names = [goal['goal_name'] for goal in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            names += [goal['goal_name'] for goal in page['results']]
+        self.assertEqual(len(names), 25)
+        self.assertEqual(len(set(names)), 25)
+
+    def test_sparse_fieldset(self):
+        # ETag version stamp, then the goals with only the requested columns
+        with self.assertNumQueries(2):
+            response = self.client.get('/planner/goals/?fields=id,goal_name')
+        self.assertEqual(set(response.json()[0]), {'id', 'goal_name'})
+
+    def test_sparse_fieldset_ignores_unknown_names(self):
+        full = set(self.client.get('/planner/goals/').json()[0])
+        self.assertEqual(set(self.client.get('/planner/goals/?fields=id,bogus').json()[0]), {'id'})
+        self.assertEqual(set(self.client.get('/planner/goals/?fields=bogus').json()[0]), full)
+
+
+class BulkActivityStatusTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ticker', password='password')
+        self.goal = Goal.objects.create(
+            user=self.user, goal_name='Read more', goal_description='Read every day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        self.plan = DailyPlan.objects.create(goal=self.goal, plan_date=date(2024, 1, 2))
+        self.activities = DailyPlanActivity.objects.bulk_create([
+            DailyPlanActivity(plan=self.plan, activity_name=f'Chapter {n}', start_time=time(8 + n), end_time=time(9 + n))
+            for n in range(3)
+        ])
+        add_activities(self.plan, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = '/planner/daily-plan-activities-update/bulk/'
+
+    def patch(self, updates):
+        return self.client.patch(self.url, updates, format='json')
+
+    def test_statuses_roll_up_to_the_plan(self):
+        response = self.patch([{'id': self.activities[0].id, 'status': True}, {'id': self.activities[1].id, 'status': True}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['plans'], [{'id': self.plan.id, 'status': 'In Progress'}])
+
+        response = self.patch([{'id': activity.id, 'status': True} for activity in self.activities])
+        self.assertEqual(response.json()['plans'][0]['status'], 'Completed')
+        self.assertEqual(DailyPlanActivity.objects.filter(plan=self.plan, status=True).count(), 3)
+
+        self.goal.refresh_from_db()
+        self.assertEqual((self.goal.completed_activities, self.goal.completed_days), (3, 1))
+
+        self.patch([{'id': activity.id, 'status': False} for activity in self.activities])
+        self.plan.refresh_from_db()
+        self.assertEqual(self.plan.status, 'Pending')
+        self.goal.refresh_from_db()
+        self.assertEqual((self.goal.completed_activities, self.goal.completed_days), (0, 0))
+
+    def test_other_users_activities_are_rejected(self):
+        other = User.objects.create_user(username='other', password='password')
+        other_goal = Goal.objects.create(
+            user=other, goal_name='Other', goal_description='Other goal.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        other_plan = DailyPlan.objects.create(goal=other_goal, plan_date=date(2024, 1, 2))
+        foreign = DailyPlanActivity.objects.create(
+            plan=other_plan, activity_name='Secret', start_time=time(8), end_time=time(9)
+        )
+        response = self.patch([{'id': self.activities[0].id, 'status': True}, {'id': foreign.id, 'status': True}])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(DailyPlanActivity.objects.filter(status=True).exists())
+
+    def test_plan_created_before_the_counters_is_recounted(self):
+        # Activities created directly leave every counter at 0, one of them already completed
+        plan = DailyPlan.objects.create(goal=self.goal, plan_date=date(2024, 1, 3))
+        legacy = DailyPlanActivity.objects.bulk_create([
+            DailyPlanActivity(
+                plan=plan, activity_name=f'Essay {n}', start_time=time(8 + n), end_time=time(9 + n), status=n == 0
+            )
+            for n in range(3)
+        ])
+
+        response = self.client.patch(
+            f'/planner/daily-plan-activities-update/{legacy[0].id}/', {'status': False}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        plan.refresh_from_db()
+        self.assertEqual((plan.total_activities, plan.completed_activities, plan.status), (3, 0, 'Pending'))
+
+        response = self.patch([{'id': activity.id, 'status': True} for activity in legacy])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['plans'], [{'id': plan.id, 'status': 'Completed'}])
+        self.goal.refresh_from_db()
+        self.assertEqual((self.goal.total_activities, self.goal.completed_activities, self.goal.completed_days), (6, 3, 1))
+
+        response = self.patch([{'id': activity.id, 'status': False} for activity in legacy[1:]])
+        self.assertEqual(response.json()['plans'], [{'id': plan.id, 'status': 'In Progress'}])
+        self.assertEqual(rebuild_counters(fix=False), (0, 0))
+
+    def test_duplicate_ids_are_invalid(self):
+        response = self.patch([{'id': self.activities[0].id, 'status': True}, {'id': self.activities[0].id, 'status': False}])
+        self.assertEqual(response.status_code, 400)
+
+
+class ProgressCounterTests(TestCase):
+
+    def test_generated_plan_is_counted_and_rebuild_finds_drift(self):
+        user = User.objects.create_user(username='counter', password='password')
+        goal = Goal.objects.create(
+            user=user, goal_name='Learn chess', goal_description='Play every day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        plan = generate_plan_once(goal, date(2024, 1, 2), fast=True)
+        plan.refresh_from_db()
+        goal.refresh_from_db()
+        self.assertEqual(plan.total_activities, plan.activities.count())
+        self.assertEqual(goal.total_activities, plan.total_activities)
+        self.assertEqual(rebuild_counters(fix=False), (0, 0))
+
+        # A change that bypasses the counters is reported and repaired
+        plan.activities.update(status=True)
+        self.assertEqual(rebuild_counters(), (1, 1))
+        goal.refresh_from_db()
+        self.assertEqual((goal.completed_activities, goal.completed_days), (plan.total_activities, 1))
+        self.assertEqual(rebuild_counters(fix=False), (0, 0))
+
+    def test_unticking_an_uncounted_activity_keeps_counters_at_zero(self):
+        # Completed before the counters were maintained: every counter is still 0
+        user = User.objects.create_user(username='legacy', password='password')
+        goal = Goal.objects.create(
+            user=user, goal_name='Run', goal_description='Run every day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        plan = DailyPlan.objects.create(goal=goal, plan_date=date(2024, 1, 2))
+        activity = DailyPlanActivity.objects.create(
+            plan=plan, activity_name='Warm up', start_time=time(8), end_time=time(9), status=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.patch(
+            f'/planner/daily-plan-activities-update/{activity.id}/', {'status': False}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        plan.refresh_from_db()
+        goal.refresh_from_db()
+        self.assertEqual((plan.completed_activities, plan.status), (0, 'Pending'))
+        self.assertEqual((goal.completed_activities, goal.completed_days), (0, 0))
+
+
+class ProgressAnalyticsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='analyst', password='password')
+        self.goal = Goal.objects.create(
+            user=self.user, goal_name='Meditate', goal_description='Ten minutes a day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 30),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def complete(self, plan, count):
+        activities = list(plan.activities.order_by('id')[:count])
+        response = self.client.patch(
+            '/planner/daily-plan-activities-update/bulk/',
+            [{'id': activity.id, 'status': True} for activity in activities], format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_rollup_is_maintained_and_served(self):
+        # Jan 1-3 have a completed activity, Jan 4 none, Jan 5 one
+        plans = [generate_plan_once(self.goal, date(2024, 1, day), fast=True) for day in range(1, 6)]
+        for plan, count in zip(plans, [1, 2, 1, 0, 1]):
+            if count:
+                self.complete(plan, count)
+
+        response = self.client.get('/planner/analytics/', {'from': '2024-01-01', 'to': '2024-01-06'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([day['completed'] for day in data['days']], [1, 2, 1, 0, 1])
+        self.assertEqual(data['days'][0]['planned'], plans[0].activities.count())
+        self.assertEqual((data['longest_streak'], data['current_streak']), (3, 1))
+        self.assertEqual(data['weekday_averages'][1], {'weekday': 'Tuesday', 'average_completed': 2.0})
+
+        # The backfill reproduces the incrementally maintained rows
+        rows = DailyProgress.objects.order_by('date').values_list('date', 'planned_activities', 'completed_activities')
+        maintained = list(rows)
+        DailyProgress.objects.all().delete()
+        backfill_daily_progress()
+        self.assertEqual(list(rows.all()), maintained)
+
+    def test_plan_created_before_the_rollup_reports_its_planned_activities(self):
+        plan = DailyPlan.objects.create(goal=self.goal, plan_date=date(2024, 1, 2))
+        DailyPlanActivity.objects.bulk_create([
+            DailyPlanActivity(plan=plan, activity_name=f'Sit {n}', start_time=time(8 + n), end_time=time(9 + n))
+            for n in range(3)
+        ])
+        self.complete(plan, 1)
+
+        days = self.client.get('/planner/analytics/', {'from': '2024-01-02', 'to': '2024-01-02'}).json()['days']
+        self.assertEqual((days[0]['planned'], days[0]['completed']), (3, 1))
+
+    def test_other_users_goal_is_not_accessible(self):
+        other = User.objects.create_user(username='stranger', password='password')
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.get('/planner/analytics/', {'goal': self.goal.id}).status_code, 404)
+
+
+class PlanCalendarTests(TestCase):
+
+    def test_month_loads_in_two_queries(self):
+        cache.clear()
+        user = User.objects.create_user(username='calendar', password='password')
+        goal = Goal.objects.create(
+            user=user, goal_name='Learn guitar', goal_description='Practice daily.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 30),
+        )
+        for day in range(1, 31):
+            generate_plan_once(goal, date(2024, 1, day), fast=True)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        # ETag version stamp, plans, activities
+        with self.assertNumQueries(3):
+            response = client.get('/planner/calendar/', {'from': '2024-01-01', 'to': '2024-01-31'})
+        plans = response.json()['plans']
+        self.assertEqual(len(plans), 30)
+        self.assertEqual(plans[0]['plan_date'], '2024-01-01')
+        self.assertEqual(len(plans[0]['activities']), plans[0]['total_activities'])
+
+        self.assertEqual(client.get('/planner/calendar/', {'from': '2024-01-01', 'to': '2024-06-01'}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poller', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        DailyRoutine.objects.create(
+            user=self.user, activity_name='Work', start_time=time(9), end_time=time(17), days_of_week='Weekday'
+        )
+
+    def test_unchanged_data_is_not_modified(self):
+        response = self.client.get('/planner/daily-routines/')
+        etag = response['ETag']
+        # Only the version stamp is read
+        with self.assertNumQueries(1):
+            response = self.client.get('/planner/daily-routines/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Other scopes and query strings have their own tags
+        self.assertEqual(self.client.get('/planner/goals/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/planner/daily-routines/?fields=id', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_user_with_data_can_be_deleted(self):
+        goal = Goal.objects.create(
+            user=self.user, goal_name='Learn chess', goal_description='Play every day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        generate_plan_once(goal, date(2024, 1, 2), fast=True)
+        Notification.objects.create(user=self.user, message="Plan ready.")
+        self.assertTrue(DataVersion.objects.filter(user=self.user).exists())
+
+        # The cascade must not recreate the version row it deletes
+        self.user.delete()
+        self.assertFalse(DataVersion.objects.exists())
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get('/planner/daily-routines/')['ETag']
+        DailyRoutine.objects.create(
+            user=self.user, activity_name='Gym', start_time=time(18), end_time=time(19), days_of_week='Monday'
+        )
+        response = self.client.get('/planner/daily-routines/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['gemma'].clear()
+        gemma_client.reset_policy()  # Earlier tests may have opened the circuit
+        self.user = User.objects.create_user(username='async', password='password')
+        self.headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    async def test_goal_is_created_and_enriched(self):
+        start = timezone.now().date()
+        payload = {
+            "goal_name": "Learn Spanish", "goal_description": "Hold a short conversation.",
+            "goal_start_date": str(start), "goal_end_date": str(start + timedelta(days=20)),
+        }
+        with StubLLMServer(reply="7") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            response = await self.async_client.post(
+                '/planner/async/goals/', payload, content_type='application/json', headers=self.headers
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['feasibility_score'], 7)
+        self.assertEqual(response.json()['model_notes'], "7")
+
+        # Validation runs as for the sync endpoint
+        response = await self.async_client.post(
+            '/planner/async/goals/', payload, content_type='application/json', headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_plan_falls_back_to_the_local_scheduler(self):
+        today = timezone.now().date()
+        goal = await Goal.objects.acreate(
+            user=self.user, goal_name='Read more', goal_description='Finish a book a week.',
+            goal_start_date=today, goal_end_date=today + timedelta(days=10),
+        )
+        url = f'/planner/async/generate-daily-plan/{goal.id}/'
+        with StubLLMServer(reply="No plan today.") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(stub.requests, 1)  # The unparseable plan falls back to the local scheduler
+        self.assertTrue(await DailyPlan.objects.filter(goal=goal, plan_date=today).aexists())
+
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    async def test_token_is_required(self):
+        response = await self.async_client.post('/planner/async/goals/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', 'http://gemma.test/v1/chat/completions'))
+
+
+class GemmaResilienceTests(TestCase):
+
+    def policy(self, max_retries=2, budget_tokens=10, hedge_percentile=0, executor=None):
+        return ResiliencePolicy(
+            breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60),
+            budget=RetryBudget(ratio=0.1, max_tokens=budget_tokens),
+            latencies=LatencyTracker(window=100),
+            max_retries=max_retries, backoff_base=0.001, backoff_cap=0.01,
+            hedge_percentile=hedge_percentile, hedge_min_samples=5, executor=executor,
+        )
+
+    def test_transient_errors_are_retried_within_the_budget(self):
+        attempts = []
+
+        def flaky(timeout):
+            attempts.append(timeout)
+            if len(attempts) < 3:
+                raise connection_error()
+            return "ok"
+
+        self.assertEqual(self.policy().call(flaky, timeout=5), "ok")
+        self.assertEqual(len(attempts), 3)
+        self.assertTrue(all(timeout <= 5 for timeout in attempts))  # One deadline for all attempts
+
+        # With the budget spent, the first failure is final
+        attempts.clear()
+        with self.assertRaises(openai.APIConnectionError):
+            self.policy(budget_tokens=0).call(flaky, timeout=5)
+        self.assertEqual(len(attempts), 1)
+
+    def test_breaker_opens_and_fails_fast(self):
+        policy = self.policy(max_retries=0)
+        attempts = []
+
+        def down(timeout):
+            attempts.append(timeout)
+            raise connection_error()
+
+        for _ in range(3):
+            with self.assertRaises(openai.APIConnectionError):
+                policy.call(down, timeout=5)
+        with self.assertRaises(CircuitOpen):
+            policy.call(down, timeout=5)
+        self.assertEqual(len(attempts), 3)
+
+        # After the reset timeout a successful trial closes it again
+        policy.breaker.opened_at -= 60
+        self.assertEqual(policy.call(lambda timeout: "ok", timeout=5), "ok")
+        self.assertEqual(policy.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_call_is_hedged(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            policy = self.policy(hedge_percentile=90, executor=executor)
+            for _ in range(5):
+                policy.latencies.record('plan', 0.01)
+            calls = []
+
+            def first_slow(timeout):
+                calls.append(timeout)
+                if len(calls) == 1:
+                    clock.sleep(1)
+                    return "slow"
+                return "fast"
+
+            started = clock.monotonic()
+            self.assertEqual(policy.call(first_slow, timeout=5, operation='plan'), "fast")
+            self.assertLess(clock.monotonic() - started, 0.5)
+
+    def test_open_circuit_falls_back_to_the_local_scheduler(self):
+        user = User.objects.create_user(username='breaker', password='password')
+        today = timezone.now().date()
+        goal = Goal.objects.create(
+            user=user, goal_name='Swim', goal_description='Swim 1km.',
+            goal_start_date=today, goal_end_date=today + timedelta(days=5),
+        )
+        gemma_client.reset_policy()
+        breaker = gemma_client.get_policy().breaker
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        try:
+            plan = generate_daily_plan(goal, today)
+        finally:
+            gemma_client.reset_policy()
+        self.assertTrue(plan.activities.exists())
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        caches['gemma'].clear()
+        gemma_client.reset_policy()
+        gemma_client.close_client()
+        start = timezone.now().date()
+        self.goal = Goal(
+            goal_name='Write a novel', goal_description='50,000 words.',
+            goal_start_date=start, goal_end_date=start + timedelta(days=29),
+        )
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_calls_tokens_and_parse_failures_are_counted(self):
+        calls = self.sample('gemma_call_duration_seconds_count', operation='feasibility', outcome='ok')
+        tokens = self.sample('gemma_tokens_total', operation='feasibility', kind='completion')
+        failures = self.sample('gemma_parse_failures_total', operation='feasibility')
+        fallbacks = self.sample('gemma_fallbacks_total', operation='feasibility')
+
+        with StubLLMServer(reply="very feasible") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            try:
+                score = GoalSerializer().calculate_feasibility_score(self.goal, timeout=5)
+            finally:
+                gemma_client.close_client()
+
+        self.assertEqual(score, 5)
+        self.assertEqual(
+            self.sample('gemma_call_duration_seconds_count', operation='feasibility', outcome='ok'), calls + 1
+        )
+        self.assertEqual(self.sample('gemma_tokens_total', operation='feasibility', kind='completion'), tokens + 1)
+        self.assertEqual(self.sample('gemma_parse_failures_total', operation='feasibility'), failures + 1)
+        self.assertEqual(self.sample('gemma_fallbacks_total', operation='feasibility'), fallbacks + 1)
+
+    def test_rejected_activities_are_counted_and_exposed(self):
+        rejected = self.sample('plan_activities_rejected_total', reason='end_before_start')
+        plan = DailyPlan(goal=self.goal, plan_date=date(2024, 1, 1))
+        activity = {"activity_name": "Outline", "start_time": "10:00", "end_time": "09:00"}
+        self.assertIsNone(build_activity(plan, activity, BusyTimeIndex([])))
+        self.assertEqual(self.sample('plan_activities_rejected_total', reason='end_before_start'), rejected + 1)
+
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', headers={"Authorization": "Bearer scrape"})
+            self.assertEqual(response.status_code, 200)
+        self.assertIn(b'plan_activities_rejected_total{reason="end_before_start"}', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={"Authorization": "Bearer "}).status_code, 403)
+
+        self.client.force_login(User.objects.create_user(username='ops', password='password'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user(username='admin', password='password', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_SLOW_REQUEST_MS=0)
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='profiled', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        start = timezone.now().date()
+        Goal.objects.create(
+            user=self.user, goal_name='Run a marathon', goal_description='Train every day.',
+            goal_start_date=start, goal_end_date=start + timedelta(days=29),
+        )
+
+    def test_sampled_request_is_profiled_and_logged(self):
+        with self.assertLogs('planner_app.profiling', 'WARNING') as logs:
+            response = self.client.get('/planner/goals/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Slow request GET /planner/goals/ (goal-list) 200", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+        self.assertEqual(self.client.get('/planner/profiling/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        with self.assertLogs('planner_app.profiling', 'WARNING'):
+            response = self.client.get('/planner/profiling/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['sample_rate'], 1.0)
+        row = next(row for row in response.data['views'] if row['view'] == 'goal-list')
+        self.assertGreaterEqual(row['requests'], 1)
+        self.assertGreater(row['avg_sql_queries'], 0)
+
+    def test_unsampled_request_is_not_profiled(self):
+        with override_settings(PROFILING_SAMPLE_RATE=0), self.assertNoLogs('planner_app.profiling', 'WARNING'):
+            self.client.get('/planner/goals/')
+
+    def test_nested_serializers_are_timed_once(self):
+        goal = Goal.objects.get(user=self.user)
+        plan = DailyPlan.objects.create(goal=goal, plan_date=timezone.now().date())
+        DailyPlanActivity.objects.bulk_create([
+            DailyPlanActivity(plan=plan, activity_name=f'Run {n}', start_time=time(6 + n), end_time=time(7 + n))
+            for n in range(10)
+        ])
+        goal = load_recent_goal(self.user.id, plan.plan_date)
+
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            started = clock.perf_counter()
+            data = RecentGoalSerializer(goal).data  # The plan and its activities are serialized inside
+            elapsed = clock.perf_counter() - started
+        finally:
+            _current.reset(token)
+        self.assertEqual(len(data['daily_plans']['activities']), 10)
+        self.assertGreater(profile.serializer_time, 0)
+        self.assertLessEqual(profile.serializer_time, elapsed)
+
+    def test_llm_time_reaches_the_profile_from_executor_threads(self):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            record_llm_time(0.5)
+            with StubLLMServer(reply="4") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+                gemma_client.reset_policy()
+                gemma_client.close_client()
+                try:
+                    GoalSerializer().enrich_goal(Goal(
+                        goal_name='Learn Go', goal_description='Build a CLI.',
+                        goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 31),
+                    ))
+                finally:
+                    gemma_client.close_client()
+        finally:
+            _current.reset(token)
+        self.assertGreater(profile.llm_time, 0.5)
+        self.assertIsNone(_current.get())
+
+
+class GemmaClientTests(TestCase):
+
+    def setUp(self):
+        caches['gemma'].clear()
+        gemma_client.reset_policy()
+
+    def test_client_and_connections_are_reused_until_closed(self):
+        self.assertIs(gemma_client.get_executor(), gemma_client.get_executor())
+        with StubLLMServer(reply="7") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            client = gemma_client.get_client()
+            try:
+                for _ in range(3):
+                    self.assertEqual(gemma_client.complete("Ping"), "7")
+                self.assertIs(gemma_client.get_client(), client)
+                self.assertEqual(stub.connections, 1)  # One keep-alive connection for every call
+            finally:
+                gemma_client.close_client()
+            self.assertTrue(client._client.is_closed)
+
+            rebuilt = gemma_client.get_client()
+            try:
+                self.assertIsNot(rebuilt, client)
+                self.assertEqual(gemma_client.complete("Ping"), "7")
+                self.assertEqual(stub.connections, 2)
+            finally:
+                gemma_client.close_client()
+
+    def test_async_clients_are_closed_on_their_own_loop(self):
+        async def close_from_another_thread():
+            client = gemma_client.get_async_client()
+            self.assertIs(gemma_client.get_async_client(), client)
+            await asyncio.to_thread(gemma_client.close_client)
+            return client, client.is_closed()
+
+        client, closed = asyncio.run(close_from_another_thread())
+        self.assertTrue(closed)
+
+        # Left open, the client is closed when its loop shuts down
+        async def leave_open():
+            return gemma_client.get_async_client()
+
+        client = asyncio.run(leave_open())
+        self.assertTrue(client.is_closed())
+        gemma_client.close_client()  # Skips the closed loop
+
+
+class GoalEnrichmentTests(TestCase):
+
+    def setUp(self):
+        caches['gemma'].clear()
+        gemma_client.reset_policy()
+        start = timezone.now().date()
+        self.goal = Goal(
+            goal_name='Learn to juggle', goal_description='Three balls for a minute.',
+            goal_start_date=start, goal_end_date=start + timedelta(days=14),
+        )
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_calls_run_in_parallel(self):
+        with StubLLMServer(reply="8", latency=0.3) as stub, \
+                override_settings(GEMMA_BASE_URL=stub.base_url, GEMMA_GOAL_ENRICHMENT_DEADLINE=5):
+            gemma_client.close_client()
+            try:
+                started = clock.monotonic()
+                result = GoalSerializer().enrich_goal(self.goal)
+                elapsed = clock.monotonic() - started
+            finally:
+                gemma_client.close_client()
+        self.assertEqual(result, (8, "8"))
+        self.assertEqual(stub.peak_in_flight, 2)
+        self.assertLess(elapsed, 0.55)
+
+    def test_late_calls_fall_back_once(self):
+        fallbacks = [self.sample('gemma_fallbacks_total', operation=op) for op in ('feasibility', 'notes')]
+        errors = [
+            self.sample('gemma_call_duration_seconds_count', operation=op, outcome='error')
+            for op in ('feasibility', 'notes')
+        ]
+        with StubLLMServer(latency=1) as stub, \
+                override_settings(GEMMA_BASE_URL=stub.base_url, GEMMA_GOAL_ENRICHMENT_DEADLINE=0.2):
+            gemma_client.close_client()
+            try:
+                started = clock.monotonic()
+                result = GoalSerializer().enrich_goal(self.goal)
+                self.assertLess(clock.monotonic() - started, 0.5)
+                # Wait for the abandoned calls to give up at their own deadline
+                while clock.monotonic() - started < 5 and any(
+                    self.sample('gemma_call_duration_seconds_count', operation=op, outcome='error') == before
+                    for op, before in zip(('feasibility', 'notes'), errors)
+                ):
+                    clock.sleep(0.01)
+            finally:
+                gemma_client.close_client()
+        self.assertEqual(result, (DEFAULT_FEASIBILITY_SCORE, DEFAULT_MODEL_NOTES))
+        self.assertEqual(
+            [self.sample('gemma_fallbacks_total', operation=op) for op in ('feasibility', 'notes')],
+            [before + 1 for before in fallbacks],
+        )
+
+    def test_queued_calls_are_cancelled_at_the_deadline(self):
+        busy = threading.Event()
+        with StubLLMServer() as stub, override_settings(
+            GEMMA_BASE_URL=stub.base_url, GEMMA_GOAL_ENRICHMENT_DEADLINE=0.1
+        ):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(busy.wait)  # Saturate the executor
+                try:
+                    with mock.patch.object(gemma_client, 'get_executor', return_value=executor):
+                        result = GoalSerializer().enrich_goal(self.goal)
+                finally:
+                    busy.set()
+        self.assertEqual(result, (DEFAULT_FEASIBILITY_SCORE, DEFAULT_MODEL_NOTES))
+        self.assertEqual(stub.connections, 0)
+
+
+class PlanJobQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        gemma_client.reset_policy()
+        self.user = User.objects.create_user(username='queue', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.now().date()
+        self.goal = Goal.objects.create(
+            user=self.user, goal_name='Learn guitar', goal_description='Play three songs.',
+            goal_start_date=self.today, goal_end_date=self.today + timedelta(days=20),
+        )
+
+    def test_duplicate_submission_attaches_to_the_job(self):
+        job = enqueue_plan_generation(self.goal, self.today)
+        self.assertEqual(enqueue_plan_generation(self.goal, self.today).pk, job.pk)
+        self.assertEqual(PlanGenerationJob.objects.filter(goal=self.goal).count(), 1)
+
+    def test_job_is_not_claimed_before_run_after(self):
+        job = enqueue_plan_generation(self.goal, self.today, run_after=timezone.now() + timedelta(hours=1))
+        self.assertIsNone(claim_next_job())
+        PlanGenerationJob.objects.filter(pk=job.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.status, claimed.attempts), ('Running', 1))
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        enqueue_plan_generation(self.goal, self.today)
+        self.assertIsNotNone(claim_next_job())
+        self.assertIsNone(claim_next_job())
+
+    def test_failed_job_is_requeued(self):
+        job = enqueue_plan_generation(self.goal, self.today)
+        PlanGenerationJob.objects.filter(pk=job.pk).update(status='Failed', error='Gemma is down', attempts=3)
+        job = enqueue_plan_generation(self.goal, self.today)
+        self.assertEqual((job.status, job.error, job.attempts), ('Queued', None, 0))
+        self.assertEqual(claim_next_job().pk, job.pk)
+
+    def test_async_mode_returns_a_job_that_can_be_polled(self):
+        response = self.client.post(f'/planner/generate-daily-plan/{self.goal.id}/?mode=async')
+        self.assertEqual(response.status_code, 202)
+        job_url = f'/planner/generate-daily-plan/jobs/{response.data["job_id"]}/'
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'Queued')
+
+        with StubLLMServer(reply="No plan today.") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            try:
+                run_job(claim_next_job())  # The unparseable answer falls back to the local scheduler
+            finally:
+                gemma_client.close_client()
+        response = self.client.get(job_url)
+        self.assertEqual(response.data['status'], 'Succeeded')
+        self.assertEqual(response.data['plan_id'], DailyPlan.objects.get(goal=self.goal, plan_date=self.today).id)
+
+        other = User.objects.create_user(username='other-queue', password='password')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(job_url).status_code, 404)
+
+
+class PlanPregenerationTests(TestCase):
+
+    def setUp(self):
+        self.plan_date = date(2024, 3, 2)
+        self.goals = []
+        for n in range(4):
+            user = User.objects.create_user(username=f'early-{n}', password='password')
+            self.goals.append(Goal.objects.create(
+                user=user, goal_name=f'Goal {n}', goal_description='Every day.',
+                goal_start_date=date(2024, 3, 1), goal_end_date=date(2024, 3, 20),
+            ))
+        self.window_start = timezone.make_aware(datetime(2024, 3, 1, 22))
+
+    def test_jobs_are_spread_over_the_window(self):
+        jobs = enqueue_pregeneration(self.plan_date, self.window_start, window_seconds=3600)
+        self.assertEqual([job.goal_id for job in jobs], [goal.id for goal in self.goals])
+        self.assertEqual(
+            [job.run_after for job in jobs],
+            [self.window_start + timedelta(minutes=15 * n) for n in range(4)],
+        )
+
+    def test_goals_with_a_plan_are_skipped(self):
+        DailyPlan.objects.create(goal=self.goals[0], plan_date=self.plan_date)
+        ended = self.goals[1]
+        ended.goal_end_date = date(2024, 3, 1)
+        ended.save()
+        jobs = enqueue_pregeneration(self.plan_date, self.window_start, window_seconds=3600)
+        self.assertEqual([job.goal_id for job in jobs], [goal.id for goal in self.goals[2:]])
+
+    def test_rerun_keeps_the_existing_jobs(self):
+        first = enqueue_pregeneration(self.plan_date, self.window_start, window_seconds=3600)
+        later = self.window_start + timedelta(hours=1)
+        second = enqueue_pregeneration(self.plan_date, later, window_seconds=3600)
+        self.assertEqual([job.pk for job in second], [job.pk for job in first])
+        self.assertEqual([job.run_after for job in second], [job.run_after for job in first])
+        self.assertEqual(PlanGenerationJob.objects.count(), 4)
+
+    def test_command_queues_the_jobs_once(self):
+        out = StringIO()
+        call_command('pregenerate_daily_plans', date='2024-03-02', window_hours=1, stdout=out)
+        self.assertIn("4 goals need a plan for 2024-03-02, 4 jobs pending.", out.getvalue())
+        call_command('pregenerate_daily_plans', date='2024-03-02', window_hours=1, stdout=StringIO())
+        self.assertEqual(PlanGenerationJob.objects.filter(plan_date=self.plan_date).count(), 4)
+
+
+class GemmaCacheTests(TestCase):
+
+    def setUp(self):
+        caches['gemma'].clear()
+        gemma_client.reset_policy()
+        start = timezone.now().date()
+        self.goal = Goal(
+            goal_name='Bake bread', goal_description='A sourdough loaf.',
+            goal_start_date=start, goal_end_date=start + timedelta(days=10),
+        )
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_key_is_normalized(self):
+        key = gemma_client.cache_key("Rate  this goal:\nRun 5k", 'gemma')
+        self.assertEqual(gemma_client.cache_key("rate this GOAL: run 5k ", 'gemma'), key)
+        self.assertNotEqual(gemma_client.cache_key("rate this goal: run 10k", 'gemma'), key)
+        self.assertNotEqual(gemma_client.cache_key("rate this goal: run 5k", 'other-model'), key)
+
+    def test_hits_and_misses(self):
+        hits = self.sample('gemma_cache_hits_total', operation='feasibility')
+        misses = self.sample('gemma_cache_misses_total', operation='feasibility')
+        with StubLLMServer(reply="7") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            try:
+                scores = [GoalSerializer().calculate_feasibility_score(self.goal) for _ in range(3)]
+            finally:
+                gemma_client.close_client()
+        self.assertEqual(scores, [7, 7, 7])
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual(self.sample('gemma_cache_misses_total', operation='feasibility'), misses + 1)
+        self.assertEqual(self.sample('gemma_cache_hits_total', operation='feasibility'), hits + 2)
+
+    def test_unparseable_answer_is_not_cached(self):
+        hits = self.sample('gemma_cache_hits_total', operation='feasibility')
+        with StubLLMServer(reply="very feasible") as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            try:
+                scores = [GoalSerializer().calculate_feasibility_score(self.goal) for _ in range(2)]
+            finally:
+                gemma_client.close_client()
+        self.assertEqual(scores, [DEFAULT_FEASIBILITY_SCORE] * 2)
+        self.assertEqual(stub.requests, 2)
+        self.assertEqual(self.sample('gemma_cache_hits_total', operation='feasibility'), hits)
+
+
+class QuotePoolTests(TestCase):
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_oldest_quote_is_taken(self):
+        MotivationalQuote.objects.bulk_create([MotivationalQuote(text=text) for text in ("First", "Second")])
+        self.assertEqual(quotes.take_quote(), "First")
+        self.assertEqual(list(MotivationalQuote.objects.values_list('text', flat=True)), ["Second"])
+
+    def test_empty_pool_falls_back(self):
+        fallbacks = self.sample('gemma_fallbacks_total', operation='quotes')
+        self.assertEqual(quotes.take_quote(), quotes.DEFAULT_MOTIVATIONAL_QUOTE)
+        self.assertEqual(self.sample('gemma_fallbacks_total', operation='quotes'), fallbacks + 1)
+
+    @override_settings(QUOTE_POOL_LOW_WATER=2)
+    def test_refill_is_scheduled_below_the_low_water_mark(self):
+        MotivationalQuote.objects.bulk_create([MotivationalQuote(text=f"Quote {n}") for n in range(4)])
+        with mock.patch.object(quotes, 'schedule_refill') as schedule_refill:
+            quotes.take_quote()  # Three left
+            schedule_refill.assert_not_called()
+            quotes.take_quote()  # Two left, no longer more than the low-water mark
+            schedule_refill.assert_called_once()
+
+    def test_background_refill_can_be_switched_off(self):
+        with mock.patch.object(gemma_client, 'get_executor') as get_executor:
+            quotes.schedule_refill()  # Off in the test run
+        get_executor.assert_not_called()
+
+    @override_settings(QUOTE_POOL_BATCH_SIZE=2)
+    def test_refill_command_tops_the_pool_up(self):
+        MotivationalQuote.objects.create(text="Already there")
+        reply = '["Keep going!", "One step at a time."]'
+        with StubLLMServer(reply=reply) as stub, override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            try:
+                out = StringIO()
+                call_command('refill_quote_pool', size=4, stdout=out)
+                self.assertIn("Added 4 quotes", out.getvalue())  # Two batches of two
+                self.assertEqual(stub.requests, 2)
+                call_command('refill_quote_pool', size=4, stdout=out)
+                self.assertEqual(stub.requests, 2)  # Already full
+            finally:
+                gemma_client.close_client()
+        self.assertEqual(MotivationalQuote.objects.count(), 5)
+
+
+class ActivityStreamParserTests(TestCase):
+
+    def feed_in_pieces(self, text, size):
+        parser = ActivityStreamParser()
+        activities = []
+        for start in range(0, len(text), size):
+            activities.extend(parser.feed(text[start:start + size]))
+        return activities
+
+    def test_chunks_split_mid_token(self):
+        text = json.dumps({"activities": [
+            {"activity_name": "Stretch", "start_time": "07:00", "end_time": "07:15"},
+            {"activity_name": "Run", "start_time": "07:30", "end_time": "08:00"},
+        ], "notes": "Easy day."})
+        for size in (1, 3, 7, len(text)):
+            self.assertEqual([a["activity_name"] for a in self.feed_in_pieces(text, size)], ["Stretch", "Run"])
+
+    def test_escaped_quotes_and_braces_in_strings(self):
+        name = 'Say "hi" {loudly} ] \\ then stop'
+        text = json.dumps({"activities": [{"activity_name": name, "notes": "}{"}, {"activity_name": "Next"}]})
+        activities = self.feed_in_pieces(text, 2)
+        self.assertEqual([a["activity_name"] for a in activities], [name, "Next"])
+        self.assertEqual(activities[0]["notes"], "}{")
+
+    def test_objects_after_the_array_and_invalid_objects_are_ignored(self):
+        text = 'Sure! {"activities": [{"activity_name": oops}, {"activity_name": "Read"}], "extra": {"a": 1}}'
+        self.assertEqual(self.feed_in_pieces(text, 4), [{"activity_name": "Read"}])
+
+    def test_truncated_stream_yields_only_complete_objects(self):
+        text = '{"activities": [{"activity_name": "Read"}, {"activity_name": "Wri'
+        self.assertEqual(self.feed_in_pieces(text, 5), [{"activity_name": "Read"}])
+
+
+def parse_events(body):
+    events = []
+    for block in body.decode().split("\n\n"):
+        if block:
+            lines = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class PlanStreamingTests(TestCase):
+    plan_reply = json.dumps({
+        "activities": [
+            {"activity_name": "Warm up", "start_time": "08:00", "end_time": "08:15", "notes": "Say \"go\" {now}"},
+            {"activity_name": "Intervals", "start_time": "08:30", "end_time": "09:00"},
+        ],
+        "notes": "Hydrate.",
+    })
+
+    def setUp(self):
+        cache.clear()
+        gemma_client.reset_policy()
+        self.user = User.objects.create_user(username='streamer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = date(2024, 3, 5)
+        self.goal = Goal.objects.create(
+            user=self.user, goal_name='Run faster', goal_description='A 25 minute 5k.',
+            goal_start_date=self.today, goal_end_date=self.today + timedelta(days=20),
+        )
+        # Early in the morning, so no generated activity has already started
+        now = mock.patch('django.utils.timezone.now', return_value=timezone.make_aware(datetime(2024, 3, 5, 6)))
+        now.start()
+        self.addCleanup(now.stop)
+
+    def stream(self, reply, chunk_size=7):
+        with StubLLMServer(reply=reply, chunk_size=chunk_size) as stub, \
+                override_settings(GEMMA_BASE_URL=stub.base_url):
+            gemma_client.close_client()
+            try:
+                response = self.client.post(f'/planner/generate-daily-plan/{self.goal.id}/stream/')
+                self.assertEqual(response.status_code, 200)
+                return parse_events(b"".join(response.streaming_content))
+            finally:
+                gemma_client.close_client()
+
+    def test_activities_are_streamed_as_they_complete(self):
+        events = self.stream(self.plan_reply)
+        self.assertEqual([event for event, _ in events], ['plan', 'activity', 'activity', 'done'])
+        plan = DailyPlan.objects.get(goal=self.goal, plan_date=self.today)
+        self.assertEqual(events[0][1], {"plan_id": plan.id})
+        self.assertEqual(events[1][1]["notes"], 'Say "go" {now}')
+        self.assertEqual(plan.notes, "Hydrate.")
+        self.assertEqual(plan.activities.count(), 2)
+        self.assertEqual(PlanGenerationJob.objects.get(goal=self.goal).status, 'Succeeded')
+
+        # A request that finds the plan already generated replays it
+        self.assertEqual(list(stream_plan_once(self.goal, self.today)), events)
+
+    def test_truncated_stream_falls_back_to_the_local_scheduler(self):
+        events = self.stream(self.plan_reply[:40])
+        self.assertEqual(events[0][0], 'plan')
+        self.assertEqual(events[-1][0], 'done')
+        self.assertGreater(len(events), 2)
+        self.assertEqual(DailyPlan.objects.get(goal=self.goal, plan_date=self.today).id, events[0][1]["plan_id"])
+
+    def fail_after_first_activity(self, *args, **kwargs):
+        yield self.plan_reply[:self.plan_reply.index('Intervals')]  # Only the first activity is complete
+        raise openai.APIConnectionError(request=httpx.Request('POST', 'http://gemma.invalid/'))
+
+    def assert_replaced(self, events):
+        partial_id = events[0][1]["plan_id"]
+        self.assertEqual([event for event, _ in events[:3]], ['plan', 'activity', 'reset'])
+        self.assertEqual(events[2][1], {"plan_id": partial_id})
+        self.assertFalse(DailyPlan.objects.filter(id=partial_id).exists())
+
+        # Only the local plan is left, and counted once
+        plan = DailyPlan.objects.get(goal=self.goal, plan_date=self.today)
+        self.assertEqual(events[3][1], {"plan_id": plan.id})
+        self.assertEqual(events[-1][0], 'done')
+        self.assertNotIn("Warm up", [data.get("activity_name") for _, data in events[3:]])
+        self.goal.refresh_from_db()
+        self.assertEqual(self.goal.total_activities, plan.activities.count())
+        self.assertEqual(DailyProgress.objects.get(goal=self.goal).planned_activities, plan.activities.count())
+        self.assertEqual(PlanGenerationJob.objects.get(goal=self.goal).status, 'Succeeded')
+
+    def test_failure_after_the_first_activity_replaces_the_partial_plan(self):
+        with mock.patch.object(gemma_client, 'stream', side_effect=self.fail_after_first_activity):
+            response = self.client.post(f'/planner/generate-daily-plan/{self.goal.id}/stream/')
+            events = parse_events(b"".join(response.streaming_content))
+        self.assert_replaced(events)
+
+    @override_settings(PLAN_LOCAL_FALLBACK=False)
+    def test_failure_after_the_first_activity_without_fallback_keeps_nothing(self):
+        with mock.patch.object(gemma_client, 'stream', side_effect=self.fail_after_first_activity):
+            events = list(stream_plan_once(self.goal, self.today))
+        self.assertEqual([event for event, _ in events], ['plan', 'activity', 'reset', 'error'])
+        self.assertFalse(DailyPlan.objects.filter(goal=self.goal).exists())
+        self.goal.refresh_from_db()
+        self.assertEqual(self.goal.total_activities, 0)
+        self.assertFalse(DailyProgress.objects.exists())
+        self.assertEqual(PlanGenerationJob.objects.get(goal=self.goal).status, 'Failed')
+
+    def test_stream_cut_off_inside_the_array_replaces_the_partial_plan(self):
+        events = self.stream(self.plan_reply[:self.plan_reply.index('Intervals')])
+        self.assert_replaced(events)
+
+    async def test_async_view_streams_from_an_async_iterator(self):
+        headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+        with StubLLMServer(reply=self.plan_reply, chunk_size=7) as stub, \
+                override_settings(GEMMA_BASE_URL=stub.base_url):
+            await sync_to_async(gemma_client.close_client)()
+            try:
+                response = await self.async_client.post(
+                    f'/planner/async/generate-daily-plan/{self.goal.id}/stream/', headers=headers
+                )
+                self.assertTrue(response.is_async)
+                events = parse_events(b"".join([part async for part in response.streaming_content]))
+            finally:
+                await sync_to_async(gemma_client.close_client)()
+        self.assertEqual([event for event, _ in events], ['plan', 'activity', 'activity', 'done'])
+        job = await PlanGenerationJob.objects.aget(goal=self.goal)
+        self.assertEqual(job.status, 'Succeeded')
+
+    def test_garbage_stream_falls_back_to_the_local_scheduler(self):
+        fallbacks = REGISTRY.get_sample_value('gemma_fallbacks_total', {'operation': 'plan'}) or 0
+        events = self.stream("I can't help with that.")
+        self.assertEqual([events[0][0], events[-1][0]], ['plan', 'done'])
+        self.assertEqual(REGISTRY.get_sample_value('gemma_fallbacks_total', {'operation': 'plan'}), fallbacks + 1)
+
+
+class AdminActivityActionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='planner-user', password='password')
+        self.goal = Goal.objects.create(
+            user=self.user, goal_name='Learn chess', goal_description='Play every day.',
+            goal_start_date=date(2024, 1, 1), goal_end_date=date(2024, 1, 20),
+        )
+        self.plan = generate_plan_once(self.goal, date(2024, 1, 2), fast=True)
+        admin_user = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(admin_user)
+
+    def test_mark_completed_updates_counters_rollup_and_etag(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        etag = api.get('/planner/goals/')['ETag']
+
+        ids = list(self.plan.activities.values_list('id', flat=True))
+        response = self.client.post(
+            '/admin/planner_app/dailyplanactivity/', {'action': 'mark_completed', '_selected_action': ids}
+        )
+        self.assertEqual(response.status_code, 302)
+
+        self.plan.refresh_from_db()
+        self.goal.refresh_from_db()
+        self.assertEqual((self.plan.completed_activities, self.plan.status), (len(ids), 'Completed'))
+        self.assertEqual((self.goal.completed_activities, self.goal.completed_days), (len(ids), 1))
+        self.assertEqual(DailyProgress.objects.get(goal=self.goal, date=date(2024, 1, 2)).completed_activities, len(ids))
+        self.assertEqual(rebuild_counters(fix=False), (0, 0))
+        self.assertEqual(api.get('/planner/goals/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
@@ -1,6 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DailyRoutineViewSet, GoalViewSet,GenerateDailyPlanAPIView, RecentGoalView, DailyPlanActivityViewSet
+from .views import DailyRoutineViewSet, GoalViewSet,GenerateDailyPlanAPIView, RecentGoalView, DailyPlanActivityViewSet, \
+    PlanGenerationJobStatusView, GenerateDailyPlanStreamView, ProgressAnalyticsView, \
+    PlanCalendarView, ProfilingAggregatesView
+from .async_views import AsyncGenerateDailyPlanStreamView, AsyncGenerateDailyPlanView, AsyncGoalCreateView
 
 
 router = DefaultRouter()
@@ -11,6 +14,18 @@ router.register('daily-plan-activities-update', DailyPlanActivityViewSet, basena
 urlpatterns = [
     path('', include(router.urls)),  # Include router URLs
     path('generate-daily-plan/<int:goal_id>/', GenerateDailyPlanAPIView.as_view(), name='generate_daily_plan'),
+    path('generate-daily-plan/<int:goal_id>/stream/', GenerateDailyPlanStreamView.as_view(),
+         name='generate_daily_plan_stream'),
+    path('generate-daily-plan/jobs/<int:job_id>/', PlanGenerationJobStatusView.as_view(), name='generate_daily_plan_job'),
     path('goals/recent/for-user/', RecentGoalView.as_view(), name='recent-goal'),
+    path('analytics/', ProgressAnalyticsView.as_view(), name='progress-analytics'),
+    path('calendar/', PlanCalendarView.as_view(), name='plan-calendar'),
+    path('profiling/', ProfilingAggregatesView.as_view(), name='profiling-aggregates'),
+    # Native async variants, for the ASGI application
+    path('async/goals/', AsyncGoalCreateView.as_view(), name='async-goal-create'),
+    path('async/generate-daily-plan/<int:goal_id>/', AsyncGenerateDailyPlanView.as_view(),
+         name='async_generate_daily_plan'),
+    path('async/generate-daily-plan/<int:goal_id>/stream/', AsyncGenerateDailyPlanStreamView.as_view(),
+         name='async_generate_daily_plan_stream'),
 ]
 
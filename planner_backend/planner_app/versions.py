@@ -0,0 +1,34 @@
+"""
+Per-user data version stamps.
+
+Every write to a user's goals (and their plans and activities), routines or
+notifications bumps a counter in the user's DataVersion row, in the same
+transaction as the write. Reading one small row is then enough to build an
+ETag or a cache key: a conditional GET can answer 304 without touching the
+main tables, and cached payloads are invalidated in every process at once.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import DataVersion
+
+GOALS = 'goals'
+ROUTINES = 'routines'
+NOTIFICATIONS = 'notifications'
+
+
+def get_version(user_id, scope):
+    return DataVersion.objects.filter(user_id=user_id).values_list(scope, flat=True).first() or 0
+
+
+def bump_version(user_id, scope):
+    """
+    Record a change to the user's data in scope.
+    """
+    rows = DataVersion.objects.filter(user_id=user_id)
+    if rows.update(**{scope: F(scope) + 1}):
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(user_id=user_id, **{scope: 1})
+    except IntegrityError:
+        rows.update(**{scope: F(scope) + 1})  # Created concurrently
@@ -1,26 +1,44 @@
-import re
-import json
 from rest_framework import viewsets
 from rest_framework.viewsets import ModelViewSet
 from .serializers import *
-from rest_framework.permissions import IsAuthenticated
-from datetime import datetime
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.conf import settings
 from django.utils import timezone
+from datetime import datetime, timedelta
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from openai import OpenAI
-from django.conf import settings
+from rest_framework.decorators import action
+from .analytics import progress_analytics
+from .metrics import get_registry
+from .profiling import profiling_aggregates
+from .conditional import ConditionalGetMixin
+from .activity_status import ActivityNotFound, update_activity_statuses
+from .jobs import PlanGenerationInProgress, enqueue_plan_generation, generate_plan_once
+from .plan_generation import PlanGenerationError
+from .plan_streaming import format_event, stream_plan_once
+from .plan_calendar import plan_calendar
+from .pagination import OptionalCursorPagination
+from .recent_goal import get_recent_goal_payload
+from .sparse_fields import SparseFieldsetViewMixin
+from .versions import GOALS, ROUTINES
+from django.http import StreamingHttpResponse
 import logging
 
 logger = logging.getLogger(__name__)
 
+BULK_ACTIVITY_UPDATE_LIMIT = 100
+ANALYTICS_MAX_DAYS = 366
+CALENDAR_MAX_DAYS = 62
+
 
 # User Goal model
 
-class GoalViewSet(viewsets.ModelViewSet):
+class GoalViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = GoalSerializer
     permission_classes = [IsAuthenticated]  # Restrict access to authenticated users
+    pagination_class = OptionalCursorPagination
+    etag_scope = GOALS
     http_method_names = ['get', 'post']
 
     def get_queryset(self):
@@ -28,11 +46,13 @@ class GoalViewSet(viewsets.ModelViewSet):
         return Goal.objects.filter(user=self.request.user)
 
 
-class DailyRoutineViewSet(viewsets.ModelViewSet):
+class DailyRoutineViewSet(ConditionalGetMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     http_method_names = ['get', 'post']
     queryset = DailyRoutine.objects.all()
     serializer_class = DailyRoutineSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OptionalCursorPagination
+    etag_scope = ROUTINES
 
     def get_queryset(self):
         # Filter goals for the logged-in user
@@ -45,20 +65,71 @@ class DailyPlanActivityViewSet(ModelViewSet):
     permission_classes = [IsAuthenticated]
     http_method_names = ['patch']
 
+    def get_queryset(self):
+        # Only the user's own activities; the goal is loaded for cache invalidation
+        return DailyPlanActivity.objects.filter(plan__goal__user=self.request.user).select_related('plan__goal')
+
     def partial_update(self, request, *args, **kwargs):
         """Handle the PATCH request to update the status"""
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Goes through the bulk path so the plan and goal counters follow
+            new_status = serializer.validated_data.get('status', instance.status)
+            update_activity_statuses(request.user, [{'id': instance.id, 'status': new_status}])
+            return Response({"id": instance.id, "status": new_status}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['patch'], url_path='bulk')
+    def bulk_update(self, request):
+        """
+        Update the status of several activities at once. Takes a list of
+        {"id", "status"} objects and returns them with the affected plans'
+        rolled-up statuses.
+        """
+        serializer = ActivityStatusUpdateSerializer(
+            data=request.data, many=True, allow_empty=False, max_length=BULK_ACTIVITY_UPDATE_LIMIT
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            plans = update_activity_statuses(request.user, serializer.validated_data)
+        except ActivityNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({"activities": serializer.data, "plans": plans}, status=status.HTTP_200_OK)
+
+
+def check_plan_preconditions(goal, today):
+    """
+    Return the response to send instead of generating a plan for today,
+    or None if generation can go ahead.
+    """
+    # Check if a daily plan already exists for today
+    if DailyPlan.objects.filter(goal=goal, plan_date=today).exists():
+        return Response(
+            {"message": "A daily plan for this goal already exists for today."},
+            status=status.HTTP_200_OK
+        )
+
+    # Check if the goal is within the valid date range
+    if not (goal.goal_start_date <= today <= goal.goal_end_date):
+        return Response(
+            {"error": "Goal is not active on the current date."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return None
+
 
 class GenerateDailyPlanAPIView(APIView):
     """
     Endpoint to generate a daily plan and activities for a specific goal,
     only if one does not already exist for the day.
+
+    Pass ?mode=async to queue the generation in the background: the response
+    is 202 with a job id that can be polled on the job status endpoint.
+    Pass ?mode=fast to skip Gemma and build the plan with the local scheduler.
     """
 
     def post(self, request, goal_id):
@@ -66,203 +137,21 @@ class GenerateDailyPlanAPIView(APIView):
             # Fetch the goal
             goal = Goal.objects.get(id=goal_id, user=request.user)
 
-            # Check if a daily plan already exists for today
             today = timezone.now().date()
-            if DailyPlan.objects.filter(goal=goal, plan_date=today).exists():
-                return Response(
-                    {"message": "A daily plan for this goal already exists for today."},
-                    status=status.HTTP_200_OK
-                )
-
-            # Check if the goal is within the valid date range
-            if not (goal.goal_start_date <= today <= goal.goal_end_date):
-                return Response(
-                    {"error": "Goal is not active on the current date."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Determine the current day of the week
-            today_weekday_name = today.strftime('%A')  # e.g., 'Monday'
-
-            # Determine if today is a weekday or weekend
-            if today.weekday() < 5:
-                day_type = 'Weekday'
-            else:
-                day_type = 'Weekend'
+            precondition_response = check_plan_preconditions(goal, today)
+            if precondition_response:
+                return precondition_response
 
-            applicable_days = [today_weekday_name, day_type]
-
-            # Fetch user's daily routines for today
-            daily_routines = DailyRoutine.objects.filter(
-                user=request.user,
-                days_of_week__in=applicable_days
-            )
-
-            # Prepare busy times from the daily routines
-            busy_times = []
-            for routine in daily_routines:
-                busy_times.append({
-                    'activity_name': routine.activity_name,
-                    'start_time': routine.start_time.strftime('%H:%M'),
-                    'end_time': routine.end_time.strftime('%H:%M'),
-                })
-
-            # Fetch existing progress
-            daily_plans = DailyPlan.objects.filter(goal=goal, plan_date__lt=today).order_by('plan_date')
-            completed_activities_count = DailyPlanActivity.objects.filter(
-                plan__goal=goal,
-                status=True
-            ).count()
-
-            # Prepare previous plans and progress data
-            previous_plans_data = []
-            for plan in daily_plans:
-                activities = plan.activities.all()
-                activities_data = []
-                for activity in activities:
-                    activities_data.append({
-                        "activity_name": activity.activity_name,
-                        "start_time": activity.start_time.strftime("%H:%M"),
-                        "end_time": activity.end_time.strftime("%H:%M"),
-                        "status": activity.status
-                    })
-                previous_plans_data.append({
-                    "plan_date": plan.plan_date.strftime("%Y-%m-%d"),
-                    "status": plan.status,
-                    "activities": activities_data
-                })
-
-            # Prepare input for the AI model
-            input_content = (
-                f"Based on the following goal, progress, and user's busy times, generate a daily plan for today with at least 5 activities, "
-                f"scheduled outside of the user's busy times. "
-                f"Goal Name: '{goal.goal_name}'. "
-                f"Goal Description: '{goal.goal_description}'. "
-                f"Goal Start Date: {goal.goal_start_date}. "
-                f"Goal End Date: {goal.goal_end_date}. "
-                f"Completed Activities So Far: {completed_activities_count}. "
-                f"User's Busy Times Today: {json.dumps(busy_times)}. "
-                f"Previous Plans and Progress: {json.dumps(previous_plans_data)}. "
-                f"Your response must be valid JSON only, with the following structure:\n"
-                f"{{\n"
-                f"  \"notes\": \"string\",\n"
-                f"  \"activities\": [\n"
-                f"    {{\n"
-                f"      \"activity_name\": \"string\",\n"
-                f"      \"start_time\": \"HH:MM\" (24-hour format),\n"
-                f"      \"end_time\": \"HH:MM\" (24-hour format),\n"
-                f"      \"notes\": \"string\"\n"
-                f"    }},\n"
-                f"    ...\n"
-                f"  ]\n"
-                f"}}\n"
-                f"Ensure that 'start_time' and 'end_time' are valid times in 24-hour format (HH:MM). "
-                f"Ensure that none of the activities overlap with the user's busy times. "
-                f"If generating a plan for today, ensure that 'start_time' is greater than the current time ({timezone.now().strftime('%H:%M')}). "
-                f"Do not include any explanation or additional text. Only output the JSON data."
-            )
-
-            input_data = {
-                "role": "user",
-                "content": input_content
-            }
-
-            # Initialize the OpenAI client
-            client = OpenAI(
-                base_url=settings.GEMMA_BASE_URL,
-                api_key=settings.GEMMA_API_KEY
-            )
-
-            # Call the AI model with a timeout
-            completion = client.chat.completions.create(
-                model="google/gemma-2-27b-it",
-                messages=[input_data],
-                timeout=15  # Set a timeout to prevent long waits
-            )
-
-            # Get the AI response
-            response_text = completion.choices[0].message.content.strip()
-            logger.info(f"Gemma AI response: {response_text}")
-
-            # Extract JSON from response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_content = json_match.group(0)
-                daily_plan_data = json.loads(json_content)
-            else:
-                logger.error("No JSON content found in AI response.")
+            # Queue the generation and return immediately in async mode
+            if request.query_params.get('mode') == 'async':
+                job = enqueue_plan_generation(goal, today)
                 return Response(
-                    {"error": "Failed to parse AI response. Please try again later."},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {"message": "Daily plan generation queued.", "job_id": job.id, "status": job.status},
+                    status=status.HTTP_202_ACCEPTED
                 )
 
-            # Create today's daily plan
-            daily_plan = DailyPlan.objects.create(
-                goal=goal,
-                plan_date=today,
-                status='Pending',
-                notes=daily_plan_data.get("notes", "")
-            )
-
-            # Prepare activity instances for bulk creation
-            activities = daily_plan_data.get("activities", [])
-            activity_instances = []
-            time_format = "%H:%M"
-            current_time = timezone.now().time()
-            for activity in activities:
-                try:
-                    # Parse and validate start_time and end_time
-                    start_time_str = activity["start_time"]
-                    end_time_str = activity["end_time"]
-                    start_time_obj = datetime.strptime(start_time_str, time_format).time()
-                    end_time_obj = datetime.strptime(end_time_str, time_format).time()
-
-                    # Ensure start_time is before end_time
-                    if start_time_obj >= end_time_obj:
-                        logger.error(
-                            f"Start time {start_time_obj} is not before end time {end_time_obj} in activity '{activity['activity_name']}'")
-                        continue  # Skip invalid activity
-
-                    # If plan date is today, ensure start_time is after current time
-                    if daily_plan.plan_date == today and start_time_obj <= current_time:
-                        logger.error(
-                            f"Start time {start_time_obj} is not after current time {current_time} in activity '{activity['activity_name']}'")
-                        continue  # Skip activity that has already passed
-
-                    # Check for overlaps with user's busy times
-                    overlap = False
-                    for busy_time in busy_times:
-                        busy_start = datetime.strptime(busy_time['start_time'], time_format).time()
-                        busy_end = datetime.strptime(busy_time['end_time'], time_format).time()
-                        if (start_time_obj < busy_end and end_time_obj > busy_start):
-                            overlap = True
-                            logger.error(
-                                f"Activity '{activity['activity_name']}' overlaps with busy time '{busy_time['activity_name']}' from {busy_start} to {busy_end}")
-                            break
-                    if overlap:
-                        continue  # Skip activities that overlap with busy times
-
-                    activity_instances.append(DailyPlanActivity(
-                        plan=daily_plan,
-                        activity_name=activity["activity_name"],
-                        start_time=start_time_obj,
-                        end_time=end_time_obj,
-                        notes=activity.get("notes", ""),
-                        status=False
-                    ))
-                except (KeyError, ValueError) as e:
-                    logger.error(f"Error parsing activity data: {e}")
-                    continue  # Skip invalid activity
-
-            if not activity_instances:
-                logger.error("No valid activities to create.")
-                return Response(
-                    {"error": "No valid activities were generated. Please try again later."},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-            # Bulk create activities
-            DailyPlanActivity.objects.bulk_create(activity_instances)
+            # Concurrent requests for the same goal and day share one generation
+            daily_plan = generate_plan_once(goal, today, fast=request.query_params.get('mode') == 'fast')
 
             return Response(
                 {"message": "Daily plan and activities created successfully.", "plan_id": daily_plan.id},
@@ -275,11 +164,15 @@ class GenerateDailyPlanAPIView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON response from AI: {e}")
-            logger.error(f"AI response was: {response_text}")
+        except PlanGenerationInProgress as e:
+            return Response(
+                {"message": str(e), "job_id": e.job.id, "status": e.job.status},
+                status=status.HTTP_202_ACCEPTED
+            )
+
+        except PlanGenerationError as e:
             return Response(
-                {"error": "Failed to parse AI response. Please try again later."},
+                {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
@@ -291,9 +184,60 @@ class GenerateDailyPlanAPIView(APIView):
             )
 
 
+class GenerateDailyPlanStreamView(APIView):
+    """
+    Streaming variant of the daily plan endpoint. Activities are validated,
+    saved and pushed to the client as server-sent events as soon as Gemma
+    has produced each one ('plan', 'activity', then 'done' or 'error'; 'reset'
+    drops the activities sent so far when Gemma fails mid-stream and the local
+    scheduler's plan follows). A concurrent request for the same goal waits and
+    receives the same plan. Under ASGI use the async variant, as the ASGI
+    handler buffers this view's sync iterator.
+    """
+
+    def post(self, request, goal_id):
+        try:
+            goal = Goal.objects.get(id=goal_id, user=request.user)
+        except Goal.DoesNotExist:
+            return Response(
+                {"error": "Goal not found or not accessible."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        today = timezone.now().date()
+        precondition_response = check_plan_preconditions(goal, today)
+        if precondition_response:
+            return precondition_response
+
+        events = (format_event(event, data) for event, data in stream_plan_once(goal, today))
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+        return response
+
+
+class PlanGenerationJobStatusView(APIView):
+    """
+    Status of a background daily plan generation job. Once the job has
+    succeeded the response carries the generated plan_id.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = PlanGenerationJob.objects.get(id=job_id, goal__user=request.user)
+        except PlanGenerationJob.DoesNotExist:
+            return Response(
+                {"error": "Job not found or not accessible."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(PlanGenerationJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
 # ------------------------ Get the Goal For the current active goal ------------------------
-class RecentGoalView(APIView):
+class RecentGoalView(ConditionalGetMixin, APIView):
     permission_classes = [IsAuthenticated]
+    etag_scope = GOALS
 
     def get(self, request, *args, **kwargs):
         """
@@ -306,16 +250,104 @@ class RecentGoalView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED,
             )
 
-        recent_goal = Goal.objects.filter(
-            user=user,
-            status__in=['Pending', 'In Progress']
-        ).order_by('-id').first()
+        payload = get_recent_goal_payload(user.id, version=self.data_version)
 
-        if not recent_goal:
+        if payload is None:
             return Response(
                 {"detail": "No recent goal found with status 'Pending' or 'In Progress'."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        serializer = RecentGoalSerializer(recent_goal)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(payload, status=status.HTTP_200_OK)
+
+
+def parse_date_range(params, default_days, max_days):
+    """
+    Read the from/to (YYYY-MM-DD) query parameters. Returns (start, end, None),
+    or (None, None, response) with the error to send. By default the range
+    is the default_days days up to today.
+    """
+    try:
+        end = datetime.strptime(params['to'], '%Y-%m-%d').date() if 'to' in params else timezone.now().date()
+        start = (
+            datetime.strptime(params['from'], '%Y-%m-%d').date() if 'from' in params
+            else end - timedelta(days=default_days - 1)
+        )
+    except ValueError:
+        return None, None, Response(
+            {"error": "from and to must be in YYYY-MM-DD format."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if start > end or (end - start).days >= max_days:
+        return None, None, Response(
+            {"error": f"from must not be after to, and the range cannot exceed {max_days} days."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return start, end, None
+
+
+class ProgressAnalyticsView(ConditionalGetMixin, APIView):
+    """
+    Progress charts for the user's goals: per-day completion, streaks and the
+    average number of completed activities per weekday, from the daily
+    progress rollup. Query parameters: from and to (YYYY-MM-DD, default the
+    last 30 days) and optionally goal.
+    """
+    permission_classes = [IsAuthenticated]
+    etag_scope = GOALS
+
+    def get(self, request):
+        params = request.query_params
+        start, end, error_response = parse_date_range(params, default_days=30, max_days=ANALYTICS_MAX_DAYS)
+        if error_response:
+            return error_response
+
+        goal_id = params.get('goal')
+        if goal_id is not None:
+            if not goal_id.isdigit() or not Goal.objects.filter(id=goal_id, user=request.user).exists():
+                return Response(
+                    {"error": "Goal not found or not accessible."},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            goal_id = int(goal_id)
+
+        return Response(progress_analytics(request.user.id, start, end, goal_id), status=status.HTTP_200_OK)
+
+
+class PlanCalendarView(ConditionalGetMixin, APIView):
+    """
+    Plans and activities of the user's goals between from and to
+    (YYYY-MM-DD, default the last 31 days, at most CALENDAR_MAX_DAYS), in
+    exactly two queries. Pass goal to limit the calendar to one goal.
+    """
+    permission_classes = [IsAuthenticated]
+    etag_scope = GOALS
+
+    def get(self, request):
+        params = request.query_params
+        start, end, error_response = parse_date_range(params, default_days=31, max_days=CALENDAR_MAX_DAYS)
+        if error_response:
+            return error_response
+
+        goal_id = params.get('goal')
+        if goal_id is not None and not goal_id.isdigit():
+            return Response({"error": "goal must be a goal id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        plans = plan_calendar(request.user.id, start, end, int(goal_id) if goal_id else None)
+        return Response({"from": start, "to": end, "plans": plans}, status=status.HTTP_200_OK)
+
+
+class ProfilingAggregatesView(APIView):
+    """
+    Per-view averages of the requests sampled by the profiling middleware
+    (SQL queries and time, serializer, LLM and wall time), slowest total
+    wall time first. Staff only.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {"sample_rate": settings.PROFILING_SAMPLE_RATE, "views": profiling_aggregates(get_registry())},
+            status=status.HTTP_200_OK
+        )
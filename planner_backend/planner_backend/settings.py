@@ -17,9 +17,97 @@ DEBUG = True
 
 GEMMA_API_KEY = config('GEMMA_API_KEY')
 GEMMA_BASE_URL = config('GEMMA_BASE_URL')
+GEMMA_MODEL = config('GEMMA_MODEL', default='google/gemma-2-27b-it')
+
+# Shared Gemma client connection pool and timeouts (seconds)
+GEMMA_MAX_CONNECTIONS = config('GEMMA_MAX_CONNECTIONS', default=20, cast=int)
+GEMMA_MAX_KEEPALIVE_CONNECTIONS = config('GEMMA_MAX_KEEPALIVE_CONNECTIONS', default=10, cast=int)
+GEMMA_KEEPALIVE_EXPIRY = config('GEMMA_KEEPALIVE_EXPIRY', default=30.0, cast=float)
+GEMMA_CONNECT_TIMEOUT = config('GEMMA_CONNECT_TIMEOUT', default=5.0, cast=float)
+GEMMA_TIMEOUT = config('GEMMA_TIMEOUT', default=30.0, cast=float)
+GEMMA_PLAN_TIMEOUT = config('GEMMA_PLAN_TIMEOUT', default=15.0, cast=float)
+
+# Gemma call resilience: retries with jittered backoff within a shared budget (a call earns
+# GEMMA_RETRY_BUDGET_RATIO retries), optional hedging after the given latency percentile
+# of recent calls (0 disables it) and a circuit breaker that fails fast to the fallbacks
+GEMMA_MAX_RETRIES = config('GEMMA_MAX_RETRIES', default=2, cast=int)
+GEMMA_RETRY_BACKOFF_BASE = config('GEMMA_RETRY_BACKOFF_BASE', default=0.2, cast=float)
+GEMMA_RETRY_BACKOFF_CAP = config('GEMMA_RETRY_BACKOFF_CAP', default=2.0, cast=float)
+GEMMA_RETRY_BUDGET_RATIO = config('GEMMA_RETRY_BUDGET_RATIO', default=0.1, cast=float)
+GEMMA_RETRY_BUDGET_MAX_TOKENS = config('GEMMA_RETRY_BUDGET_MAX_TOKENS', default=10, cast=int)
+GEMMA_HEDGE_PERCENTILE = config('GEMMA_HEDGE_PERCENTILE', default=0.0, cast=float)
+GEMMA_HEDGE_MIN_SAMPLES = config('GEMMA_HEDGE_MIN_SAMPLES', default=50, cast=int)
+GEMMA_LATENCY_WINDOW = config('GEMMA_LATENCY_WINDOW', default=500, cast=int)
+GEMMA_BREAKER_FAILURE_THRESHOLD = config('GEMMA_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+GEMMA_BREAKER_RESET_TIMEOUT = config('GEMMA_BREAKER_RESET_TIMEOUT', default=30.0, cast=float)
+
+# Async Gemma client pool (async views keep many calls in flight per worker)
+GEMMA_ASYNC_MAX_CONNECTIONS = config('GEMMA_ASYNC_MAX_CONNECTIONS', default=500, cast=int)
+GEMMA_ASYNC_MAX_KEEPALIVE_CONNECTIONS = config('GEMMA_ASYNC_MAX_KEEPALIVE_CONNECTIONS', default=100, cast=int)
+
+# Concurrent Gemma calls (goal creation runs feasibility and notes side by side)
+GEMMA_EXECUTOR_WORKERS = config('GEMMA_EXECUTOR_WORKERS', default=10, cast=int)
+GEMMA_GOAL_ENRICHMENT_DEADLINE = config('GEMMA_GOAL_ENRICHMENT_DEADLINE', default=15.0, cast=float)
+
+# Rolling per-goal progress summary used in the plan prompt
+PROGRESS_SUMMARY_RECENT_DAYS = config('PROGRESS_SUMMARY_RECENT_DAYS', default=7, cast=int)
+PROGRESS_SUMMARY_MAX_ACTIVITIES = config('PROGRESS_SUMMARY_MAX_ACTIVITIES', default=50, cast=int)
+
+# Cached per-user, per-day busy-time index (seconds)
+BUSY_INDEX_CACHE_TTL = config('BUSY_INDEX_CACHE_TTL', default=300, cast=int)
+
+# Local scheduler: fallback when Gemma fails, and ?mode=fast plans (hours are 0-23)
+PLAN_LOCAL_FALLBACK = config('PLAN_LOCAL_FALLBACK', default=True, cast=bool)
+LOCAL_SCHEDULER_DAY_START = config('LOCAL_SCHEDULER_DAY_START', default=7, cast=int)
+LOCAL_SCHEDULER_DAY_END = config('LOCAL_SCHEDULER_DAY_END', default=22, cast=int)
+LOCAL_SCHEDULER_GAP_MINUTES = config('LOCAL_SCHEDULER_GAP_MINUTES', default=15, cast=int)
+LOCAL_SCHEDULER_MIN_ACTIVITIES = config('LOCAL_SCHEDULER_MIN_ACTIVITIES', default=5, cast=int)
+LOCAL_SCHEDULER_MAX_ACTIVITIES = config('LOCAL_SCHEDULER_MAX_ACTIVITIES', default=6, cast=int)
+LOCAL_SCHEDULER_HISTORY = config('LOCAL_SCHEDULER_HISTORY', default=60, cast=int)
+
+# Home screen (RecentGoalView) payload cache, keyed by the user's goals version stamp
+RECENT_GOAL_CACHE_TTL = config('RECENT_GOAL_CACHE_TTL', default=60, cast=int)
+
+# Background daily plan generation (python manage.py process_plan_jobs)
+PLAN_JOB_WORKERS = config('PLAN_JOB_WORKERS', default=4, cast=int)
+PLAN_JOB_POLL_INTERVAL = config('PLAN_JOB_POLL_INTERVAL', default=1.0, cast=float)
+PLAN_JOB_STALE_AFTER = config('PLAN_JOB_STALE_AFTER', default=300, cast=int)
+PLAN_JOB_MAX_ATTEMPTS = config('PLAN_JOB_MAX_ATTEMPTS', default=3, cast=int)
+PLAN_PREGENERATION_WINDOW_HOURS = config('PLAN_PREGENERATION_WINDOW_HOURS', default=5.0, cast=float)
+
+# Single-flight plan generation: how long concurrent requests wait for the first one
+PLAN_SINGLE_FLIGHT_WAIT = config('PLAN_SINGLE_FLIGHT_WAIT', default=30.0, cast=float)
+PLAN_SINGLE_FLIGHT_POLL_INTERVAL = config('PLAN_SINGLE_FLIGHT_POLL_INTERVAL', default=0.25, cast=float)
+
+# Pre-generated motivational quote pool (python manage.py refill_quote_pool)
+QUOTE_POOL_SIZE = config('QUOTE_POOL_SIZE', default=100, cast=int)
+QUOTE_POOL_LOW_WATER = config('QUOTE_POOL_LOW_WATER', default=20, cast=int)
+QUOTE_POOL_BATCH_SIZE = config('QUOTE_POOL_BATCH_SIZE', default=25, cast=int)
+QUOTE_POOL_MAX_BATCHES = config('QUOTE_POOL_MAX_BATCHES', default=5, cast=int)
+# Refill the pool in the background when it runs low (off during tests, see planner_backend.test_runner)
+QUOTE_POOL_BACKGROUND_REFILL = config('QUOTE_POOL_BACKGROUND_REFILL', default=True, cast=bool)
+
+# Prometheus scrape endpoint (/metrics); scrapers must send "Authorization: Bearer <token>".
+# Left empty, the endpoint is only open to staff users logged in to the admin.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Sampled request profiling (planner_app.profiling); sampled requests slower than
+# PROFILING_SLOW_REQUEST_MS are logged with their PROFILING_SLOW_QUERIES_LOGGED slowest queries
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.01, cast=float)
+PROFILING_SLOW_REQUEST_MS = config('PROFILING_SLOW_REQUEST_MS', default=1000, cast=int)
+PROFILING_SLOW_QUERIES_LOGGED = config('PROFILING_SLOW_QUERIES_LOGGED', default=5, cast=int)
+
+# Notification stream (accounts/notifications/stream/, served by the ASGI application)
+NOTIFICATION_STREAM_POLL_INTERVAL = config('NOTIFICATION_STREAM_POLL_INTERVAL', default=2.0, cast=float)
+NOTIFICATION_STREAM_HEARTBEAT = config('NOTIFICATION_STREAM_HEARTBEAT', default=15.0, cast=float)
+NOTIFICATION_STREAM_MAX_DURATION = config('NOTIFICATION_STREAM_MAX_DURATION', default=300.0, cast=float)
+NOTIFICATION_STREAM_RETRY_MS = config('NOTIFICATION_STREAM_RETRY_MS', default=3000, cast=int)
 
 ALLOWED_HOSTS = ['*']
 
+# Keeps background Gemma calls out of the test run
+TEST_RUNNER = 'planner_backend.test_runner.PlannerTestRunner'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -81,6 +169,7 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 MIDDLEWARE = [
+    'planner_app.profiling.RequestProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -125,6 +214,26 @@ DATABASES = {
     }
 }
 
+# Cache
+# The 'gemma' cache holds responses for prompts that depend only on their text.
+# LocMem evicts least-recently-used entries once MAX_ENTRIES is reached.
+
+CACHES = {
+    'default': {
+        # Use a shared backend (e.g. Redis) with several workers so invalidations reach every process
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    },
+    'gemma': {
+        'BACKEND': config('GEMMA_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('GEMMA_CACHE_LOCATION', default='gemma-responses'),
+        'TIMEOUT': config('GEMMA_CACHE_TTL', default=86400, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('GEMMA_CACHE_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+}
+
 # Password validation
 
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class PlannerTestRunner(DiscoverRunner):
+    """
+    Test runner that keeps plan creation from refilling the motivational
+    quote pool in the background, which would call Gemma from executor
+    threads while other tests run. Tests of the refill turn it back on with
+    override_settings.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUOTE_POOL_BACKGROUND_REFILL = False
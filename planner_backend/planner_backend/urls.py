@@ -5,6 +5,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from accounts.views import CustomTokenObtainPairView
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
+from planner_app.metrics import metrics_view
 
 
 schema_view = get_schema_view(
@@ -34,6 +35,9 @@ urlpatterns = [
     # Accounts APIs
     path('accounts/', include('accounts.urls')),
 
+    # Prometheus metrics
+    path('metrics', metrics_view, name='metrics'),
+
     # Swagger and ReDoc URLs
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),